@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+admission.py
+
+Admission control for the webhook. Each worker tracks its in-flight requests
+and an EWMA of their latency. The concurrency limit is max_in_flight while the
+EWMA stays under max_latency_ms, and shrinks in proportion when it goes above
+(never below one request, so latency keeps being measured and the limit comes
+back up once Mongo / the Graph API recover).
+
+A request over the limit is shed, depending on the mode (the reply and spill
+modes still do I/O: at most max_shedding shed requests at once do it, the others
+get the retry answer):
+
+    reply   send a canned reply straight through the Send API, no DB access
+    spill   persist the events with spill_to (app.py: the partition event queue,
+            handled by the partitioning.py consumers), 503 + Retry-After if that fails
+    retry   answer 503 + Retry-After so Facebook redelivers later
+
+Spilled events are never only in memory: a worker restarting (deploy, dyno
+cycling) would lose events Facebook was told were received.
+"""
+
+import threading
+import collections
+
+REPLY = "reply"
+SPILL = "spill"
+RETRY = "retry"
+MODES = (REPLY, SPILL, RETRY)
+
+
+class AdmissionController:
+
+    def __init__(self, max_in_flight=16, max_latency_ms=2000, mode=RETRY, spill_to=None, max_shedding=4, alpha=0.2):
+        """
+            :param max_in_flight: concurrent requests per worker, 0 disables admission control
+            :param spill_to: function(items, deadline) persisting shed work, rtype: True once stored;
+                needed by the spill mode
+            :param max_shedding: shed requests replying / spilling at once
+            :param alpha: weight of the latest request in the latency EWMA
+        """
+        if mode not in MODES:
+            raise ValueError("admission mode must be one of %s, not %r" % (", ".join(MODES), mode))
+        if mode == SPILL and spill_to is None:
+            raise ValueError("the spill admission mode needs somewhere to spill to")
+        self.max_in_flight = max_in_flight
+        self.max_latency_ms = max_latency_ms
+        self.mode = mode
+        self.spill_to = spill_to
+        self.alpha = alpha
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.latency_ms = 0.0
+        self.admitted = 0
+        self.shed = collections.Counter()
+        self.spilled = 0
+        self.spill_failed = 0
+        self.shedding = threading.BoundedSemaphore(max_shedding)
+        self.shed_overflow = 0
+
+    def limit(self):
+        # called with the lock held
+        if self.latency_ms <= self.max_latency_ms:
+            return self.max_in_flight
+        return max(1, int(self.max_in_flight * self.max_latency_ms / self.latency_ms))
+
+    def enter(self):
+        """ rtype: True if the request is admitted, leave() must then be called
+        """
+        if not self.max_in_flight:
+            return True
+        with self.lock:
+            if self.in_flight >= self.limit():
+                self.shed[self.mode] += 1
+                return False
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+
+    def leave(self, seconds):
+        if not self.max_in_flight:
+            return
+        with self.lock:
+            self.in_flight -= 1
+            self.latency_ms += self.alpha * (seconds * 1000 - self.latency_ms)
+
+    def begin_shed(self):
+        """ Never blocks
+            rtype: True if this shed request may reply / spill, end_shed() must then be called
+        """
+        if self.shedding.acquire(False):
+            return True
+        with self.lock:
+            self.shed_overflow += 1
+        return False
+
+    def end_shed(self):
+        self.shedding.release()
+
+    def spill(self, items, deadline=None):
+        """ Persist shed work for later, through spill_to
+            rtype: False when it couldn't be stored: answer 503 so that it is redelivered
+        """
+        stored = bool(self.spill_to(items, deadline))
+        with self.lock:
+            if stored:
+                self.spilled += len(items)
+            else:
+                self.spill_failed += len(items)
+        return stored
+
+    def stats(self):
+        with self.lock:
+            return {
+                "mode": self.mode,
+                "in_flight": self.in_flight,
+                "limit": self.limit() if self.max_in_flight else None,
+                "latency_ewma_ms": round(self.latency_ms, 1),
+                "admitted": self.admitted,
+                "shed": dict(self.shed),
+                "spilled": self.spilled,
+                "spill_failed": self.spill_failed,
+                "shed_overflow": self.shed_overflow,
+            }
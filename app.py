@@ -1,20 +1,171 @@
 import os
 import sys
+import hmac
 import json
+import hashlib
+import functools
 import datetime
-import requests
 import re
-from flask import Flask, request
-from flask_pymongo import PyMongo
+import time
+from flask import request
 from common.log_util import log
+from common.profiling import profiler, HEADER as PROFILE_HEADER
+from common.deadline import Deadline, DeadlineExceeded
+from common.circuit_breaker import CircuitBreaker, CircuitOpenError, breaker_stats
+from db.connection import init_mongo, ping_all
+from extractor import Extractor
 from message_dispatcher import MessageDispatcher
-# Create the Flask app
-app = Flask(__name__)
-app.config.from_object('configuration.Config')
-if isinstance(app.config['MGDB_PREFIX'], str):
-    app.mongo = PyMongo(app, config_prefix=app.config['MGDB_PREFIX'])
+from messages import from_messaging_event, TextMessage
+# the Flask app and its config (with the databases of PAGES_FILE)
+from application import app, pages_config
+from pages import PageRegistry
+# Mongo clients are created per process by start_worker() below
 
-dispatcher = MessageDispatcher()
+from warmup import WarmUp
+warm_up = WarmUp(retry_base_seconds=app.config['WARMUP_RETRY_BASE_SECONDS'],
+                 retry_max_seconds=app.config['WARMUP_RETRY_MAX_SECONDS'])
+
+from sender import MessageSender
+from outbox import Outbox
+from db.mongo import UNAVAILABLE
+from db.contacts import ContactsCollection
+from db.contact_stats import mongo_contact_stats, contact_stats, day_of
+from db.locations import LocationsCollection
+
+# one breaker for the Graph API, shared by the pages' senders
+graph_api_breaker = CircuitBreaker("graph_api",
+                                   failure_threshold=app.config['BREAKER_FAILURE_THRESHOLD'],
+                                   reset_seconds=app.config['BREAKER_RESET_SECONDS'])
+
+
+def make_sender(page_id, access_token):
+    return MessageSender(url=app.config['GRAPH_API_URL'],
+                         pool_size=app.config['GRAPH_API_POOL_SIZE'],
+                         timeout=app.config['GRAPH_API_TIMEOUT_SECONDS'],
+                         breaker=graph_api_breaker,
+                         access_token=access_token)
+
+
+def make_dispatcher(tasks_config_file, mongodb):
+    return MessageDispatcher(tasks_config_file, stats=contact_stats, mongodb=mongodb)
+
+# handler modules listed in each page's tasks file are imported and instantiated here
+started = time.time()
+pages = PageRegistry(pages_config, make_sender, make_dispatcher)
+warm_up.record("handlers", time.time() - started)
+# the first page's dispatcher, for callers that don't route by page
+dispatcher = pages.all()[0].dispatcher
+
+outbox = Outbox(pages.all()[0].sender,
+                max_attempts=app.config['OUTBOX_MAX_ATTEMPTS'],
+                retry_base_seconds=app.config['OUTBOX_RETRY_BASE_SECONDS'],
+                lease_seconds=app.config['OUTBOX_LEASE_SECONDS'],
+                senders=pages.senders(),
+                retention_days=app.config['OUTBOX_RETENTION_DAYS'])
+
+from attachments import AttachmentPipeline
+from event_archive import ArchiveWriter
+from admission import AdmissionController, REPLY, SPILL
+
+
+def on_attachment_text(message, attachment, text):
+    if event_queue is not None:
+        # partitioned: the sender's partition consumer handles it, in order with their other messages
+        text_message = TextMessage(message.sender_id, text, message_id=message.message_id,
+                                   page_id=message.page_id, timestamp=message.timestamp)
+        document = text_message.to_document()
+        # already counted as a message when the attachments came in
+        document["attachment_text"] = True
+        event_queue.enqueue(message.sender_id, document,
+                            deadline=Deadline(app.config['WEBHOOK_DEADLINE_SECONDS']))
+        return
+    reply = pages.get(message.page_id).dispatcher.process_attachment_text(message, attachment, text)
+    send_message(message.sender_id, reply, page_id=message.page_id)
+
+archive = None
+
+event_queue = None
+spill_queue = None
+if app.config['PROCESSING_MODE'] == "partitioned" or app.config['ADMISSION_MODE'] == SPILL:
+    from partitioning import EventQueue
+    # spilled events are handled by the partition consumers (partitioning.py), like partitioned ones
+    spill_queue = EventQueue(partition_count=app.config['PARTITION_COUNT'])
+    if app.config['PROCESSING_MODE'] == "partitioned":
+        event_queue = spill_queue
+
+
+def spill_events(messages, deadline=None):
+    """ Shed events go to the partition event queue, so a restart doesn't lose them
+        rtype: False if they couldn't all be stored: Facebook redelivers them after a 503
+    """
+    try:
+        for message in messages:
+            spill_queue.enqueue(message.sender_id, message.to_document(), deadline=deadline)
+        return True
+    except (DeadlineExceeded, CircuitOpenError) + UNAVAILABLE as e:
+        log("can't spill %d events: %r" % (len(messages), e))
+        return False
+
+admission = AdmissionController(max_in_flight=app.config['ADMISSION_MAX_IN_FLIGHT'],
+                                max_latency_ms=app.config['ADMISSION_MAX_LATENCY_MS'],
+                                mode=app.config['ADMISSION_MODE'],
+                                spill_to=spill_events if spill_queue is not None else None,
+                                max_shedding=app.config['ADMISSION_MAX_SHEDDING'])
+
+
+def ensure_indexes():
+    outbox.ensure_indexes()
+    mongo_contact_stats.ensure_indexes()
+    for mongodb in pages.databases():
+        ContactsCollection(mongodb=mongodb, collection="contacts").ensure_indexes()
+        LocationsCollection(mongodb=mongodb, collection="locations").ensure_indexes()
+    if spill_queue is not None:
+        spill_queue.ensure_indexes()
+
+
+def warm_up_extractor():
+    Extractor().extract_contact("warm.up@example.com 0988 123 456")
+
+def warm_up_senders():
+    for page in pages.all():
+        page.sender.warm_up()
+
+worker_pid = None
+
+
+def start_worker():
+    """ Per-process state: Mongo clients, the Send API pool, the attachment pools, the archive
+        writer and the warm-up thread. Sockets, threads and process pools don't survive a fork,
+        so with gunicorn --preload this runs in each worker after fork (gunicorn.conf.py).
+    """
+    global worker_pid, archive
+    if worker_pid == os.getpid():
+        return
+    worker_pid = os.getpid()
+    init_mongo(app)
+    for page in pages.all():
+        page.sender.reset()
+    attachment_pipeline = AttachmentPipeline(on_attachment_text,
+                                             max_workers=app.config['ATTACHMENT_WORKERS'],
+                                             max_queued=app.config['ATTACHMENT_MAX_QUEUED'],
+                                             max_bytes=app.config['ATTACHMENT_MAX_BYTES'],
+                                             timeout_seconds=app.config['ATTACHMENT_TIMEOUT_SECONDS'])
+    for page_dispatcher in pages.dispatchers():
+        page_dispatcher.attachment_pipeline = attachment_pipeline
+    if app.config['ARCHIVE_DIR']:
+        # segment files are per pid, each worker appends to its own
+        archive = ArchiveWriter(app.config['ARCHIVE_DIR'],
+                                block_bytes=app.config['ARCHIVE_BLOCK_BYTES'],
+                                segment_bytes=app.config['ARCHIVE_SEGMENT_BYTES'],
+                                max_bytes=app.config['ARCHIVE_MAX_BYTES'],
+                                max_segments=app.config['ARCHIVE_MAX_SEGMENTS'])
+    warm_up.start([
+        ("mongo", lambda: ping_all(app), True),
+        ("indexes", ensure_indexes, True),
+        ("extractor", warm_up_extractor, True),
+        # replies are kept in the outbox if the Graph API can't be reached yet
+        ("graph_api", warm_up_senders, False),
+    ])
 
 @app.route('/', methods=['GET'])
 def verify():
@@ -29,89 +180,160 @@ def verify():
     return msg, 200
 
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    # readiness check: 503 until this worker's warm-up has run
+    report = warm_up.report()
+    return json.dumps(report), 200 if report["ready"] else 503, {"Content-Type": "application/json"}
+
+
+def signed(view):
+    """ Internal endpoints: only requests carrying a valid signed X-Profile-Request header
+        (PROFILE_SECRET, see common/profiling.py) get through
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not profiler.signature_valid(request.headers.get(PROFILE_HEADER)):
+            return "Forbidden", 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@app.route('/stats', methods=['GET'])
+@signed
+def stats():
+    from db.mongo import pool_stats
+    body = {"mongo_pools": pool_stats(), "admission": admission.stats(), "circuit_breakers": breaker_stats()}
+    return json.dumps(body), 200, {"Content-Type": "application/json"}
+
+
+@app.route('/stats/contacts', methods=['GET'])
+@signed
+def contact_stats_report():
+    # ?from=2026-10-01&to=2026-10-19&group_by=day,page_id,country[&page_id=...][&country=VN]
+    today = day_of()
+    rows = mongo_contact_stats.report(request.args.get("from", today), request.args.get("to", today),
+                                      group_by=request.args.get("group_by", "day").split(","),
+                                      page_id=request.args.get("page_id"),
+                                      country=request.args.get("country"))
+    return json.dumps(rows), 200, {"Content-Type": "application/json"}
+
+
+def signature_valid():
+    """ Facebook signs every delivery with the app secret:
+        X-Hub-Signature-256: sha256=<hex hmac-sha256(secret, body)> (X-Hub-Signature: sha1=... before)
+    """
+    for header, algorithm in (("X-Hub-Signature-256", "sha256"), ("X-Hub-Signature", "sha1")):
+        value = request.headers.get(header)
+        if value is not None:
+            name, _, signature = value.partition("=")
+            expected = hmac.new(app.config['APP_SECRET'].encode("utf-8"), request.get_data(),
+                                getattr(hashlib, algorithm)).hexdigest()
+            return name == algorithm and hmac.compare_digest(expected, signature)
+    return False
+
+if not app.config['APP_SECRET']:
+    log("APP_SECRET isn't set: webhook signatures aren't checked")
+
+
 @app.route('/', methods=['POST'])
+@profiler.profiled("webhook", header=lambda: request.headers.get(PROFILE_HEADER))
 def webhook():
     # endpoint for processing incoming messaging events
+    if app.config['APP_SECRET'] and not signature_valid():
+        return "Invalid signature", 403
     data = request.get_json()
-    log(data)  # log all msg, ok for this chatbot
-    if data["object"] == "page":
-        for entry in data["entry"]:
-            for messaging_event in entry["messaging"]:
-                # someone sent us a message
-                if messaging_event.get("message"):
-                    sender_id = messaging_event["sender"]["id"]
-                    message_data = messaging_data(messaging_event['message'])
-                    reply = dispatcher.dispatch_and_process(sender_id, message_data)
-                    send_message(sender_id, reply)
-
-                if messaging_event.get("delivery") or \
-                    messaging_event.get("optin") or \
-                        messaging_event.get("postback"):
-                    pass
+    if archive is not None:
+        senders = [messaging_event["sender"]["id"]
+                   for entry in data.get("entry", []) for messaging_event in entry.get("messaging", [])
+                   if "sender" in messaging_event]
+        archive.append(request.get_data(), senders)
+    else:
+        log(data)  # log all msg, ok for this chatbot
+    if not admission.enter():
+        return shed(data)
+    started = time.time()
+    deadline = Deadline(app.config['WEBHOOK_DEADLINE_SECONDS'])
+    try:
+        for message in messages_of(data):
+            try:
+                handle_message(message, deadline=deadline)
+            except Exception as e:
+                # an error would make Facebook redeliver the whole batch: log it and go on
+                log("failed to handle a message from %s: %r" % (message.sender_id, e))
+    finally:
+        admission.leave(time.time() - started)
 
     return "ok", 200
 
 
-def send_message(recipient_id, message_text):
-    params = {"access_token": os.environ["PAGE_ACCESS_TOKEN"]}
-    headers = {"Content-Type": "application/json"}
-    data = json.dumps(
-        {"recipient": {"id": recipient_id},
-         "message": {"text": message_text}}
-    )
-    r = requests.post("https://graph.facebook.com/v2.6/me/messages",
-                      params=params, headers=headers, data=data)
-    if r.status_code != 200:
-        log(r.status_code)
-        log(r.text)
-
-
-def messaging_data(message_data):
-    # Text only
-    if "text" in message_data and "quick_reply" not in message_data:
-        text = message_data['text'].encode('unicode_escape')
-        data = {
-            "type": "text",
-            "data": text,
-            "messaging_id": message_data['mid']
-        }
-        return data
-    # Includes attachment(photo, audio, file, location...)
-    elif "attachments" in message_data:
-        if "location" == message_data['attachments'][0]['type']:
-            coordinates = message_data['attachments'][0]['payload']['coordinates']
-            latitude = coordinates['lat']
-            longtitude = coordinates['long']
-            data = {
-                "type": "location",
-                "data": [latitude, longtitude],
-                "message_id": message_data['mid']
-            }
-            return data
-        elif "audio" == message_data['attachments'][0]['type']:
-            audio_url = message_data['attachments'][0]['payload']['url']
-            data = {
-                "type": "audio",
-                "data": audio_url,
-                "message_id": message_data['mid']
-            }
-            return data
-        elif "photo" == message_data['attactments'][0]['type']:
-            photo_url = message_data['attachments'][0]['payload']['url']
-            data = {
-                "type": "audio",
-                "data": photo_url,
-                "message_id": message_data['mid']
-            }
-            return data
-        else:
-            data = {
-                "type": "text",
-                "data": "Sorry, I don't understand",
-                "message_id": message_data['mid']
-            }
-            return data
-    return None
+def messages_of(data):
+    if data.get("object") != "page":
+        return
+    for entry in data["entry"]:
+        for messaging_event in entry["messaging"]:
+            # someone sent us a message; delivery / optin / postback events are ignored
+            message = from_messaging_event(messaging_event, page_id=entry.get("id"))
+            if message is None:
+                continue
+            if pages.get(message.page_id) is None:
+                log("ignoring an event for page %s, not in PAGES_FILE" % message.page_id)
+                continue
+            yield message
+
+
+def handle_message(message, deadline=None):
+    try:
+        if event_queue is not None:
+            # handled by the partition worker owning this sender
+            event_queue.enqueue(message.sender_id, message.to_document(), deadline=deadline)
+            return
+        reply = pages.get(message.page_id).dispatcher.dispatch_and_process(message, deadline=deadline)
+        if reply is not None:
+            send_message(message.sender_id, reply, page_id=message.page_id, deadline=deadline)
+    except (DeadlineExceeded, CircuitOpenError) + UNAVAILABLE as e:
+        # Mongo down or too slow (handlers, event queue or outbox): fail fast with a canned reply
+        # sent straight through the Send API
+        log("falling back to the canned reply for %s: %r" % (message.sender_id, e))
+        send_canned_reply(message.sender_id, page_id=message.page_id)
+
+
+def send_canned_reply(recipient_id, page_id=None, deadline=None):
+    # straight to the Send API: no outbox, no retry
+    return outbox.sender_for(page_id).send(recipient_id, app.config['CANNED_REPLY'],
+                                           timeout=app.config['CANNED_REPLY_TIMEOUT_SECONDS'], deadline=deadline)
+
+
+def shed(data):
+    """ Over the admission limit, see admission.py. Replying or spilling still takes I/O: it
+        gets CANNED_REPLY_TIMEOUT_SECONDS in total, and a few shed requests at most at once
+    """
+    retry = "overloaded", 503, {"Retry-After": str(app.config['ADMISSION_RETRY_AFTER_SECONDS'])}
+    if admission.mode not in (REPLY, SPILL) or not admission.begin_shed():
+        return retry
+    try:
+        deadline = Deadline(app.config['CANNED_REPLY_TIMEOUT_SECONDS'])
+        if admission.mode == REPLY:
+            for message in messages_of(data):
+                send_canned_reply(message.sender_id, page_id=message.page_id, deadline=deadline)
+            return "ok", 200
+        if admission.spill(list(messages_of(data)), deadline=deadline):
+            return "ok", 200
+        return retry
+    finally:
+        admission.end_shed()
+
+
+def send_message(recipient_id, message_text, page_id=None, deadline=None):
+    # stored in the outbox first; failed sends are retried by the replay worker (outbox.py),
+    # through the page's sender
+    return outbox.deliver(recipient_id, message_text, page_id=page_id, deadline=deadline)
+
+
+# set by gunicorn.conf.py when the app is preloaded in the master: post_fork starts each worker
+if os.environ.get("START_WORKER_AFTER_FORK") != "1":
+    start_worker()
+
 
 if __name__ == '__main__':
     app.run(debug=False)
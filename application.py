@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+application.py
+
+The Flask app object and its config, without the webhook. db.* takes the config
+and the Mongo clients from here, so the worker processes and the tools
+(outbox.py, partitioning.py, tools/*) can import db.* before app.py: app.py
+imports modules that import db.*, which used to import app.py back.
+"""
+
+from flask import Flask
+from pages import load_pages_file
+
+app = Flask(__name__)
+app.config.from_object('configuration.Config')
+# the databases of PAGES_FILE become MGDB_PREFIX entries, before anything reads the prefixes
+pages_config = load_pages_file(app.config)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+attachments.py
+
+Attachment pipeline: pulls contact details out of shared photos (business cards)
+and voice notes, off the request path.
+
+Every attachment of a message is downloaded on a small thread pool, streamed to a
+temp file with a size cap, then processed (OCR, speech to text) on a bounded
+process pool. The text found goes back through the MessageDispatcher like a text
+message, and its reply is sent with on_result (app.py: in partitioned mode the text
+is enqueued in the sender's partition instead, see partitioning.py).
+
+Only https URLs on Facebook's CDN hosts are downloaded (redirects included),
+so a forged event can't make the bot fetch internal addresses. An attachment
+holds its slot until its processing is over, even after timing out: the temp
+file stays until the process pool is done with it, and processing never
+piles up beyond max_queued.
+
+OCR needs pytesseract + Pillow, speech to text needs SpeechRecognition + pydub
+(and ffmpeg). Without them those attachment types yield no text.
+"""
+
+import os
+import threading
+import tempfile
+import requests
+try:
+    from urllib.parse import urljoin, urlparse
+except ImportError:
+    from urlparse import urljoin, urlparse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from requests.adapters import HTTPAdapter
+from common.log_util import log
+
+
+# Facebook serves attachments from these domains and their subdomains
+ALLOWED_HOSTS = ("fbcdn.net", "fbsbx.com")
+MAX_REDIRECTS = 5
+
+
+class AttachmentTooLarge(Exception):
+    pass
+
+
+class AttachmentURLRefused(Exception):
+    pass
+
+
+def extract_image_text(path):
+    try:
+        from PIL import Image
+        import pytesseract
+    except ImportError:
+        return ""
+    return pytesseract.image_to_string(Image.open(path))
+
+
+def extract_audio_text(path):
+    try:
+        import speech_recognition
+        from pydub import AudioSegment
+    except ImportError:
+        return ""
+    # voice notes come as mp4/aac, the recogniser reads wav
+    wav_path = path + ".wav"
+    AudioSegment.from_file(path).export(wav_path, format="wav")
+    try:
+        recognizer = speech_recognition.Recognizer()
+        with speech_recognition.AudioFile(wav_path) as source:
+            audio = recognizer.record(source)
+        try:
+            return recognizer.recognize_google(audio)
+        except speech_recognition.UnknownValueError:
+            return ""
+    finally:
+        os.remove(wav_path)
+
+
+# attachment type -> function(path) returning the text found, run in the process pool
+PROCESSORS = {
+    "image": extract_image_text,
+    "audio": extract_audio_text,
+}
+
+
+class AttachmentPipeline:
+
+    def __init__(self, on_result, processors=None, max_workers=2, max_queued=32,
+                 max_bytes=10 * 1024 * 1024, timeout_seconds=60, allowed_hosts=ALLOWED_HOSTS, schemes=("https",)):
+        """
+            :param on_result: function(message, attachment, text) called with each attachment's text
+            :param max_workers: processes for the CPU-heavy part
+            :param max_queued: attachments in flight at once (downloading or processing), more are dropped
+            :param max_bytes: bigger downloads are aborted
+            :param allowed_hosts: domains attachments may be downloaded from, subdomains included
+            :param schemes: URL schemes allowed
+        """
+        self.on_result = on_result
+        self.processors = processors if processors is not None else PROCESSORS
+        self.max_bytes = max_bytes
+        self.timeout_seconds = timeout_seconds
+        self.allowed_hosts = tuple(allowed_hosts)
+        self.schemes = tuple(schemes)
+        self.slots = threading.BoundedSemaphore(max_queued)
+        self.download_pool = ThreadPoolExecutor(max_workers=max_workers * 2)
+        # worker processes are only started on the first submit
+        self.process_pool = ProcessPoolExecutor(max_workers=max_workers)
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=max_workers * 2))
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=max_workers * 2))
+
+    def submit(self, message):
+        """ Queue every attachment of an AttachmentMessage we have a processor for
+            rtype: number of attachments accepted
+        """
+        accepted = 0
+        for attachment in message.attachments:
+            if attachment.type not in self.processors or not attachment.url:
+                continue
+            if not self.url_allowed(attachment.url):
+                log("refusing %s attachment from %s: %s" % (attachment.type, message.sender_id, attachment.url))
+                continue
+            if not self.slots.acquire(False):
+                log("attachment pipeline full, dropping %s from %s" % (attachment.type, message.sender_id))
+                continue
+            self.download_pool.submit(self.run, message, attachment)
+            accepted += 1
+        return accepted
+
+    def url_allowed(self, url):
+        parsed = urlparse(url)
+        host = (parsed.hostname or "").lower()
+        return parsed.scheme in self.schemes and any(
+            host == allowed or host.endswith("." + allowed) for allowed in self.allowed_hosts)
+
+    def run(self, message, attachment):
+        path = None
+        future = None
+        try:
+            path = self.download(attachment.url)
+            future = self.process_pool.submit(self.processors[attachment.type], path)
+            text = future.result(timeout=self.timeout_seconds)
+            self.on_result(message, attachment, text)
+        except Exception as e:
+            log("attachment %s from %s failed: %r" % (attachment.type, message.sender_id, e))
+        finally:
+            if future is not None and not future.done() and not future.cancel():
+                # timed out while the process pool reads the file: free it once processing is over
+                future.add_done_callback(lambda done: self.release(path))
+            else:
+                self.release(path)
+
+    def release(self, path):
+        if path is not None:
+            os.remove(path)
+        self.slots.release()
+
+    def download(self, url):
+        """ Stream url to a temp file, never holding more than one chunk in memory
+            rtype: temp file path, the caller removes it
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            if not self.url_allowed(url):
+                raise AttachmentURLRefused(url)
+            # redirects are followed here, so that their targets are checked too
+            response = self.session.get(url, stream=True, timeout=self.timeout_seconds, allow_redirects=False)
+            if not response.is_redirect:
+                break
+            url = urljoin(url, response.headers["Location"])
+            response.close()
+        else:
+            raise AttachmentURLRefused("too many redirects: %s" % url)
+        try:
+            response.raise_for_status()
+            if int(response.headers.get("Content-Length") or 0) > self.max_bytes:
+                raise AttachmentTooLarge(url)
+            handle, path = tempfile.mkstemp(prefix="attachment-")
+            size = 0
+            try:
+                with os.fdopen(handle, "wb") as out:
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        size += len(chunk)
+                        if size > self.max_bytes:
+                            raise AttachmentTooLarge(url)
+                        out.write(chunk)
+            except Exception:
+                os.remove(path)
+                raise
+            return path
+        finally:
+            response.close()
+
+    def shutdown(self, wait=True):
+        self.download_pool.shutdown(wait=wait)
+        self.process_pool.shutdown(wait=wait)
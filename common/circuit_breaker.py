@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+circuit_breaker.py
+
+Circuit breaker per dependency (Mongo prefix, Graph API). After
+failure_threshold consecutive failures the breaker opens and calls fail fast
+with CircuitOpenError instead of waiting on the dependency. After
+reset_seconds one trial call is let through (half-open): success closes the
+breaker, failure opens it again.
+
+Every breaker is registered by name; GET /stats reports them all.
+"""
+
+import time
+import threading
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+BREAKERS = {}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+
+    def __init__(self, name, failure_threshold=5, reset_seconds=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.trips = 0
+        self.rejected = 0
+        BREAKERS[name] = self
+
+    def allow(self):
+        """ rtype: True if a call may go ahead, record_success / record_failure must follow
+        """
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self.trial_running:
+                self.trial_running = True
+                return True
+            self.rejected += 1
+            return False
+
+    def check(self):
+        if not self.allow():
+            raise CircuitOpenError("%s circuit open" % self.name)
+
+    def is_open(self):
+        """ Open and not due for a trial call yet. Doesn't take the half-open trial call
+        """
+        with self.lock:
+            return self.state == OPEN and time.monotonic() - self.opened_at < self.reset_seconds
+
+    def check_open(self):
+        """ Fail fast while open, for lazy operations (cursors) whose outcome the breaker doesn't see
+        """
+        if self.is_open():
+            with self.lock:
+                self.rejected += 1
+            raise CircuitOpenError("%s circuit open" % self.name)
+
+    def record_success(self):
+        with self.lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.trial_running = False
+
+    def release(self):
+        """ End a call that says nothing about the dependency (e.g. the caller's own deadline ran out)
+        """
+        with self.lock:
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self.trips += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "open_for_s": round(time.monotonic() - self.opened_at, 1) if self.state != CLOSED else None,
+            }
+
+
+def breaker_stats():
+    return dict((name, breaker.stats()) for name, breaker in sorted(BREAKERS.items()))
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+deadline.py
+
+Per-request time budget. The webhook creates one Deadline and passes it down
+(dispatcher, handlers, db.mongo helpers, MessageSender); each call uses what is
+left as its timeout, so a stalled dependency can't hold a worker longer than
+the request's budget.
+"""
+
+import time
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    __slots__ = ("expires_at",)
+
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        """ rtype: seconds left, 0 once expired
+        """
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def remaining_ms(self):
+        return int(self.remaining() * 1000)
+
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+    def check(self, operation=""):
+        """ Raise DeadlineExceeded rather than start a call that can't finish in time
+        """
+        if self.expired():
+            raise DeadlineExceeded("deadline exceeded before %s" % (operation or "call"))
+
+    def timeout(self, cap=None, operation=""):
+        """ Timeout for the next call: the remaining budget, at most cap seconds
+        """
+        self.check(operation)
+        remaining = self.remaining()
+        return remaining if cap is None else min(cap, remaining)
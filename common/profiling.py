@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+profiling.py
+
+Opt-in profiling of real requests, without redeploying:
+
+    PROFILE_SAMPLE_RATE=0.01      profile 1% of requests
+    PROFILE_SECRET=...            or profile requests carrying a valid signed header:
+                                  X-Profile-Request: <unix time>:<hex hmac-sha256(secret, unix time)>
+    PROFILE_ALLOCATIONS=1         also record an allocation snapshot (tracemalloc)
+    PROFILE_DIR=/tmp/profiles     where .prof (pstats) / .alloc.txt files go
+    PROFILE_KEEP=50               older files are deleted
+
+With none of PROFILE_SAMPLE_RATE / PROFILE_SECRET set, profiled() returns the
+function unchanged, so there is no cost at all.
+
+One request is profiled at a time per process: Python 3.12 allows a single
+active profiler, and tracemalloc is process-wide. A request picked while another
+one is being profiled just runs unprofiled.
+"""
+
+import os
+import hmac
+import time
+import random
+import hashlib
+import cProfile
+import functools
+import threading
+import tracemalloc
+from common.log_util import log
+
+HEADER = "X-Profile-Request"
+# signed headers older than this are refused, so a leaked one can't be replayed for long
+SIGNATURE_MAX_AGE = 300
+
+
+class Profiler:
+
+    def __init__(self, sample_rate=0.0, secret=None, allocations=False, directory="/tmp/profiles", keep=50):
+        self.sample_rate = sample_rate
+        self.secret = secret
+        self.allocations = allocations
+        self.directory = directory
+        self.keep = keep
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # held while a request is profiled
+        self.profiling = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0 or bool(self.secret)
+
+    def signature_valid(self, value):
+        if not self.secret or not value or ":" not in value:
+            return False
+        timestamp, signature = value.split(":", 1)
+        try:
+            if abs(time.time() - int(timestamp)) > SIGNATURE_MAX_AGE:
+                return False
+        except ValueError:
+            return False
+        expected = hmac.new(self.secret.encode("utf-8"), timestamp.encode("utf-8"), hashlib.sha256).hexdigest()
+        return hmac.compare_digest(expected, signature)
+
+    def should_profile(self, header=None):
+        if self.signature_valid(header):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def profiled(self, name, header=None):
+        """ Decorator. header: function returning the request's X-Profile-Request value
+        """
+        def decorator(function):
+            if not self.enabled:
+                return function
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                # nested hooks (dispatcher inside webhook) are covered by the outer profile
+                if getattr(self.local, "active", False) or \
+                        not self.should_profile(header() if header is not None else None):
+                    return function(*args, **kwargs)
+                if not self.profiling.acquire(False):
+                    return function(*args, **kwargs)
+                try:
+                    return self.run(name, function, args, kwargs)
+                finally:
+                    self.profiling.release()
+            return wrapper
+        return decorator
+
+    def run(self, name, function, args, kwargs):
+        self.local.active = True
+        trace_allocations = self.allocations and not tracemalloc.is_tracing()
+        if trace_allocations:
+            tracemalloc.start(10)
+        profile = cProfile.Profile()
+        started = time.time()
+        try:
+            return profile.runcall(function, *args, **kwargs)
+        finally:
+            elapsed = time.time() - started
+            snapshot = tracemalloc.take_snapshot() if trace_allocations else None
+            if trace_allocations:
+                tracemalloc.stop()
+            self.local.active = False
+            try:
+                self.save(name, elapsed, profile, snapshot)
+            except Exception as e:
+                log("profile %s not saved: %r" % (name, e))
+
+    def save(self, name, elapsed, profile, snapshot):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        base = os.path.join(self.directory, "%s-%s-%d-%dms" % (
+            time.strftime("%Y%m%d-%H%M%S"), name, os.getpid(), elapsed * 1000))
+        profile.dump_stats(base + ".prof")
+        if snapshot is not None:
+            with open(base + ".alloc.txt", "w") as out:
+                for stat in snapshot.statistics("lineno")[:50]:
+                    out.write("%s\n" % stat)
+        log("profile saved: %s.prof (%.0fms)" % (base, elapsed * 1000))
+        self.rotate()
+
+    def rotate(self):
+        with self.lock:
+            paths = [os.path.join(self.directory, f) for f in os.listdir(self.directory)]
+            paths.sort(key=os.path.getmtime, reverse=True)
+            for path in paths[self.keep:]:
+                os.remove(path)
+
+
+profiler = Profiler(sample_rate=float(os.environ.get("PROFILE_SAMPLE_RATE", 0)),
+                    secret=os.environ.get("PROFILE_SECRET"),
+                    allocations=os.environ.get("PROFILE_ALLOCATIONS") == "1",
+                    directory=os.environ.get("PROFILE_DIR", "/tmp/profiles"),
+                    keep=int(os.environ.get("PROFILE_KEEP", 50)))
@@ -4,4 +4,82 @@ class Config(object):
     MGDB_PREFIX = "MONGO"
     MONGO_URI = os.environ["MONGO_URI"]
     MONGO_DBNAME = "contact_bot"
-    MONGO_COLLECTIONS = ['contacts']
+    MONGO_COLLECTIONS = ['contacts', 'outbox', 'events', 'partitions', 'workers', 'jobs', 'contact_stats', 'locations']
+    # Connection pool and read routing, see db/connection.py for every <PREFIX>_ option
+    MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", 100))
+    MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", 2000))
+    MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get("MONGO_CONNECT_TIMEOUT_MS", 5000))
+    MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get("MONGO_SOCKET_TIMEOUT_MS", 10000))
+    MONGO_COMPRESSORS = os.environ.get("MONGO_COMPRESSORS", "")
+    MONGO_READ_PREFERENCE = os.environ.get("MONGO_READ_PREFERENCE", "primary")
+    MONGO_MAX_STALENESS_SECONDS = int(os.environ.get("MONGO_MAX_STALENESS_SECONDS", -1))
+
+    # Facebook Graph API (Send API) client
+    GRAPH_API_URL = os.environ.get("GRAPH_API_URL", "https://graph.facebook.com/v2.6/me/messages")
+    GRAPH_API_POOL_SIZE = int(os.environ.get("GRAPH_API_POOL_SIZE", 10))
+    GRAPH_API_TIMEOUT_SECONDS = int(os.environ.get("GRAPH_API_TIMEOUT_SECONDS", 10))
+
+    # Facebook app secret: webhook deliveries must carry a valid X-Hub-Signature(-256), empty = not checked
+    APP_SECRET = os.environ.get("APP_SECRET", "")
+
+    # Time budget of a webhook request, shared by every Mongo / Send API call it makes (common/deadline.py)
+    WEBHOOK_DEADLINE_SECONDS = int(os.environ.get("WEBHOOK_DEADLINE_SECONDS", 10))
+    # Circuit breakers per Mongo prefix and for the Graph API (common/circuit_breaker.py)
+    BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", 5))
+    BREAKER_RESET_SECONDS = int(os.environ.get("BREAKER_RESET_SECONDS", 30))
+
+    # Outbox: every reply is stored before sending and replayed until delivered
+    OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", 50))
+    OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 8))
+    OUTBOX_RETRY_BASE_SECONDS = int(os.environ.get("OUTBOX_RETRY_BASE_SECONDS", 15))
+    OUTBOX_LEASE_SECONDS = int(os.environ.get("OUTBOX_LEASE_SECONDS", 60))
+    OUTBOX_POLL_SECONDS = int(os.environ.get("OUTBOX_POLL_SECONDS", 5))
+    # sent / failed replies are kept this long (TTL index on done_at)
+    OUTBOX_RETENTION_DAYS = int(os.environ.get("OUTBOX_RETENTION_DAYS", 7))
+
+    # "inline": handle messages in the webhook request
+    # "partitioned": the webhook enqueues, partition workers (partitioning.py) handle them in per-sender order
+    PROCESSING_MODE = os.environ.get("PROCESSING_MODE", "inline")
+    PARTITION_COUNT = int(os.environ.get("PARTITION_COUNT", 64))
+    PARTITION_LEASE_SECONDS = int(os.environ.get("PARTITION_LEASE_SECONDS", 30))
+
+    # Attachment pipeline (attachments.py): photos / voice notes processed off the request path
+    ATTACHMENT_WORKERS = int(os.environ.get("ATTACHMENT_WORKERS", 2))
+    ATTACHMENT_MAX_QUEUED = int(os.environ.get("ATTACHMENT_MAX_QUEUED", 32))
+    ATTACHMENT_MAX_BYTES = int(os.environ.get("ATTACHMENT_MAX_BYTES", 10 * 1024 * 1024))
+    ATTACHMENT_TIMEOUT_SECONDS = int(os.environ.get("ATTACHMENT_TIMEOUT_SECONDS", 60))
+
+    # Raw webhook archive (event_archive.py), disabled when empty. Replaces logging every payload.
+    ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "")
+    ARCHIVE_BLOCK_BYTES = int(os.environ.get("ARCHIVE_BLOCK_BYTES", 256 * 1024))
+    ARCHIVE_SEGMENT_BYTES = int(os.environ.get("ARCHIVE_SEGMENT_BYTES", 256 * 1024 * 1024))
+    # oldest segments are deleted on rotation beyond these, 0 = no limit
+    ARCHIVE_MAX_BYTES = int(os.environ.get("ARCHIVE_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+    ARCHIVE_MAX_SEGMENTS = int(os.environ.get("ARCHIVE_MAX_SEGMENTS", 0))
+
+    # Admission control (admission.py): per worker, requests over the limit are shed
+    # ADMISSION_MODE: "reply" canned reply without DB access, "spill" to the partition event queue (run partitioning.py),
+    # "retry" 503 + Retry-After
+    ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", 16))
+    ADMISSION_MAX_LATENCY_MS = int(os.environ.get("ADMISSION_MAX_LATENCY_MS", 2000))
+    ADMISSION_MODE = os.environ.get("ADMISSION_MODE", "retry")
+    ADMISSION_RETRY_AFTER_SECONDS = int(os.environ.get("ADMISSION_RETRY_AFTER_SECONDS", 30))
+    # shed requests replying / spilling at once (each within CANNED_REPLY_TIMEOUT_SECONDS), the rest get the 503
+    ADMISSION_MAX_SHEDDING = int(os.environ.get("ADMISSION_MAX_SHEDDING", 4))
+    # Sent straight through the Send API when a request is shed or Mongo is unavailable
+    CANNED_REPLY = os.environ.get("CANNED_REPLY",
+                                  "We're a bit busy right now, please send that again in a few minutes.")
+    CANNED_REPLY_TIMEOUT_SECONDS = int(os.environ.get("CANNED_REPLY_TIMEOUT_SECONDS", 2))
+
+    # Warm-up (warmup.py): failed required steps are retried after 1, 2, 4... seconds, at most WARMUP_RETRY_MAX_SECONDS
+    WARMUP_RETRY_BASE_SECONDS = int(os.environ.get("WARMUP_RETRY_BASE_SECONDS", 1))
+    WARMUP_RETRY_MAX_SECONDS = int(os.environ.get("WARMUP_RETRY_MAX_SECONDS", 30))
+
+    # Contact statistics (db/contact_stats.py): increments are flushed every STATS_FLUSH_SECONDS, 0 = right away
+    STATS_FLUSH_SECONDS = int(os.environ.get("STATS_FLUSH_SECONDS", 10))
+
+    # Last known location per sender (db/locations.py), written every LOCATION_FLUSH_SECONDS, 0 = right away
+    LOCATION_FLUSH_SECONDS = int(os.environ.get("LOCATION_FLUSH_SECONDS", 5))
+
+    # Multi-page mode (pages.py): JSON file of the pages served by this deployment, empty = one page (PAGE_ACCESS_TOKEN)
+    PAGES_FILE = os.environ.get("PAGES_FILE", "")
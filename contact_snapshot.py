@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+contact_snapshot.py
+
+Read-only snapshot of the contact keys, for services asking "is this email /
+phone / facebook id a known contact?" at a high rate without a find_one each.
+
+A snapshot is one file of fixed-width records sorted by key hash:
+
+    header   = magic "CTSNAP01", record size, metadata length, record count, data offset
+    metadata = JSON: build / apply times, resume token of the contacts change stream
+    record   = md5(kind ":" key) (16 bytes), contact ObjectId (12 bytes)
+
+with one record per key of a contact (email_norm, phone_e164, facebook_id),
+merged duplicates left out. ContactSnapshot maps the file read-only and binary
+searches the records in place: no DB traffic and no copy of the file in the
+process, so every worker process on the host shares the same page cache pages.
+
+build() streams the collection into sorted runs of run_records records, merged
+into the snapshot (external merge sort: memory stays bounded whatever the number
+of contacts). apply_changes() reads the contacts change stream from the
+snapshot's resume token and merges the changed contacts into a new snapshot.
+Both write a temporary file renamed over the snapshot: readers keep using the
+file they mapped and switch to the new one on their next check. Run one builder
+per snapshot file.
+"""
+
+import os
+import mmap
+import time
+import heapq
+import struct
+import hashlib
+import tempfile
+import collections
+from bson import ObjectId, json_util
+from pymongo.errors import OperationFailure
+from common.log_util import log
+from extractor import normalize_email, normalize_phone
+
+MAGIC = b"CTSNAP01"
+HEADER = struct.Struct("<8sIIQQ")
+# the key hash as two big-endian integers compares like its bytes
+KEY = struct.Struct(">QQ")
+HASH_BYTES = 16
+RECORD_BYTES = HASH_BYTES + 12
+PAGE_BYTES = 4096
+WRITE_RECORDS = 4096
+
+# kind -> contact field holding its canonical key
+FIELDS = collections.OrderedDict([("email", "email_norm"), ("phone", "phone_e164"), ("facebook_id", "facebook_id")])
+
+Mapping = collections.namedtuple("Mapping", "data count offset metadata identity")
+
+
+class SnapshotStale(Exception):
+    """ The snapshot can't be brought up to date from the change stream (no resume token,
+        changes no longer in the oplog, collection dropped...): rebuild it
+    """
+
+
+def key_hash(kind, key):
+    return hashlib.md5((u"%s:%s" % (kind, key)).encode("utf-8")).digest()
+
+
+def contact_records(contact):
+    """ Records of a contact's keys, none for a deleted contact or a merged duplicate
+        rtype: list of record bytes
+    """
+    if contact is None or "merged_into" in contact or not isinstance(contact.get("_id"), ObjectId):
+        return []
+    return [key_hash(kind, contact[field]) + contact["_id"].binary
+            for kind, field in FIELDS.items() if contact.get(field)]
+
+
+def write_run(records, directory=None):
+    """ Sort a batch of records into an anonymous temporary file
+    """
+    records.sort()
+    run = tempfile.TemporaryFile(dir=directory)
+    run.write(b"".join(records))
+    run.seek(0)
+    return run
+
+
+def read_run(run):
+    while True:
+        chunk = run.read(RECORD_BYTES * WRITE_RECORDS)
+        if not chunk:
+            return
+        for position in range(0, len(chunk), RECORD_BYTES):
+            yield chunk[position:position + RECORD_BYTES]
+
+
+def write_snapshot(path, records, metadata):
+    """ Write sorted records to a temporary file renamed over path
+        rtype: number of records written
+    """
+    meta = json_util.dumps(metadata).encode("utf-8")
+    # records start on a page boundary
+    data_offset = (HEADER.size + len(meta) + PAGE_BYTES - 1) // PAGE_BYTES * PAGE_BYTES
+    fd, temporary = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp",
+                                     dir=os.path.dirname(os.path.abspath(path)))
+    count = 0
+    try:
+        with os.fdopen(fd, "wb") as target:
+            target.write(b"\0" * data_offset)
+            batch, previous = [], None
+            for record in records:
+                if record == previous:
+                    # same key of the same contact, e.g. in two runs
+                    continue
+                previous = record
+                batch.append(record)
+                if len(batch) == WRITE_RECORDS:
+                    target.write(b"".join(batch))
+                    count += len(batch)
+                    batch = []
+            target.write(b"".join(batch))
+            count += len(batch)
+            target.seek(0)
+            target.write(HEADER.pack(MAGIC, RECORD_BYTES, len(meta), count, data_offset) + meta)
+            target.flush()
+            os.fsync(target.fileno())
+        # mkstemp files are private to the builder's user
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+    return count
+
+
+def stream_start(collection):
+    """ Resume token of the contacts change stream as of now, None when the deployment
+        has no change streams (standalone server): the snapshot can then only be rebuilt
+    """
+    try:
+        with collection.watch(max_await_time_ms=100) as stream:
+            if stream.resume_token is None:
+                # servers before 4.0.7 only give a token with the first getMore
+                stream.try_next()
+            return stream.resume_token
+    except OperationFailure as e:
+        log("no change stream on %s, the snapshot can only be rebuilt: %s" % (collection.collection, e))
+        return None
+
+
+def build(collection, path, run_records=500000, tmp_dir=None):
+    """ Full rebuild from a contacts MongoCollection
+        rtype: number of records
+    """
+    started = time.time()
+    # taken before the scan: changes made during the scan are applied again by the next apply_changes
+    resume_token = stream_start(collection)
+    runs, records = [], []
+    try:
+        # from the primary: a lagging secondary could miss writes older than the resume token
+        for contact in collection.find(query={"merged_into": {"$exists": False}}, limit=0, primary=True):
+            records.extend(contact_records(contact))
+            if len(records) >= run_records:
+                runs.append(write_run(records, tmp_dir))
+                records = []
+        if records:
+            runs.append(write_run(records, tmp_dir))
+        return write_snapshot(path, heapq.merge(*[read_run(run) for run in runs]), {
+            "collection": collection.collection, "built_at": started, "applied_at": started,
+            "resume_token": resume_token, "changes_applied": 0})
+    finally:
+        for run in runs:
+            run.close()
+
+
+def apply_changes(collection, path, max_changes=100000, max_await_ms=1000):
+    """ Merge the contacts changed since the snapshot's resume token into a new snapshot
+        rtype: number of contacts changed, 0 = snapshot left as is
+        raises SnapshotStale when the snapshot has to be rebuilt instead
+    """
+    snapshot = ContactSnapshot(path, check_seconds=None)
+    try:
+        metadata = dict(snapshot.mapped.metadata)
+        if metadata.get("resume_token") is None:
+            raise SnapshotStale("%s has no resume token" % path)
+        # contact _id -> current document, None once deleted
+        changed = collections.OrderedDict()
+        try:
+            with collection.watch(resume_after=metadata["resume_token"], full_document="updateLookup",
+                                  max_await_time_ms=max_await_ms) as stream:
+                while len(changed) < max_changes:
+                    change = stream.try_next()
+                    if change is None:
+                        break
+                    if change["operationType"] in ("insert", "update", "replace"):
+                        # the document as of the lookup, None if deleted since
+                        changed[change["documentKey"]["_id"]] = change.get("fullDocument")
+                    elif change["operationType"] == "delete":
+                        changed[change["documentKey"]["_id"]] = None
+                    else:
+                        # drop, rename, dropDatabase, invalidate
+                        raise SnapshotStale("contacts collection event: %s" % change["operationType"])
+                resume_token = stream.resume_token
+        except OperationFailure as e:
+            # e.g. ChangeStreamHistoryLost: the token is older than the oplog
+            raise SnapshotStale("can't resume the contacts change stream: %s" % e)
+        if not changed:
+            return 0
+        removed = set(contact_id.binary for contact_id in changed if isinstance(contact_id, ObjectId))
+        added = sorted(record for contact in changed.values() for record in contact_records(contact))
+        kept = (record for record in snapshot.records() if record[HASH_BYTES:] not in removed)
+        metadata.update(resume_token=resume_token, applied_at=time.time(),
+                        changes_applied=metadata.get("changes_applied", 0) + len(changed))
+        write_snapshot(path, heapq.merge(kept, added), metadata)
+        return len(changed)
+    finally:
+        snapshot.close()
+
+
+class ContactSnapshot:
+
+    def __init__(self, path, check_seconds=5):
+        """
+            :param check_seconds: how often lookups check whether the file was replaced,
+                None = never (call refresh())
+        """
+        self.path = path
+        self.check_seconds = check_seconds
+        self.checked = 0
+        self.mapped = None
+        self.open()
+
+    def open(self):
+        with open(self.path, "rb") as source:
+            stat = os.fstat(source.fileno())
+            data = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, record_bytes, meta_length, count, data_offset = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or record_bytes != RECORD_BYTES or data_offset + count * RECORD_BYTES > len(data):
+            data.close()
+            raise ValueError("%s is not a contact snapshot" % self.path)
+        metadata = json_util.loads(data[HEADER.size:HEADER.size + meta_length].decode("utf-8"))
+        # swapped in one assignment: lookups running on the previous mapping finish on it,
+        # and it is unmapped once the last of them lets go of it
+        self.mapped = Mapping(data, count, data_offset, metadata, (stat.st_dev, stat.st_ino))
+        self.checked = time.time()
+
+    def refresh(self):
+        """ Map the snapshot again if it was replaced since
+            rtype: True if it was
+        """
+        self.checked = time.time()
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            # keep serving the one mapped
+            return False
+        if (stat.st_dev, stat.st_ino) == self.mapped.identity:
+            return False
+        self.open()
+        return True
+
+    def lookup(self, kind, key):
+        """ Ids of the contacts owning a canonical key
+            :param kind: "email" (email_norm), "phone" (phone_e164) or "facebook_id"
+            rtype: list of bson.ObjectId, empty for an unknown key
+        """
+        if self.check_seconds is not None and time.time() - self.checked >= self.check_seconds:
+            self.refresh()
+        mapped = self.mapped
+        data, offset = mapped.data, mapped.offset
+        target = KEY.unpack(key_hash(kind, key))
+        low, high = 0, mapped.count
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(data, offset + middle * RECORD_BYTES) < target:
+                low = middle + 1
+            else:
+                high = middle
+        contact_ids = []
+        position, end = offset + low * RECORD_BYTES, offset + mapped.count * RECORD_BYTES
+        while position < end and KEY.unpack_from(data, position) == target:
+            contact_ids.append(ObjectId(data[position + HASH_BYTES:position + RECORD_BYTES]))
+            position += RECORD_BYTES
+        return contact_ids
+
+    def find_by_email(self, email):
+        """ Contact ids owning an email, whatever its case/spacing
+        """
+        email_norm = normalize_email(email)
+        return self.lookup("email", email_norm) if email_norm is not None else []
+
+    def find_by_phone(self, phone):
+        """ Contact ids owning a phone number, whatever its separators
+        """
+        phone_e164 = normalize_phone(phone)
+        return self.lookup("phone", phone_e164) if phone_e164 is not None else []
+
+    def find_by_facebook_id(self, facebook_id):
+        return self.lookup("facebook_id", facebook_id)
+
+    def is_known(self, email=None, phone=None, facebook_id=None):
+        return bool((email and self.find_by_email(email)) or (phone and self.find_by_phone(phone))
+                    or (facebook_id and self.find_by_facebook_id(facebook_id)))
+
+    def records(self):
+        """ All records in key order
+        """
+        mapped = self.mapped
+        end = mapped.offset + mapped.count * RECORD_BYTES
+        for start in range(mapped.offset, end, RECORD_BYTES * WRITE_RECORDS):
+            chunk = mapped.data[start:min(end, start + RECORD_BYTES * WRITE_RECORDS)]
+            for position in range(0, len(chunk), RECORD_BYTES):
+                yield chunk[position:position + RECORD_BYTES]
+
+    def stats(self):
+        mapped = self.mapped
+        return {
+            "path": self.path,
+            "records": mapped.count,
+            "bytes": mapped.offset + mapped.count * RECORD_BYTES,
+            "built_at": mapped.metadata.get("built_at"),
+            "age_seconds": round(time.time() - mapped.metadata.get("applied_at", 0), 1),
+            "changes_applied": mapped.metadata.get("changes_applied"),
+        }
+
+    def close(self):
+        """ Unmap the snapshot, once no lookup is running
+        """
+        self.mapped.data.close()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+    MongoDb connections
+
+    One pooled MongoClient per config prefix (MGDB_PREFIX). Every option is read from
+    the Flask config with the prefix, e.g. for prefix "MONGO":
+
+        MONGO_URI, MONGO_DBNAME
+        MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_WAIT_QUEUE_TIMEOUT_MS
+        MONGO_CONNECT_TIMEOUT_MS, MONGO_SOCKET_TIMEOUT_MS, MONGO_SERVER_SELECTION_TIMEOUT_MS
+        MONGO_COMPRESSORS                     "zstd,snappy,zlib" (empty = no compression)
+        MONGO_READ_PREFERENCE                 primary | primaryPreferred | secondary | secondaryPreferred | nearest
+        MONGO_MAX_STALENESS_SECONDS           -1 = no bound, otherwise >= 90
+
+    Writes always go to the primary (instance.db), reads go through instance.read_db.
+"""
+import os
+import threading
+import time
+from pymongo import MongoClient, monitoring, read_preferences
+
+DEFAULTS = {
+    "DBNAME": None,
+    "MAX_POOL_SIZE": 100,
+    "MIN_POOL_SIZE": 0,
+    "WAIT_QUEUE_TIMEOUT_MS": 2000,
+    "CONNECT_TIMEOUT_MS": 5000,
+    "SOCKET_TIMEOUT_MS": 10000,
+    "SERVER_SELECTION_TIMEOUT_MS": 5000,
+    "COMPRESSORS": "",
+    "READ_PREFERENCE": "primary",
+    "MAX_STALENESS_SECONDS": -1,
+}
+
+READ_PREFERENCES = {
+    "primarypreferred": read_preferences.PrimaryPreferred,
+    "secondary": read_preferences.Secondary,
+    "secondarypreferred": read_preferences.SecondaryPreferred,
+    "nearest": read_preferences.Nearest,
+}
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """ Records how long threads wait to check a connection out of the pool.
+        A growing wait time (or checkout failures) means the pool is undersized.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self.in_use = 0
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "avg_wait_ms": self.total_wait_ms / self.checkouts if self.checkouts else 0.0,
+                "max_wait_ms": self.max_wait_ms,
+                "in_use": self.in_use,
+            }
+
+    def connection_check_out_started(self, event):
+        self.local.started = time.time()
+
+    def connection_checked_out(self, event):
+        wait_ms = (time.time() - getattr(self.local, "started", time.time())) * 1000
+        with self.lock:
+            self.checkouts += 1
+            self.total_wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+            self.in_use += 1
+
+    def connection_check_out_failed(self, event):
+        with self.lock:
+            self.checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        with self.lock:
+            self.in_use -= 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+
+class MongoInstance:
+
+    def __init__(self, config, prefix):
+        """ Create the pooled client for a config prefix. connect=False: sockets are only
+            opened on first use.
+        """
+        def option(name):
+            return config.get(prefix + "_" + name, DEFAULTS[name])
+
+        self.prefix = prefix
+        self.pool_stats = PoolStats()
+        kwargs = {
+            "maxPoolSize": option("MAX_POOL_SIZE"),
+            "minPoolSize": option("MIN_POOL_SIZE"),
+            "waitQueueTimeoutMS": option("WAIT_QUEUE_TIMEOUT_MS"),
+            "connectTimeoutMS": option("CONNECT_TIMEOUT_MS"),
+            "socketTimeoutMS": option("SOCKET_TIMEOUT_MS"),
+            "serverSelectionTimeoutMS": option("SERVER_SELECTION_TIMEOUT_MS"),
+        }
+        if option("COMPRESSORS"):
+            kwargs["compressors"] = option("COMPRESSORS")
+        self.cx = MongoClient(config[prefix + "_URI"], connect=False,
+                              event_listeners=[self.pool_stats], **kwargs)
+        dbname = option("DBNAME")
+        self.db = self.cx[dbname] if dbname else self.cx.get_default_database()
+        self.read_db = self.cx.get_database(
+            self.db.name,
+            read_preference=read_preference(option("READ_PREFERENCE"),
+                                            option("MAX_STALENESS_SECONDS")))
+
+
+def read_preference(mode, max_staleness=-1):
+    """ Build a pymongo read preference from its config name
+    """
+    mode_class = READ_PREFERENCES.get(str(mode).lower())
+    if mode_class is None:
+        return read_preferences.Primary()
+    return mode_class(max_staleness=int(max_staleness))
+
+
+def init_mongo(app):
+    """ Create the MongoInstance(s) for app.config['MGDB_PREFIX']:
+        app.mongo for a single prefix, app.mgdb_<prefix> for each prefix in a list,
+        and app.mongo_pid: the process they belong to
+    """
+    prefix = app.config['MGDB_PREFIX']
+    if isinstance(prefix, str):
+        app.mongo = MongoInstance(app.config, prefix)
+    elif isinstance(prefix, list):
+        for name in prefix:
+            setattr(app, "mgdb_" + name.lower(), MongoInstance(app.config, name))
+    app.mongo_pid = os.getpid()
+
+
+def mongo_instances(app):
+    """ The MongoInstance of every configured prefix
+    """
+    prefix = app.config['MGDB_PREFIX']
+    if isinstance(prefix, str):
+        return [app.mongo]
+    return [getattr(app, "mgdb_" + name.lower()) for name in prefix]
+
+
+def ping_all(app):
+    """ Ping each prefix's primary, which also opens its connection pool
+    """
+    for instance in mongo_instances(app):
+        instance.cx.admin.command("ping")
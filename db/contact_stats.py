@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+    Contact statistics
+
+    Counters pre-aggregated into one document per (day, page_id, country) bucket, so
+    the daily report reads a few hundred small documents instead of scanning contacts:
+
+        {"day": "2026-10-19", "page_id": "1234", "country": "VN",
+         "messages": 120, "contact_attempts": 80, "contacts_captured": 52, "contacts_new": 40}
+
+    messages / unhandled are bumped by the dispatcher and contact_attempts by the contact
+    registration handler, with country None; contacts_captured / contacts_new are bumped
+    by store_contact in the bucket of the phone's country.
+
+    Increments are summed in process and flushed every STATS_FLUSH_SECONDS as one
+    bulk_write of $inc upserts (0 = one upsert per increment).
+"""
+import os
+import time
+import atexit
+import datetime
+import threading
+import collections
+from pymongo import UpdateOne
+from application import app
+from common.log_util import log
+from db.mongo import MongoCollection
+
+BUCKET_KEYS = ("day", "page_id", "country")
+COUNTERS = ("messages", "unhandled", "contact_attempts", "contacts_captured", "contacts_new")
+
+
+def day_of(timestamp=None):
+    """ UTC day bucket of an epoch timestamp in seconds (now by default)
+    """
+    return datetime.datetime.utcfromtimestamp(time.time() if timestamp is None else timestamp).strftime("%Y-%m-%d")
+
+
+class ContactStatsCollection(MongoCollection):
+
+    def ensure_indexes(self):
+        # one document per bucket: concurrent $inc upserts can't create duplicates
+        self.create_index([("day", 1), ("page_id", 1), ("country", 1)], name="bucket", unique=True)
+
+    def increment(self, increments):
+        """ increments: {(day, page_id, country): {counter: n}}
+        """
+        requests = [UpdateOne(dict(zip(BUCKET_KEYS, bucket)), {"$inc": counts}, upsert=True)
+                    for bucket, counts in increments.items() if counts]
+        if requests:
+            self.bulk_write(requests=requests, ordered=False)
+
+    def report(self, start_day, end_day, group_by=("day",), page_id=None, country=None):
+        """ Counters summed over the buckets of [start_day, end_day] ("YYYY-MM-DD"), grouped by
+            any of day / page_id / country. success_rate = contacts_captured / contact_attempts,
+            only meaningful when not grouped or filtered by country (attempts have no country).
+            rtype: list of dicts, sorted by the group keys
+        """
+        query = {"day": {"$gte": start_day, "$lte": end_day}}
+        if page_id is not None:
+            query["page_id"] = page_id
+        if country is not None:
+            query["country"] = country
+        group = {"_id": dict((key, "$" + key) for key in group_by if key in BUCKET_KEYS)}
+        for counter in COUNTERS:
+            group[counter] = {"$sum": "$" + counter}
+        rows = []
+        for row in self.aggregate(pipeline=[{"$match": query}, {"$group": group}]):
+            keys = row.pop("_id")
+            row.update(keys)
+            row["success_rate"] = (float(row["contacts_captured"]) / row["contact_attempts"]
+                                   if row["contact_attempts"] else None)
+            rows.append(row)
+        rows.sort(key=lambda row: tuple(str(row.get(key)) for key in group_by))
+        return rows
+
+
+class ContactStatsRecorder:
+
+    def __init__(self, collection, flush_seconds=10):
+        self.collection = collection
+        self.flush_seconds = flush_seconds
+        self.lock = threading.Lock()
+        self.pending = collections.defaultdict(collections.Counter)
+        self.pid = None
+
+    def bump(self, page_id=None, country=None, **counts):
+        """ Add counts to today's (page_id, country) bucket, e.g. bump(page_id, messages=1)
+        """
+        bucket = (day_of(), page_id, country)
+        if not self.flush_seconds:
+            try:
+                self.collection.increment({bucket: counts})
+            except Exception as e:
+                log("contact stats update failed: %r" % e)
+            return
+        with self.lock:
+            if self.pid != os.getpid():
+                # first bump in this process (or after fork: the parent's counts aren't ours to flush)
+                self.pid = os.getpid()
+                self.pending.clear()
+                flusher = threading.Thread(target=self.flush_periodically, name="contact-stats-flush")
+                flusher.daemon = True
+                flusher.start()
+                atexit.register(self.flush)
+            self.pending[bucket].update(counts)
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, collections.defaultdict(collections.Counter)
+        if not pending:
+            return
+        try:
+            self.collection.increment(dict((bucket, dict(counts)) for bucket, counts in pending.items()))
+        except Exception as e:
+            log("contact stats flush failed, retrying with the next batch: %r" % e)
+            with self.lock:
+                for bucket, counts in pending.items():
+                    self.pending[bucket].update(counts)
+
+    def flush_periodically(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            self.flush()
+
+
+mongo_contact_stats = ContactStatsCollection(collection="contact_stats")
+contact_stats = ContactStatsRecorder(mongo_contact_stats, flush_seconds=app.config['STATS_FLUSH_SECONDS'])
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+    Contacts collection
+
+    mongo_contacts with lookups on the canonical contact keys (email_norm, phone_e164),
+    each backed by one sparse ascending index, serving both the lookups and the dedupe
+    job's ordered scans.
+
+    Duplicates merged by tools/dedupe_contacts.py are kept with merged_into pointing
+    at the surviving contact, and are left out of lookups.
+
+    facebook_id is unique, so concurrent upserts for one sender can't insert twice.
+    Collections indexed by older versions get the unique index from
+    python -m tools.dedupe_contacts --facebook-id, which first merges contacts sharing
+    a facebook_id.
+"""
+from pymongo.errors import OperationFailure
+from common.log_util import log
+from db.mongo import MongoCollection
+from extractor import normalize_email, normalize_phone
+
+FACEBOOK_ID_INDEX = dict(name="facebook_id", unique=True,
+                         partialFilterExpression={"facebook_id": {"$exists": True}})
+# hashed indexes of older versions, replaced by the ascending ones
+OLD_INDEXES = ("email_norm_hashed", "phone_e164_hashed")
+
+
+class ContactsCollection(MongoCollection):
+
+    def ensure_indexes(self):
+        try:
+            self.create_index([("facebook_id", 1)], **FACEBOOK_ID_INDEX)
+        except OperationFailure as e:
+            # the non-unique index of older versions, or contacts sharing a facebook_id
+            log("contacts: facebook_id isn't unique yet, run python -m tools.dedupe_contacts --facebook-id (%s)" % e)
+        # equality lookups and the dedupe job's ordered $match/$sort
+        self.create_index([("email_norm", 1)], name="email_norm", sparse=True)
+        self.create_index([("phone_e164", 1)], name="phone_e164", sparse=True)
+        self.create_index([("merged_into", 1)], name="merged_into", sparse=True)
+        existing = self.index_information() or {}
+        for name in OLD_INDEXES:
+            if name in existing:
+                try:
+                    self.drop_index(name)
+                except OperationFailure:
+                    # dropped by another worker meanwhile
+                    pass
+
+    def make_facebook_id_unique(self):
+        """ Replace a non-unique facebook_id index by the unique one, once no contacts share a facebook_id
+            rtype: True when the index is unique
+        """
+        index = (self.index_information() or {}).get("facebook_id")
+        if index is not None and index.get("unique"):
+            return True
+        if index is not None:
+            self.drop_index("facebook_id")
+        self.create_index([("facebook_id", 1)], **FACEBOOK_ID_INDEX)
+        return True
+
+    def find_by_email(self, email, limit=20):
+        """ Contacts owning an email, whatever its case/spacing
+        """
+        email_norm = normalize_email(email)
+        if email_norm is None:
+            return []
+        return list(self.find(query={"email_norm": email_norm, "merged_into": {"$exists": False}},
+                              limit=limit))
+
+    def find_by_phone(self, phone, limit=20):
+        """ Contacts owning a phone number, whatever its separators:
+            "0988 123 456", "0988-123-456" and "+84988123456" all match
+        """
+        phone_e164 = normalize_phone(phone)
+        if phone_e164 is None:
+            return []
+        return list(self.find(query={"phone_e164": phone_e164, "merged_into": {"$exists": False}},
+                              limit=limit))
+
+
+mongo_contacts = ContactsCollection(collection="contacts")
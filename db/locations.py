@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+    Locations collection
+
+    Last known location of each sender, one document per sender (_id = facebook id)
+    with a GeoJSON point in a 2dsphere indexed "location" field:
+
+        {"_id": "1254459154682919", "location": {"type": "Point", "coordinates": [106.70, 10.77]},
+         "page_id": "1234", "timestamp": 1760860800000, "updated_at": ...}
+
+    Writes go through LocationWriter, which keeps only the latest location per sender
+    and flushes every LOCATION_FLUSH_SECONDS as one bulk_write: a sender sharing their
+    live location costs one write per interval, not one per event. Locations the server
+    rejects (coordinates out of range...) are dropped; the others are retried with the
+    next flush when the write fails as a whole.
+"""
+import os
+import time
+import atexit
+import datetime
+import itertools
+import threading
+from pymongo import UpdateOne, GEOSPHERE
+from pymongo.errors import BulkWriteError
+from application import app
+from common.log_util import log
+from db.mongo import MongoCollection, geo_point
+from db.contacts import ContactsCollection
+
+
+class LocationsCollection(MongoCollection):
+
+    def ensure_indexes(self):
+        self.create_index([("location", GEOSPHERE)], name="location_2dsphere")
+
+    def store_latest(self, locations):
+        """ locations: {sender_id: (longitude, latitude, page_id, timestamp)}
+            rtype: dict of sender_id -> error message for the locations the server rejected
+        """
+        now = datetime.datetime.utcnow()
+        # write errors point at requests by index
+        sender_ids = list(locations)
+        requests = []
+        for sender_id in sender_ids:
+            longitude, latitude, page_id, timestamp = locations[sender_id]
+            requests.append(UpdateOne({"_id": sender_id},
+                                      {"$set": {"location": geo_point(longitude, latitude), "page_id": page_id,
+                                                "timestamp": timestamp, "updated_at": now}},
+                                      upsert=True))
+        if not requests:
+            return {}
+        try:
+            # unordered: one rejected location doesn't stop the others
+            self.bulk_write(requests=requests, ordered=False)
+        except BulkWriteError as e:
+            return dict((sender_ids[error["index"]], error.get("errmsg"))
+                        for error in e.details.get("writeErrors", []))
+        return {}
+
+    def contacts_near(self, longitude, latitude, max_distance_m=5000, limit=20):
+        """ Contacts whose sender was last seen within max_distance_m of a point, closest first
+            rtype: list of (contact, location document)
+        """
+        contacts_collection = ContactsCollection(mongodb=self.mongodb, collection="contacts")
+        results = []
+        # senders without a contact (or with a merged one) are skipped: read on until limit contacts are found
+        with self.near(longitude=longitude, latitude=latitude, max_distance_m=max_distance_m,
+                       projection=["location", "timestamp"], limit=0).batch_size(limit * 2) as cursor:
+            while len(results) < limit:
+                locations = list(itertools.islice(cursor, limit * 2))
+                if not locations:
+                    break
+                contacts = dict((contact["facebook_id"], contact) for contact in contacts_collection.find(
+                    query={"facebook_id": {"$in": [location["_id"] for location in locations]},
+                           "merged_into": {"$exists": False}},
+                    limit=0))
+                results.extend((contacts[location["_id"]], location)
+                               for location in locations if location["_id"] in contacts)
+        return results[:limit]
+
+
+class LocationWriter:
+
+    def __init__(self, collection, flush_seconds=5):
+        self.collection = collection
+        self.flush_seconds = flush_seconds
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.pid = None
+
+    def record(self, message):
+        """ message: messages.LocationMessage
+        """
+        timestamp = message.timestamp if message.timestamp is not None else int(time.time() * 1000)
+        location = (message.longitude, message.latitude, message.page_id, timestamp)
+        if not self.flush_seconds:
+            self.log_rejected(self.collection.store_latest({message.sender_id: location}), {message.sender_id: location})
+            return
+        with self.lock:
+            if self.pid != os.getpid():
+                # first location in this process (or after fork)
+                self.pid = os.getpid()
+                self.pending = {}
+                flusher = threading.Thread(target=self.flush_periodically, name="location-flush")
+                flusher.daemon = True
+                flusher.start()
+                atexit.register(self.flush)
+            previous = self.pending.get(message.sender_id)
+            # events can arrive out of order: keep the latest one
+            if previous is None or previous[3] <= timestamp:
+                self.pending[message.sender_id] = location
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        try:
+            rejected = self.collection.store_latest(pending)
+        except Exception as e:
+            log("location flush failed, retrying with the next batch: %r" % e)
+            with self.lock:
+                for sender_id, location in pending.items():
+                    # a newer location recorded since wins
+                    self.pending.setdefault(sender_id, location)
+            return
+        self.log_rejected(rejected, pending)
+
+    def log_rejected(self, rejected, locations):
+        for sender_id, error in rejected.items():
+            # retrying would fail the same way
+            log("location of %s %r dropped: %s" % (sender_id, locations[sender_id][:2], error))
+
+    def flush_periodically(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            self.flush()
+
+
+mongo_locations = LocationsCollection(collection="locations")
+location_writer = LocationWriter(mongo_locations, flush_seconds=app.config['LOCATION_FLUSH_SECONDS'])
@@ -3,71 +3,99 @@
     MongoDb Util functions
     Providing helper functions and auto create convenient collection access (example users.find())
     Support multi mongodb instance
+    Operations take an optional deadline (common/deadline.py) and go through the prefix's circuit breaker
 
     Author: Hai Nguyen (Jin) haibeo at gmail dot com / skype jiimmy.hai
     Date: 03/2016
 """
-from app import app
+import os
+import threading
+import contextlib
+import pymongo
+from bson.son import SON
+from pymongo import ReturnDocument
+from pymongo.errors import ConnectionFailure, ExecutionTimeout, WTimeoutError
+from application import app
+from common.circuit_breaker import CircuitBreaker
+from db.connection import init_mongo
+
+# errors meaning the server is unreachable or too slow (counted by the circuit breaker),
+# as opposed to a bad query or a duplicate key
+UNAVAILABLE = (ConnectionFailure, ExecutionTimeout, WTimeoutError)
 
 ################################
 # Base functions
 
 
-def insert_one(collection=None, query={}, mongodb="mongo"):
+def insert_one(collection=None, query={}, deadline=None, mongodb="mongo"):
     """ Insert one document to a collection
         Args:
             :param collection: (string) Mongodb collection name
             :param query: (dict) The document to insert. Must be a mutable mapping type. If the document does not have an _id field one will be added automatically.
+            :param deadline: (common.deadline.Deadline) The request's time budget, None = no limit
         Returns:
             An instance of InsertOneResult if success
             None if failed
     """
     if check_one_query(collection=collection, query=query):
-        return get_db_instance(mongodb=mongodb).db[collection].insert_one(query)
+        with guarded(mongodb, deadline):
+            return get_db_instance(mongodb=mongodb).db[collection].insert_one(query)
     else:
         return None
 
-def update_many(collection=None, query={}, update=None, mongodb="mongo"):
+def update_many(collection=None, query={}, update=None, upsert=False, deadline=None, mongodb="mongo"):
     """ Update many document in a collection
         Args:
             :param collection: (string) Mongodb collection name
             :param query: (dict) Document query data
+            :param upsert: (bool) Insert a new document if nothing matches
+            :param deadline: (common.deadline.Deadline) The request's time budget, None = no limit
     """
     if check_one_query(collection=collection, query=query):
-        return get_db_instance(mongodb=mongodb).db[collection].update_many(query, update)
+        with guarded(mongodb, deadline):
+            return get_db_instance(mongodb=mongodb).db[collection].update_many(query, update, upsert=upsert)
     else:
         return None
 
 
-def update_one(collection=None, query={}, update=None, mongodb="mongo"):
+def update_one(collection=None, query={}, update=None, upsert=False, deadline=None, mongodb="mongo"):
     """ Update one document in a collection
         Args:
             :param collection: (string) Mongodb collection name
             :param query: (dict) Document query data
+            :param upsert: (bool) Insert a new document if nothing matches
+            :param deadline: (common.deadline.Deadline) The request's time budget, None = no limit
     """
     if check_one_query(collection=collection, query=query):
-        return get_db_instance(mongodb=mongodb).db[collection].update_one(query, update)
+        with guarded(mongodb, deadline):
+            return get_db_instance(mongodb=mongodb).db[collection].update_one(query, update, upsert=upsert)
     else:
         return None
 
 
-def find_one(collection=None, query={}, mongodb="mongo"):
+def find_one(collection=None, query={}, primary=False, deadline=None, mongodb="mongo"):
     """ Find one document from a colllection
         Args:
             :param collection: (string) Mongodb collection name
             :param query: (dict) Document query data
+            :param primary: (bool) Read from the primary instead of the prefix's READ_PREFERENCE
+            :param deadline: (common.deadline.Deadline) The request's time budget, None = no limit
     """
     if check_one_query(collection=collection, query=query):
-        return get_db_instance(mongodb=mongodb).db[collection].find_one(query)
+        with guarded(mongodb, deadline):
+            return get_read_db(mongodb=mongodb, primary=primary)[collection].find_one(
+                query, **time_limit(deadline, "max_time_ms"))
     else:
         return None
 
 
-def find_by_id(collection=None, id_array=None, mongodb="mongo"):
-    return find(mongodb=mongodb, collection=collection, query={"_id": {"$in": id_array}}, limit=0)
+def find_by_id(collection=None, id_array=None, primary=False, deadline=None, mongodb="mongo"):
+    return find(mongodb=mongodb, collection=collection, query={"_id": {"$in": id_array}}, limit=0,
+                primary=primary, deadline=deadline)
 
 
-def find(collection=None, query={}, limit=20, skip=0, sort=None, sort_field =None, sort_order = -1, mongodb="mongo"):
+def find(collection=None, query={}, limit=20, skip=0, sort=None, sort_field =None, sort_order = -1,
+         primary=False, deadline=None, mongodb="mongo"):
     """ Find documents from a collection
         Args:
             :param collection: (string) Mongodb collection name
@@ -75,11 +103,14 @@ def find(collection=None, query={}, limit=20, skip=0, sort=None, sort_field =Non
             :param limit: (int) Number of documents to get
             :param skip: (int) Number of documents to skip
             :param sort: (str) Currently support "id_desc" or "id_asc" for sorting by document id
+            :param primary: (bool) Read from the primary instead of the prefix's READ_PREFERENCE
+            :param deadline: (common.deadline.Deadline) The request's time budget, None = no limit
     """
     if check_find_query(collection=collection, query=query, limit=limit, skip=skip):
+        check_available(mongodb, deadline)
         # Get the cursor from mongodb
-        cursor = get_db_instance(mongodb=mongodb).db[collection].find(
-            query).limit(limit).skip(skip)
+        cursor = get_read_db(mongodb=mongodb, primary=primary)[collection].find(
+            query, **time_limit(deadline, "max_time_ms")).limit(limit).skip(skip)
         if sort is not None:
             if sort == "id_desc":
                 # Sort cursor by id descending
@@ -89,31 +120,260 @@ def find(collection=None, query={}, limit=20, skip=0, sort=None, sort_field =Non
                 cursor.sort('_id', 1)
         if sort_field is not None:
             cursor.sort(sort_field,sort_order)
-        return cursor
+        return GuardedCursor(cursor, mongodb=mongodb, deadline=deadline)
     else:
         return None
 
 
-def delete_one(collection=None, query={}, mongodb="mongo"):
+def near(collection=None, field="location", longitude=None, latitude=None, max_distance_m=None,
+         min_distance_m=None, query=None, projection=None, limit=20, primary=False, deadline=None,
+         mongodb="mongo"):
+    """ Find documents nearest to a point, closest first. Needs a 2dsphere index on field
+        Args:
+            :param collection: (string) Mongodb collection name
+            :param field: (string) GeoJSON point field
+            :param longitude, latitude: (float) The point, in degrees (GeoJSON order is [longitude, latitude])
+            :param max_distance_m: (float) Only documents within this many meters
+            :param query: (dict) Extra conditions on the documents
+            :param projection: (dict or list) Fields to return
+            :param limit: (int) Number of documents to get
+            :param deadline: (common.deadline.Deadline) The request's time budget, None = no limit
+        Returns:
+            A cursor over the documents
+    """
+    if isinstance(collection, str) and longitude is not None and latitude is not None:
+        condition = {"$geometry": geo_point(longitude, latitude)}
+        if max_distance_m is not None:
+            condition["$maxDistance"] = max_distance_m
+        if min_distance_m is not None:
+            condition["$minDistance"] = min_distance_m
+        geo_query = dict(query or {})
+        geo_query[field] = {"$near": condition}
+        check_available(mongodb, deadline)
+        return GuardedCursor(get_read_db(mongodb=mongodb, primary=primary)[collection].find(
+            geo_query, projection, **time_limit(deadline, "max_time_ms")).limit(limit),
+            mongodb=mongodb, deadline=deadline)
+    else:
+        return None
+
+
+def within(collection=None, field="location", geometry=None, center=None, radius_m=None,
+           query=None, projection=None, limit=20, primary=False, deadline=None, mongodb="mongo"):
+    """ Find documents inside an area, in no particular order
+        Args:
+            :param collection: (string) Mongodb collection name
+            :param field: (string) GeoJSON field
+            :param geometry: (dict) GeoJSON Polygon / MultiPolygon
+            :param center, radius_m: ((longitude, latitude), meters) A circle instead of geometry
+            :param query: (dict) Extra conditions on the documents
+            :param projection: (dict or list) Fields to return
+            :param limit: (int) Number of documents to get, 0 = all
+            :param deadline: (common.deadline.Deadline) The request's time budget, None = no limit
+        Returns:
+            A cursor over the documents
+    """
+    if geometry is not None:
+        condition = {"$geometry": geometry}
+    elif center is not None and radius_m is not None:
+        condition = {"$centerSphere": [list(center), radius_m / EARTH_RADIUS_M]}
+    else:
+        return None
+    if isinstance(collection, str):
+        geo_query = dict(query or {})
+        geo_query[field] = {"$geoWithin": condition}
+        check_available(mongodb, deadline)
+        return GuardedCursor(get_read_db(mongodb=mongodb, primary=primary)[collection].find(
+            geo_query, projection, **time_limit(deadline, "max_time_ms")).limit(limit),
+            mongodb=mongodb, deadline=deadline)
+    else:
+        return None
+
+
+def aggregate(collection=None, pipeline=None, allow_disk_use=False, batch_size=None,
+              primary=False, deadline=None, mongodb="mongo"):
+    """ Run an aggregation pipeline on a collection
+        Args:
+            :param collection: (string) Mongodb collection name
+            :param pipeline: (list) Aggregation stages
+            :param allow_disk_use: (bool) Let $group/$sort stages spill to disk on large inputs
+            :param batch_size: (int) Documents per round trip for the result cursor
+            :param primary: (bool) Read from the primary instead of the prefix's READ_PREFERENCE
+            :param deadline: (common.deadline.Deadline) The request's time budget, None = no limit
+        Returns:
+            A CommandCursor over the results
+    """
+    if isinstance(collection, str) and isinstance(pipeline, list):
+        kwargs = {"allowDiskUse": allow_disk_use}
+        if batch_size is not None:
+            kwargs["batchSize"] = batch_size
+        kwargs.update(time_limit(deadline, "maxTimeMS"))
+        with guarded(mongodb, deadline):
+            cursor = get_read_db(mongodb=mongodb, primary=primary)[collection].aggregate(pipeline, **kwargs)
+        return GuardedCursor(cursor, mongodb=mongodb, deadline=deadline)
+    else:
+        return None
+
+
+def watch(collection=None, pipeline=None, resume_after=None, full_document=None,
+          max_await_time_ms=None, mongodb="mongo"):
+    """ Open a change stream on a collection (replica sets and sharded clusters only)
+        Args:
+            :param collection: (string) Mongodb collection name
+            :param pipeline: (list) Stages filtering / reshaping the change events
+            :param resume_after: A resume token of an earlier stream, to continue where it stopped
+            :param full_document: (string) "updateLookup" to get the current document with update events
+            :param max_await_time_ms: (int) How long a getMore waits for new events
+        Returns:
+            A ChangeStream, to be closed by the caller
+    """
+    if isinstance(collection, str):
+        kwargs = {}
+        if resume_after is not None:
+            kwargs["resume_after"] = resume_after
+        if full_document is not None:
+            kwargs["full_document"] = full_document
+        if max_await_time_ms is not None:
+            kwargs["max_await_time_ms"] = max_await_time_ms
+        with guarded(mongodb):
+            return get_db_instance(mongodb=mongodb).db[collection].watch(pipeline, **kwargs)
+    else:
+        return None
+
+
+def find_one_and_update(collection=None, query={}, update=None, sort=None,
+                        return_document=ReturnDocument.AFTER, upsert=False, deadline=None, mongodb="mongo"):
+    """ Atomically find one document and update it (find-and-modify)
+        Args:
+            :param collection: (string) Mongodb collection name
+            :param query: (dict) Document query data
+            :param update: (dict) The update operations to apply
+            :param sort: (list) (key, direction) pairs deciding which document is picked first
+            :param upsert: (bool) Insert the document when none matches
+            :param deadline: (common.deadline.Deadline) The request's time budget, None = no limit
+        Returns:
+            The updated document (or the original one with ReturnDocument.BEFORE)
+            None if nothing matched
+    """
+    if check_one_query(collection=collection, query=query):
+        with guarded(mongodb, deadline):
+            return get_db_instance(mongodb=mongodb).db[collection].find_one_and_update(
+                query, update, sort=sort, return_document=return_document, upsert=upsert)
+    else:
+        return None
+
+
+def create_index(collection=None, keys=None, mongodb="mongo", **kwargs):
+    """ Create an index on a collection if it does not exist yet
+        Args:
+            :param collection: (string) Mongodb collection name
+            :param keys: (list) (key, direction) pairs, e.g. [("next_attempt_at", 1)]
+            :param kwargs: Extra index options (name, unique, sparse...)
+    """
+    if isinstance(collection, str) and keys:
+        return get_db_instance(mongodb=mongodb).db[collection].create_index(keys, **kwargs)
+    else:
+        return None
+
+
+def index_information(collection=None, mongodb="mongo"):
+    """ The indexes of a collection, by name, e.g. {"facebook_id": {"key": [("facebook_id", 1)], "unique": True}}
+    """
+    if isinstance(collection, str):
+        return get_db_instance(mongodb=mongodb).db[collection].index_information()
+    else:
+        return None
+
+
+def drop_index(collection=None, name=None, mongodb="mongo"):
+    """ Drop an index of a collection by name
+    """
+    if isinstance(collection, str) and name:
+        return get_db_instance(mongodb=mongodb).db[collection].drop_index(name)
+    else:
+        return None
+
+
+def set_ttl(collection=None, name=None, seconds=None, mongodb="mongo"):
+    """ Change the expireAfterSeconds of an existing TTL index (collMod), create_index refuses to
+    """
+    if isinstance(collection, str) and name and seconds is not None:
+        return get_db_instance(mongodb=mongodb).db.command(
+            SON([("collMod", collection), ("index", {"name": name, "expireAfterSeconds": seconds})]))
+    else:
+        return None
+
+
+def delete_one(collection=None, query={}, deadline=None, mongodb="mongo"):
     """ Delete one document from a collection
         Args:
             :param collection: (string) Mongodb collection name
             :param query: (dict) Document query data
+            :param deadline: (common.deadline.Deadline) The request's time budget, None = no limit
+    """
+    if check_one_query(collection=collection, query=query):
+        with guarded(mongodb, deadline):
+            return get_db_instance(mongodb=mongodb).db[collection].delete_one(query)
+    else:
+        return None
+
+def bulk_write(collection=None, requests=None, ordered=True, deadline=None, mongodb="mongo"):
+    """ Send a batch of write operations in one round trip
+        Args:
+            :param collection: (string) Mongodb collection name
+            :param requests: (list) pymongo operations (InsertOne, UpdateOne, DeleteMany...)
+            :param ordered: (bool) False lets the server apply them in any order and keep going after an error
+            :param deadline: (common.deadline.Deadline) The request's time budget, None = no limit
+        Returns:
+            An instance of BulkWriteResult if success
+            None if failed
+    """
+    if isinstance(collection, str) and requests:
+        with guarded(mongodb, deadline):
+            return get_db_instance(mongodb=mongodb).db[collection].bulk_write(requests, ordered=ordered)
+    else:
+        return None
+
+
+def delete_many(collection=None, query={}, deadline=None, mongodb="mongo"):
+    """ Delete all documents matching a query from a collection
+        Args:
+            :param collection: (string) Mongodb collection name
+            :param query: (dict) Document query data
+            :param deadline: (common.deadline.Deadline) The request's time budget, None = no limit
     """
     if check_one_query(collection=collection, query=query):
-        return get_db_instance(mongodb=mongodb).db[collection].delete_one(query)
+        with guarded(mongodb, deadline):
+            return get_db_instance(mongodb=mongodb).db[collection].delete_many(query)
     else:
         return None
 
 ################################
 # Helper functions
 
+EARTH_RADIUS_M = 6378100.0
+
+
+def geo_point(longitude, latitude):
+    """ GeoJSON point, as stored in 2dsphere indexed fields
+    """
+    return {"type": "Point", "coordinates": [float(longitude), float(latitude)]}
+
+
+
+init_lock = threading.Lock()
+
 
 def get_db_instance(mongodb="mongo"):
     """ Get mongo instance by prefix
 
         :param mongodb: default = "mongo"
     """
+    if getattr(app, "mongo_pid", None) != os.getpid():
+        with init_lock:
+            if getattr(app, "mongo_pid", None) != os.getpid():
+                # first use in this process (tools, replay / partition workers): clients created
+                # before a fork are never reused, app.start_worker() makes them in web workers
+                init_mongo(app)
 
     if isinstance(app.config['MGDB_PREFIX'],str) and mongodb == "mongo":
         return app.mongo
@@ -123,6 +383,147 @@ def get_db_instance(mongodb="mongo"):
         return db_instance
 
 
+def get_read_db(mongodb="mongo", primary=False):
+    """ Database handle for reads: routed by the prefix's READ_PREFERENCE
+        (e.g. secondaryPreferred with MAX_STALENESS_SECONDS), or the primary when asked.
+        Writes always use get_db_instance(...).db
+    """
+    db_instance = get_db_instance(mongodb=mongodb)
+    if primary:
+        return db_instance.db
+    return db_instance.read_db
+
+
+def pool_stats():
+    """ Connection pool checkout stats per prefix, see db.connection.PoolStats
+    """
+    mgdb_prefix = app.config['MGDB_PREFIX']
+    if isinstance(mgdb_prefix, str):
+        return {mgdb_prefix: get_db_instance().pool_stats.snapshot()}
+    return dict((prefix, get_db_instance(mongodb=prefix.lower()).pool_stats.snapshot())
+                for prefix in mgdb_prefix)
+
+
+breakers = {}
+
+
+def get_breaker(mongodb="mongo"):
+    """ Circuit breaker of a prefix, see common/circuit_breaker.py
+    """
+    breaker = breakers.get(mongodb)
+    if breaker is None:
+        breaker = breakers.setdefault(mongodb, CircuitBreaker(
+            "mongo" if mongodb == "mongo" else "mongo_" + mongodb,
+            failure_threshold=app.config['BREAKER_FAILURE_THRESHOLD'],
+            reset_seconds=app.config['BREAKER_RESET_SECONDS']))
+    return breaker
+
+
+def check_available(mongodb="mongo", deadline=None):
+    """ Fail fast, before a lazy cursor is created: DeadlineExceeded once the request's budget
+        is spent, CircuitOpenError while the prefix's breaker is open. Its round trips then
+        go through guarded(), see GuardedCursor
+    """
+    if deadline is not None:
+        deadline.check("mongo")
+    get_breaker(mongodb).check_open()
+
+
+def time_limit(deadline, option):
+    """ Server-side time limit for the remaining budget, e.g. {"max_time_ms": 850}
+    """
+    if deadline is None:
+        return {}
+    return {option: max(1, deadline.remaining_ms())}
+
+
+@contextlib.contextmanager
+def guarded(mongodb="mongo", deadline=None):
+    """ Run one operation within the request's deadline (pymongo.timeout when the driver has it,
+        otherwise the client's socket timeouts) and through the prefix's circuit breaker
+    """
+    if deadline is not None:
+        deadline.check("mongo")
+    breaker = get_breaker(mongodb)
+    breaker.check()
+    try:
+        if deadline is not None and hasattr(pymongo, "timeout"):
+            with pymongo.timeout(deadline.remaining()):
+                yield
+        else:
+            yield
+    except UNAVAILABLE:
+        if deadline is not None and deadline.expired():
+            # timed out on the request's budget, maybe spent elsewhere (e.g. the Graph API):
+            # says nothing about Mongo
+            breaker.release()
+        else:
+            breaker.record_failure()
+        raise
+    except Exception:
+        # the server answered (duplicate key, bad query...)
+        breaker.record_success()
+        raise
+    else:
+        breaker.record_success()
+
+
+def buffered_documents(cursor):
+    """ Documents of the current batch a pymongo cursor still holds, served by next() without a
+        round trip. None when the driver doesn't tell
+    """
+    for name in ("_data", "_Cursor__data", "_CommandCursor__data"):
+        data = getattr(cursor, name, None)
+        if data is not None:
+            return len(data)
+    return None
+
+
+class GuardedCursor:
+    """ A cursor whose round trips (first batch, getMore) go through guarded(): they happen
+        while iterating, after the helper that created the cursor has returned. Documents
+        already fetched are handed out without the breaker / deadline checks.
+    """
+
+    def __init__(self, cursor, mongodb="mongo", deadline=None):
+        self.cursor = cursor
+        self.mongodb = mongodb
+        self.deadline = deadline
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if buffered_documents(self.cursor):
+            document = next(self.cursor, None)
+        else:
+            # next() fetches a batch
+            with guarded(self.mongodb, self.deadline):
+                document = next(self.cursor, None)
+        if document is None:
+            raise StopIteration
+        return document
+
+    next = __next__
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cursor.close()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.cursor, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            # chained cursor methods (sort, limit, batch_size...) stay guarded
+            return self if result is self.cursor else result
+        return call
+
+
 def check_one_query(collection=None, query=None):
     """ Check query params of 'do-one' function
     """
@@ -149,36 +550,87 @@ class MongoCollection():
 
 
 
-    def find_one(self, query={}):
-        return find_one(collection=self.collection, query=query, mongodb=self.mongodb)
+    def find_one(self, query={}, primary=False, deadline=None):
+        return find_one(collection=self.collection, query=query, primary=primary,
+                        deadline=deadline, mongodb=self.mongodb)
 
-    def find(self, query={}, limit=20, skip=0, sort=None, sort_field=None, sort_order=-1):
+    def find(self, query={}, limit=20, skip=0, sort=None, sort_field=None, sort_order=-1,
+             primary=False, deadline=None):
         return find(collection=self.collection, query=query,
                     limit=limit, skip=skip, sort=sort, sort_field=sort_field, sort_order=sort_order,
-                    mongodb=self.mongodb)
+                    primary=primary, deadline=deadline, mongodb=self.mongodb)
 
-    def find_by_id(self, id_array=None):
+    def find_by_id(self, id_array=None, primary=False, deadline=None):
         return find(collection=self.collection, query={"_id": {"$in": id_array}},
-                    mongodb=self.mongodb,limit=0)
+                    primary=primary, deadline=deadline, mongodb=self.mongodb,limit=0)
 
-    def update_one(self, query={}, update={}):
+    def update_one(self, query={}, update={}, upsert=False, deadline=None):
         return update_one(collection=self.collection, query=query,
-                          update=update,  mongodb=self.mongodb)
+                          update=update, upsert=upsert, deadline=deadline, mongodb=self.mongodb)
 
-    def update_many(self, query={}, update={}):
+    def update_many(self, query={}, update={}, upsert=False, deadline=None):
         return update_many(collection=self.collection, query=query,
-                          update=update,  mongodb=self.mongodb)
+                          update=update, upsert=upsert, deadline=deadline, mongodb=self.mongodb)
 
-    def insert_one(self, query={}):
+    def insert_one(self, query={}, deadline=None):
         return insert_one(collection=self.collection, query=query,
-                          mongodb=self.mongodb)
+                          deadline=deadline, mongodb=self.mongodb)
+
+    def near(self, field="location", longitude=None, latitude=None, max_distance_m=None,
+             min_distance_m=None, query=None, projection=None, limit=20, primary=False, deadline=None):
+        return near(collection=self.collection, field=field, longitude=longitude, latitude=latitude,
+                    max_distance_m=max_distance_m, min_distance_m=min_distance_m, query=query,
+                    projection=projection, limit=limit, primary=primary, deadline=deadline,
+                    mongodb=self.mongodb)
+
+    def within(self, field="location", geometry=None, center=None, radius_m=None, query=None,
+               projection=None, limit=20, primary=False, deadline=None):
+        return within(collection=self.collection, field=field, geometry=geometry, center=center,
+                      radius_m=radius_m, query=query, projection=projection, limit=limit,
+                      primary=primary, deadline=deadline, mongodb=self.mongodb)
+
+    def aggregate(self, pipeline=None, allow_disk_use=False, batch_size=None, primary=False, deadline=None):
+        return aggregate(collection=self.collection, pipeline=pipeline, allow_disk_use=allow_disk_use,
+                         batch_size=batch_size, primary=primary, deadline=deadline, mongodb=self.mongodb)
 
-    def delete_one(self, query={}):
+    def watch(self, pipeline=None, resume_after=None, full_document=None, max_await_time_ms=None):
+        return watch(collection=self.collection, pipeline=pipeline, resume_after=resume_after,
+                     full_document=full_document, max_await_time_ms=max_await_time_ms, mongodb=self.mongodb)
+
+    def find_one_and_update(self, query={}, update={}, sort=None,
+                            return_document=ReturnDocument.AFTER, upsert=False, deadline=None):
+        return find_one_and_update(collection=self.collection, query=query, update=update,
+                                   sort=sort, return_document=return_document, upsert=upsert,
+                                   deadline=deadline, mongodb=self.mongodb)
+
+    def create_index(self, keys=None, **kwargs):
+        return create_index(collection=self.collection, keys=keys,
+                            mongodb=self.mongodb, **kwargs)
+
+    def index_information(self):
+        return index_information(collection=self.collection, mongodb=self.mongodb)
+
+    def drop_index(self, name=None):
+        return drop_index(collection=self.collection, name=name, mongodb=self.mongodb)
+
+    def set_ttl(self, name=None, seconds=None):
+        return set_ttl(collection=self.collection, name=name, seconds=seconds, mongodb=self.mongodb)
+
+    def delete_one(self, query={}, deadline=None):
         return delete_one(collection=self.collection, query=query,
-                          mongodb=self.mongodb)
+                          deadline=deadline, mongodb=self.mongodb)
+
+    def bulk_write(self, requests=None, ordered=True, deadline=None):
+        return bulk_write(collection=self.collection, requests=requests, ordered=ordered,
+                          deadline=deadline, mongodb=self.mongodb)
+
+    def delete_many(self, query={}, deadline=None):
+        return delete_many(collection=self.collection, query=query,
+                           deadline=deadline, mongodb=self.mongodb)
 
-    def check_exist(self, query={}):
-        find = self.find_one(query=query)
+    def check_exist(self, query={}, deadline=None):
+        # usually followed by a write, so don't read a stale secondary
+        find = self.find_one(query=query, primary=True, deadline=deadline)
         if find is not None:
             return True
 
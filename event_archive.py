@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+event_archive.py
+
+Append-only archive of raw webhook bodies on local disk, for replay when
+debugging or load testing.
+
+Each process appends to its own segment files (events-<first ms>-<pid>.seg),
+rotated by size. A segment is a run of zlib-compressed blocks:
+
+    block  = header + zlib(records)
+    header = magic "EVB1", compressed length, raw length, record count, min ts, max ts
+    record = ts (ms), senders length, body length, senders ("," joined), body
+
+Next to it, events-...idx has one JSON line per block: offset, size, time range
+and a small bloom filter of the senders in it. That sparse index lets the reader
+skip straight to the blocks of a time range / sender; segments are read through
+mmap, so a block is decompressed straight from the page cache.
+
+A full block is compressed outside the writer's lock, so request threads don't
+wait on zlib; blocks are still written in the order they were filled. When a
+segment rotates, the oldest segments of the directory (any process) are deleted
+until the archive fits max_bytes / max_segments.
+"""
+
+import os
+import json
+import mmap
+import time
+import zlib
+import heapq
+import atexit
+import struct
+import hashlib
+import threading
+from common.log_util import log
+
+BLOCK_MAGIC = b"EVB1"
+BLOCK_HEADER = struct.Struct("<4sIIIqq")
+RECORD_HEADER = struct.Struct("<qHI")
+BLOOM_BITS = 1024
+
+
+def bloom_positions(sender_id):
+    digest = hashlib.md5(sender_id.encode("utf-8")).digest()
+    return [struct.unpack_from("<H", digest, i * 2)[0] % BLOOM_BITS for i in range(3)]
+
+
+def bloom_add(bloom, sender_id):
+    for position in bloom_positions(sender_id):
+        bloom[position // 8] |= 1 << (position % 8)
+
+
+def bloom_may_contain(bloom, sender_id):
+    return all(bloom[position // 8] & (1 << (position % 8)) for position in bloom_positions(sender_id))
+
+
+class ArchiveWriter:
+
+    def __init__(self, directory, block_bytes=256 * 1024, segment_bytes=256 * 1024 * 1024,
+                 flush_seconds=5, level=6, max_bytes=0, max_segments=0):
+        """
+            :param block_bytes: raw bytes buffered before a block is compressed and written
+            :param flush_seconds: a partial block is written after this long, so at most
+                this much traffic is lost if the process dies
+            :param max_bytes: total size of the segments kept in directory, 0 = no limit
+            :param max_segments: number of segments kept in directory, 0 = no limit
+        """
+        self.directory = directory
+        self.block_bytes = block_bytes
+        self.segment_bytes = segment_bytes
+        self.flush_seconds = flush_seconds
+        self.level = level
+        self.max_bytes = max_bytes
+        self.max_segments = max_segments
+        # lock: the block being filled; write_lock: the segment files, blocks taken in turn
+        self.lock = threading.Lock()
+        self.write_lock = threading.Condition()
+        self.blocks_taken = 0
+        self.blocks_written = 0
+        self.segment = None
+        self.index = None
+        self.reset_block()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        flusher = threading.Thread(target=self.flush_periodically, name="archive-flush")
+        flusher.daemon = True
+        flusher.start()
+        atexit.register(self.close)
+
+    def reset_block(self):
+        self.block = bytearray()
+        self.block_count = 0
+        self.block_min_ts = None
+        self.block_max_ts = None
+        self.block_bloom = bytearray(BLOOM_BITS // 8)
+        self.block_started = None
+
+    def append(self, body, senders=(), ts_ms=None):
+        """ body: raw request bytes, senders: sender ids of the events in it
+        """
+        ts_ms = ts_ms if ts_ms is not None else int(time.time() * 1000)
+        sender_bytes = ",".join(senders).encode("utf-8")
+        with self.lock:
+            self.block += RECORD_HEADER.pack(ts_ms, len(sender_bytes), len(body))
+            self.block += sender_bytes
+            self.block += body
+            self.block_count += 1
+            self.block_min_ts = ts_ms if self.block_min_ts is None else min(self.block_min_ts, ts_ms)
+            self.block_max_ts = ts_ms if self.block_max_ts is None else max(self.block_max_ts, ts_ms)
+            for sender_id in senders:
+                bloom_add(self.block_bloom, sender_id)
+            if self.block_started is None:
+                self.block_started = time.time()
+            full = self.take_block() if len(self.block) >= self.block_bytes else None
+        if full is not None:
+            self.write_block(full)
+
+    def flush(self):
+        with self.lock:
+            block = self.take_block() if self.block_count else None
+        if block is not None:
+            self.write_block(block)
+
+    def flush_periodically(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            started = self.block_started
+            if started is not None and time.time() - started >= self.flush_seconds:
+                try:
+                    self.flush()
+                except Exception as e:
+                    log("archive flush failed: %r" % e)
+
+    def take_block(self):
+        # called with the lock held: hand the filled block over to write_block, start a new one
+        block = (bytes(self.block), self.block_count, self.block_min_ts, self.block_max_ts,
+                 bytes(self.block_bloom), self.blocks_taken)
+        self.blocks_taken += 1
+        self.reset_block()
+        return block
+
+    def write_block(self, block):
+        raw, count, min_ts, max_ts, bloom, number = block
+        payload = zlib.compress(raw, self.level)
+        with self.write_lock:
+            # blocks compressed at the same time are written in the order they were taken
+            while self.blocks_written != number:
+                self.write_lock.wait()
+            try:
+                if self.segment is None or self.segment.tell() >= self.segment_bytes:
+                    self.open_segment(min_ts)
+                offset = self.segment.tell()
+                self.segment.write(BLOCK_HEADER.pack(BLOCK_MAGIC, len(payload), len(raw), count, min_ts, max_ts))
+                self.segment.write(payload)
+                self.segment.flush()
+                # the index line goes after the block: a reader never sees an entry for a partial block
+                self.index.write(json.dumps({"offset": offset, "size": BLOCK_HEADER.size + len(payload),
+                                             "count": count, "min_ts": min_ts, "max_ts": max_ts,
+                                             "bloom": bloom.hex()}) + "\n")
+                self.index.flush()
+            finally:
+                self.blocks_written += 1
+                self.write_lock.notify_all()
+
+    def open_segment(self, ts_ms):
+        # called with write_lock held
+        self.close_segment()
+        base = os.path.join(self.directory, "events-%013d-%d" % (ts_ms, os.getpid()))
+        self.segment = open(base + ".seg", "ab")
+        self.index = open(base + ".idx", "a")
+        if self.max_bytes or self.max_segments:
+            self.prune(base + ".seg")
+
+    def prune(self, current):
+        """ Delete the oldest segments (and their index) of the directory, whichever process wrote
+            them, until the rest fits max_bytes / max_segments. Segments still being written to by
+            another process (modified within flush_seconds) and our current one are kept.
+        """
+        segments = []
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".seg"):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # pruned by another process meanwhile
+                    continue
+                segments.append((path, stat.st_size, stat.st_mtime))
+        total = sum(size for path, size, mtime in segments)
+        count = len(segments)
+        recent = time.time() - self.flush_seconds
+        for path, size, mtime in segments:
+            if (not self.max_bytes or total <= self.max_bytes) and (not self.max_segments or count <= self.max_segments):
+                break
+            if path == current or mtime >= recent:
+                continue
+            for doomed in (path, path[:-4] + ".idx"):
+                try:
+                    os.remove(doomed)
+                except OSError:
+                    pass
+            total -= size
+            count -= 1
+            log("archive: deleted %s" % os.path.basename(path))
+
+    def close_segment(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.index.close()
+            self.segment = self.index = None
+
+    def close(self):
+        self.flush()
+        with self.write_lock:
+            self.close_segment()
+
+
+class ArchiveReader:
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def segments(self):
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(".seg"))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def block_entries(self, segment_path, data):
+        """ Index entries of a segment; blocks written after the last index line
+            (crash in between) are found by walking the block headers
+        """
+        entries = []
+        index_path = segment_path[:-4] + ".idx"
+        if os.path.exists(index_path):
+            with open(index_path) as index:
+                for line in index:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        break
+        offset = entries[-1]["offset"] + entries[-1]["size"] if entries else 0
+        while offset + BLOCK_HEADER.size <= len(data):
+            magic, compressed, raw, count, min_ts, max_ts = BLOCK_HEADER.unpack_from(data, offset)
+            if magic != BLOCK_MAGIC or offset + BLOCK_HEADER.size + compressed > len(data):
+                break
+            entries.append({"offset": offset, "size": BLOCK_HEADER.size + compressed, "count": count,
+                            "min_ts": min_ts, "max_ts": max_ts, "bloom": None})
+            offset += BLOCK_HEADER.size + compressed
+        return entries
+
+    def read_segment(self, segment_path, start_ms, end_ms, sender_id):
+        if os.path.getsize(segment_path) == 0:
+            return
+        with open(segment_path, "rb") as source:
+            data = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(data)
+            try:
+                for entry in self.block_entries(segment_path, data):
+                    if entry["max_ts"] < start_ms or entry["min_ts"] > end_ms:
+                        continue
+                    if sender_id is not None and entry["bloom"] is not None and \
+                            not bloom_may_contain(bytearray.fromhex(entry["bloom"]), sender_id):
+                        continue
+                    begin = entry["offset"] + BLOCK_HEADER.size
+                    block = zlib.decompress(view[begin:entry["offset"] + entry["size"]])
+                    position = 0
+                    while position < len(block):
+                        ts_ms, senders_length, body_length = RECORD_HEADER.unpack_from(block, position)
+                        position += RECORD_HEADER.size
+                        senders = block[position:position + senders_length].decode("utf-8")
+                        position += senders_length
+                        body = block[position:position + body_length]
+                        position += body_length
+                        if ts_ms < start_ms or ts_ms > end_ms:
+                            continue
+                        if sender_id is not None and sender_id not in senders.split(","):
+                            continue
+                        yield ts_ms, senders, body
+            finally:
+                view.release()
+                data.close()
+
+    def read(self, start_ms=0, end_ms=2 ** 62, sender_id=None):
+        """ Archived bodies in [start_ms, end_ms], in time order across segments
+            rtype: iterator of (ts_ms, senders, body bytes)
+        """
+        iterators = [self.read_segment(path, start_ms, end_ms, sender_id) for path in self.segments()
+                     if int(os.path.basename(path).split("-")[1]) <= end_ms]
+        return heapq.merge(*iterators)
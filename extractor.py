@@ -1,16 +1,62 @@
 import re
+from phone import default_recognizer
+
+# compiled once at import instead of on every message
+EMAIL_PATTERN = re.compile(r'[\w\.-]+@[\w\.-]+')
+NON_DIGITS = re.compile(r"\D")
+
+
+def normalize_email(email):
+    """ Canonical email key: trimmed and lowercased
+    """
+    if not email:
+        return None
+    return email.strip().lower()
+
+
+def normalize_phone(phone, recognizer=None):
+    """ Canonical E.164 phone key, by the country rules of phone_rules.json:
+        "0988 123 456" -> "+84988123456", "555-555-5555" -> "+15555555555"
+        rtype: str, None when the number doesn't match any country
+    """
+    if not phone:
+        return None
+    match = (recognizer or default_recognizer()).find(phone)
+    if match is not None:
+        return match.e164
+    if phone.strip().startswith("+"):
+        # international number of a country we have no rule for, without a "(0)" trunk prefix
+        return "+" + NON_DIGITS.sub("", phone.replace("(0)", ""))
+    return None
 
 
 class Extractor:
+    def __init__(self, recognizer=None):
+        # phone formats of every country in phone_rules.json (US & VN by default)
+        self.recognizer = recognizer or default_recognizer()
+
     def extract_details(self, from_msg):
         """
         rtype: email, phone
         """
-        # email format
-        email = re.search(r'[\w\.-]+@[\w\.-]+', from_msg)
-
-        # US & VN mobile phone formats: 555-555-5555, 0988 123 456, 0165 123 4567
-        phone = re.search(r"\(?\b[0-9][0-9]{2}\)?[-. ]?[0-9][0-9]{2}[-. ]?[0-9]{4}\b|(\d{4}[-. ]?\d{3}[-. ]?(\d{3,4}|\d{4}))|(\d{10})", from_msg)
-        if email and phone and email.group(0) and phone.group(0):
-            return email.group(0), phone.group(0)
+        email = EMAIL_PATTERN.search(from_msg)
+        phone = self.recognizer.find(from_msg)
+        if email and phone and email.group(0) and phone.raw:
+            return email.group(0), phone.raw
         return "", ""
+
+    def extract_contact(self, from_msg):
+        """ Contact fields to store: the email & phone as written plus their canonical keys
+        rtype: dict, None when the message doesn't contain both an email and a phone
+        """
+        email = EMAIL_PATTERN.search(from_msg)
+        phone = self.recognizer.find(from_msg)
+        if not email or phone is None:
+            return None
+        return {
+            "email": email.group(0),
+            "phone": phone.raw,
+            "email_norm": normalize_email(email.group(0)),
+            "phone_e164": phone.e164,
+            "phone_country": phone.country
+        }
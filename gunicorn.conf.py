@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+gunicorn.conf.py
+
+Gunicorn settings for the web process:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+WEB_WORKER_CLASS  gthread (default) | gevent | sync
+WEB_CONCURRENCY   worker processes
+WEB_THREADS       threads per gthread worker
+WEB_WORKER_CONNECTIONS  concurrent requests per gevent worker
+
+Handlers, the dispatcher and the Mongo / Send API clients are shared by the
+threads (or greenlets) of a worker, so keep MONGO_MAX_POOL_SIZE and
+GRAPH_API_POOL_SIZE at least WEB_THREADS / WEB_WORKER_CONNECTIONS.
+"""
+
+import os
+import sys
+
+worker_class = os.environ.get("WEB_WORKER_CLASS", "gthread")
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+threads = int(os.environ.get("WEB_THREADS", 8))
+worker_connections = int(os.environ.get("WEB_WORKER_CONNECTIONS", 100))
+timeout = int(os.environ.get("WEB_TIMEOUT", 30))
+errorlog = "-"
+
+# gevent patches the standard library in the worker, after fork: the app has to be imported
+# after that, so it can't be preloaded. sync / gthread workers share the preloaded app.
+preload_app = worker_class != "gevent"
+if preload_app:
+    # app.py leaves its per-process state (Mongo clients, pools, threads) to post_fork
+    os.environ["START_WORKER_AFTER_FORK"] = "1"
+
+
+def post_fork(server, worker):
+    # without preload the app isn't imported yet, and starts itself when the worker loads it
+    app_module = sys.modules.get("app")
+    if app_module is not None:
+        app_module.start_worker()
@@ -7,61 +7,67 @@ Created by Tien M. Le on 2017-02-23.
 Copyright (c) 2017 __tielehut@gmail.com__. All rights reserved.
 """
 
-import re
+from pymongo.errors import DuplicateKeyError
 from common.log_util import log
 from handlers.message_handler import MessageHandler
-from db.mongo import mongo_contacts
+from extractor import Extractor
+from db.contacts import ContactsCollection
+from db.contact_stats import contact_stats
 
 
 class ContactRegistration(MessageHandler):
 
-    def __init__(self):
+    def __init__(self, mongodb="mongo", dry_run=False):
+        MessageHandler.__init__(self, mongodb=mongodb, dry_run=dry_run)
         self.extractor = Extractor()
+        self.contacts = ContactsCollection(mongodb=mongodb, collection="contacts")
 
-    def process(self, message):
-        message_text = message["message"]["data"]
+    def process(self, message, deadline=None):
+        """ message: messages.TextMessage
+        """
         reply = ""
-        email, phone = self.extractor.extract_details(message_text)
-        if email != "" and phone != "":
-            self.store_contact(message['sender_id'], email, phone)
-            reply = "Got it. Your email is " + email + " and phone is " + phone + ". Thanks."
+        contact = self.extractor.extract_contact(message.text)
+        if not self.dry_run:
+            contact_stats.bump(message.page_id, contact_attempts=1)
+        if contact is not None:
+            if not self.dry_run:
+                self.store_contact(message.sender_id, contact, page_id=message.page_id, deadline=deadline)
+            reply = "Got it. Your email is " + contact["email"] + " and phone is " + contact["phone"] + ". Thanks."
         else:
             reply = "Hi, can I have your email & phone number please?"
         return reply
 
-    def store_contact(facebook_id, email, phone):
-        check_exist = mongo_contacts.check_exist(
-            query={"facebook_id": facebook_id})
-        log(check_exist)
-        if check_exist is None:
-            # Store facebook user, name, contact email, phone
-            mongo_contacts.insert_one(query={
-                "facebook_id": facebook_id,
-                "email": email,
-                "phone": phone
-            })
-        else:
-            mongo_contacts.update_one(query={
-                "facebook_id": facebook_id,
-            }, update={
-                "$set": {
-                    "email": email,
-                    "phone": phone
-                }
-
-            })
-
-
-class Extractor:
-    def extract_details(self, from_msg):
-        """
-        rtype: email, phone
+    def store_contact(self, facebook_id, contact, page_id=None, deadline=None):
+        """ contact: email, phone and their canonical keys, see Extractor.extract_contact
         """
-        # email format
-        email = re.search(r'[\w\.-]+@[\w\.-]+', from_msg)
+        # one atomic upsert on the unique facebook_id: when two threads / workers handling the
+        # same sender both try to insert, one gets a duplicate key error and updates instead
+        try:
+            result = self.upsert_contact(facebook_id, contact, deadline=deadline)
+        except DuplicateKeyError:
+            result = self.upsert_contact(facebook_id, contact, deadline=deadline)
+        created = result.upserted_id is not None
+        log("contact %s %s" % (facebook_id, "created" if created else "updated"))
+        contact_stats.bump(page_id, contact.get("phone_country"), contacts_captured=1, contacts_new=int(created))
 
-        # US & VN mobile phone formats: 555-555-5555, 0988 123 456, 0165 123 4567
-        phone = re.search(r"\(?\b[0-9][0-9]{2}\)?[-. ]?[0-9][0-9]{2}[-. ]?[0-9]{4}\b|(\d{4}[-. ]?\d{3}[-. ]?(\d{3,4}|\d{4}))|(\d{10})", from_msg)
-        if email and phone and email.group(0) and phone.group(0):
-            return email.group(0), phone.group(0)
-        return "", ""
+    def upsert_contact(self, facebook_id, contact, deadline=None):
+        """ A sender whose contact was merged by tools/dedupe_contacts.py updates the contact
+            it was merged into: the duplicate is left out of lookups
+        """
+        try:
+            return self.contacts.update_one(query={
+                "facebook_id": facebook_id,
+                "merged_into": {"$exists": False},
+            }, update={
+                "$set": contact
+            }, upsert=True, deadline=deadline)
+        except DuplicateKeyError:
+            # either the sender's merged duplicate or a racing insert (retried by store_contact)
+            existing = self.contacts.find_one(query={"facebook_id": facebook_id}, primary=True, deadline=deadline)
+            if existing is None or "merged_into" not in existing:
+                raise
+            return self.contacts.update_one(query={
+                "_id": existing["merged_into"],
+            }, update={
+                "$set": contact
+            }, deadline=deadline)
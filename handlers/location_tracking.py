@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+location_tracking.py
+
+Keeps the last known location of each sender, see db/locations.py.
+"""
+
+from handlers.message_handler import MessageHandler
+from db.locations import LocationsCollection, LocationWriter, location_writer
+
+
+class LocationTracking(MessageHandler):
+
+    def __init__(self, mongodb="mongo", dry_run=False):
+        MessageHandler.__init__(self, mongodb=mongodb, dry_run=dry_run)
+        if mongodb == "mongo":
+            self.location_writer = location_writer
+        else:
+            self.location_writer = LocationWriter(LocationsCollection(mongodb=mongodb, collection="locations"),
+                                                  flush_seconds=location_writer.flush_seconds)
+
+    def process(self, message, deadline=None):
+        """ message: messages.LocationMessage
+        """
+        if not self.dry_run:
+            self.location_writer.record(message)
+        return "Thanks, I've noted your location."
@@ -11,11 +11,17 @@ Copyright (c) 2017 __tielehut@gmail.com__. All rights reserved.
 
 class MessageHandler:
 
-    def __init__(self):
-        pass
+    def __init__(self, mongodb="mongo", dry_run=False):
+        """ mongodb: the page's Mongo prefix, for the collections the handler writes to
+            dry_run: reply without storing or counting anything (tools/replay_archive.py)
+        """
+        self.mongodb = mongodb
+        self.dry_run = dry_run
 
-    def message_handler(self, message):
-        return self.process(message)
+    def message_handler(self, message, deadline=None):
+        return self.process(message, deadline=deadline)
 
-    def process(self, message):
+    def process(self, message, deadline=None):
+        """ deadline: common.deadline.Deadline of the request, for the handler's DB / HTTP calls
+        """
         raise Exception("Not implemented")
@@ -9,37 +9,72 @@ Copyright (c) 2017 __tielehut@gmail.com__. All rights reserved.
 
 import json
 from importlib import util as import_util
+from messages import TextMessage
+from common.profiling import profiler
 
 
 class MessageDispatcher:
 
-    def __init__(self, tasks_config_file=u"available_tasks.json"):
+    def __init__(self, tasks_config_file=u"available_tasks.json", attachment_pipeline=None, stats=None,
+                 mongodb="mongo", dry_run=False):
+        """ stats: db.contact_stats.ContactStatsRecorder counting messages, or None
+            mongodb: Mongo prefix the handlers store their data through (the page's, see pages.py)
+            dry_run: handlers reply without storing anything, see MessageHandler
+        """
         self.handlers = dict()
+        self.attachment_pipeline = attachment_pipeline
+        self.stats = stats
         config = json.loads(open(tasks_config_file, 'r').read())
         for handler_name, handler_config in config.items():
             spec = import_util.spec_from_file_location("module.name", handler_config['path'])
             module = import_util.module_from_spec(spec)
             spec.loader.exec_module(module)
-            handler = getattr(module, handler_config['class'])()
+            handler = getattr(module, handler_config['class'])(mongodb=mongodb, dry_run=dry_run)
             self.handlers[handler_name] = handler
 
     # TODO(tien): dispatch message to a real its handler
-    # Now all text messages will be dispatched to ContactRegistration handler, otherwise pass
+    # Now all text messages will be dispatched to ContactRegistration handler, locations to LocationTracking,
+    # otherwise pass
     def dispatch_message(self, message):
-        if message is not None and message['type'] == "text":
-            return self.handlers['contact_registration']
+        if message is not None and message.kind == "text":
+            return self.handlers.get('contact_registration')
+        if message is not None and message.kind == "location":
+            return self.handlers.get('location_tracking')
         return None
 
-    def dispatch_and_process(self, sender_id, message):
+    @profiler.profiled("dispatch")
+    def dispatch_and_process(self, message, deadline=None):
+        """ message: a messages.Message, passed to the handler as is
+            deadline: common.deadline.Deadline of the request, passed down to the handler
+        """
+        if message is not None and self.stats is not None:
+            self.stats.bump(message.page_id, messages=1)
+        if message is not None and message.kind == "attachments" and self.attachment_pipeline is not None:
+            if self.attachment_pipeline.submit(message):
+                # replied from process_attachment_text once the attachments are processed
+                return None
+        return self.process(message, deadline=deadline)
+
+    def process(self, message, deadline=None):
         handler = self.dispatch_message(message)
         if handler is not None:
-            return handler.process(sender_id, message)
+            return handler.process(message, deadline=deadline)
+        if message is not None and self.stats is not None:
+            self.stats.bump(message.page_id, unhandled=1)
         return "Sorry, I can't understand this at the moment"
 
+    def process_attachment_text(self, message, attachment, text):
+        """ Text read from a photo / voice note is handled like a text message
+        """
+        text_message = TextMessage(message.sender_id, text, message_id=message.message_id,
+                                   page_id=message.page_id, timestamp=message.timestamp)
+        # already counted as a message when the attachments came in
+        return self.process(text_message)
+
 
 def main():
     dispatcher = MessageDispatcher()
-    reply = dispatcher.process_message_get_reply("this is a test message")
+    reply = dispatcher.dispatch_and_process(TextMessage("test", "this is a test message"))
     print(reply)
 
 if __name__ == "__main__":
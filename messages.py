@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+messages.py
+
+Typed messages passed from the webhook through the dispatcher to the handlers.
+They are built once from a Messenger messaging event (from_messaging_event) and
+not copied afterwards. __slots__ keeps each one to a few fields with no
+per-instance dict; see tools/bench_message_model.py for the cost against the
+plain dicts used before.
+"""
+
+
+class Message(object):
+    __slots__ = ("sender_id", "message_id", "page_id", "timestamp")
+    kind = None
+
+    def __init__(self, sender_id, message_id=None, page_id=None, timestamp=None):
+        self.sender_id = sender_id
+        self.message_id = message_id
+        self.page_id = page_id
+        self.timestamp = timestamp
+
+    def to_document(self):
+        """ Plain dict for storage (partition event queue), see message_from_document
+        """
+        document = {"kind": self.kind}
+        for cls in type(self).__mro__:
+            for name in getattr(cls, "__slots__", ()):
+                document[name] = getattr(self, name)
+        return document
+
+    def __repr__(self):
+        return "%s(%r)" % (type(self).__name__, self.to_document())
+
+
+class TextMessage(Message):
+    __slots__ = ("text",)
+    kind = "text"
+
+    def __init__(self, sender_id, text, message_id=None, page_id=None, timestamp=None):
+        self.sender_id = sender_id
+        self.message_id = message_id
+        self.page_id = page_id
+        self.timestamp = timestamp
+        self.text = text
+
+
+class LocationMessage(Message):
+    __slots__ = ("latitude", "longitude")
+    kind = "location"
+
+    def __init__(self, sender_id, latitude, longitude, message_id=None, page_id=None, timestamp=None):
+        self.sender_id = sender_id
+        self.message_id = message_id
+        self.page_id = page_id
+        self.timestamp = timestamp
+        self.latitude = latitude
+        self.longitude = longitude
+
+
+class Attachment(object):
+    __slots__ = ("type", "url")
+
+    def __init__(self, type, url):
+        self.type = type
+        self.url = url
+
+
+class AttachmentMessage(Message):
+    __slots__ = ("attachments",)
+    kind = "attachments"
+
+    def __init__(self, sender_id, attachments, message_id=None, page_id=None, timestamp=None):
+        self.sender_id = sender_id
+        self.message_id = message_id
+        self.page_id = page_id
+        self.timestamp = timestamp
+        # tuple of Attachment
+        self.attachments = attachments
+
+    def to_document(self):
+        document = Message.to_document(self)
+        document["attachments"] = [{"type": a.type, "url": a.url} for a in self.attachments]
+        return document
+
+
+def from_messaging_event(event, page_id=None):
+    """ Build the message of a Messenger messaging event
+        rtype: TextMessage, LocationMessage, AttachmentMessage or None (not a message we handle)
+    """
+    message = event.get("message")
+    if not message:
+        return None
+    sender_id = event["sender"]["id"]
+    # Text only
+    if "text" in message and "quick_reply" not in message:
+        return TextMessage(sender_id, message["text"], message.get("mid"), page_id, event.get("timestamp"))
+    # Attachments (image, audio, video, file, location...), possibly several
+    if "attachments" in message:
+        attachments = message["attachments"]
+        if attachments and attachments[0]["type"] == "location":
+            coordinates = attachments[0]["payload"]["coordinates"]
+            return LocationMessage(sender_id, coordinates["lat"], coordinates["long"],
+                                   message.get("mid"), page_id, event.get("timestamp"))
+        return AttachmentMessage(sender_id, tuple([
+            # photos are sent as "image"
+            Attachment("image" if a["type"] == "photo" else a["type"], (a.get("payload") or {}).get("url"))
+            for a in attachments]), message.get("mid"), page_id, event.get("timestamp"))
+    return None
+
+
+def message_from_document(document):
+    """ Inverse of Message.to_document
+    """
+    kwargs = {"message_id": document.get("message_id"), "page_id": document.get("page_id"),
+              "timestamp": document.get("timestamp")}
+    kind = document["kind"]
+    if kind == "text":
+        return TextMessage(document["sender_id"], document["text"], **kwargs)
+    if kind == "location":
+        return LocationMessage(document["sender_id"], document["latitude"], document["longitude"], **kwargs)
+    if kind == "attachments":
+        return AttachmentMessage(document["sender_id"], tuple(
+            Attachment(a["type"], a["url"]) for a in document["attachments"]), **kwargs)
+    raise ValueError("unknown message kind %r" % kind)
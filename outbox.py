@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+outbox.py
+
+Durable outbox for replies. Every reply is stored in the 'outbox' collection
+before it is sent, so a failed send is retried by the replay worker instead of
+being lost:
+
+    python outbox.py
+
+Sent and failed replies get a done_at date, and are removed by a TTL index
+retention_days later.
+"""
+
+import time
+import datetime
+from common.log_util import log
+from common.deadline import DeadlineExceeded
+from common.circuit_breaker import CircuitOpenError
+from db.mongo import mongo_outbox, UNAVAILABLE
+
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+
+class Outbox:
+
+    def __init__(self, sender, max_attempts=8, retry_base_seconds=15, lease_seconds=60, senders=None,
+                 retention_days=7):
+        """ sender: MessageSender for replies without a page id
+            senders: dict of page id -> that page's MessageSender (pages.py)
+        """
+        self.sender = sender
+        self.senders = senders or {}
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.lease_seconds = lease_seconds
+        self.retention_days = retention_days
+
+    def ensure_indexes(self):
+        # claim query: status in (pending, sending) and next_attempt_at <= now
+        mongo_outbox.create_index([("status", 1), ("next_attempt_at", 1)],
+                                  name="status_next_attempt_at")
+        # only sent / failed replies have done_at: pending ones never expire
+        ttl = self.retention_days * 24 * 3600
+        index = (mongo_outbox.index_information() or {}).get("done_at_ttl")
+        if index is None:
+            mongo_outbox.create_index([("done_at", 1)], name="done_at_ttl", expireAfterSeconds=ttl)
+        elif index.get("expireAfterSeconds") != ttl:
+            # OUTBOX_RETENTION_DAYS changed: create_index would fail on the existing index
+            mongo_outbox.set_ttl("done_at_ttl", ttl)
+
+    def backfill_done_at(self):
+        """ done_at for replies settled before it existed, so the TTL index removes them too
+        """
+        for status in (SENT, FAILED):
+            mongo_outbox.update_many(query={"status": status, "done_at": {"$exists": False}},
+                                     update=[{"$set": {"done_at": "$updated_at"}}])
+
+    def sender_for(self, page_id):
+        return self.senders.get(page_id, self.sender)
+
+    def deliver(self, recipient_id, message_text, page_id=None, deadline=None):
+        """ Store the reply then try to send it right away, within the request's deadline
+        """
+        now = datetime.datetime.utcnow()
+        result = mongo_outbox.insert_one(query={
+            "recipient_id": recipient_id,
+            "page_id": page_id,
+            "text": message_text,
+            "status": SENDING,
+            "attempts": 1,
+            # if this process dies mid-send, the replay worker picks it up after the lease
+            "next_attempt_at": now + datetime.timedelta(seconds=self.lease_seconds),
+            "created_at": now,
+            "updated_at": now
+        }, deadline=deadline)
+        doc = {"_id": result.inserted_id, "attempts": 1}
+        sent, error = self.sender_for(page_id).send(recipient_id, message_text, deadline=deadline)
+        try:
+            if sent:
+                self.mark_sent([doc["_id"]], deadline=deadline)
+            else:
+                self.mark_failed(doc, error, deadline=deadline)
+        except (DeadlineExceeded, CircuitOpenError) + UNAVAILABLE as e:
+            # still SENDING: the replay worker settles it once the lease is over
+            log("outbox %s left to the replay worker: %r" % (doc["_id"], e))
+        return sent
+
+    def claim_due(self, batch_size=50):
+        """ Claim up to batch_size due messages. Each claim is an atomic find-and-modify,
+            so concurrent replay workers never get the same message.
+        """
+        claimed = []
+        while len(claimed) < batch_size:
+            now = datetime.datetime.utcnow()
+            doc = mongo_outbox.find_one_and_update(
+                query={"status": {"$in": [PENDING, SENDING]},
+                       "next_attempt_at": {"$lte": now}},
+                update={"$set": {"status": SENDING,
+                                 "next_attempt_at": now + datetime.timedelta(seconds=self.lease_seconds),
+                                 "updated_at": now},
+                        "$inc": {"attempts": 1}},
+                sort=[("next_attempt_at", 1)])
+            if doc is None:
+                break
+            claimed.append(doc)
+        return claimed
+
+    def replay(self, batch_size=50):
+        """ Send one batch of due messages
+            rtype: number of messages sent
+        """
+        if self.sender.breaker.is_open():
+            # every send would fail fast and use up an attempt: leave them due
+            return 0
+        sent_ids = []
+        for doc in self.claim_due(batch_size=batch_size):
+            sent, error = self.sender_for(doc.get("page_id")).send(doc["recipient_id"], doc["text"])
+            if sent:
+                sent_ids.append(doc["_id"])
+            else:
+                self.mark_failed(doc, error)
+        self.mark_sent(sent_ids)
+        return len(sent_ids)
+
+    def mark_sent(self, ids, deadline=None):
+        if ids:
+            now = datetime.datetime.utcnow()
+            mongo_outbox.update_many(query={"_id": {"$in": ids}},
+                                     update={"$set": {"status": SENT, "updated_at": now, "done_at": now}},
+                                     deadline=deadline)
+
+    def mark_failed(self, doc, error, deadline=None):
+        now = datetime.datetime.utcnow()
+        if doc["attempts"] >= self.max_attempts:
+            update = {"status": FAILED, "last_error": error, "updated_at": now, "done_at": now}
+        else:
+            # exponential backoff: 15s, 30s, 60s, ...
+            delay = self.retry_base_seconds * (2 ** (doc["attempts"] - 1))
+            update = {"status": PENDING, "last_error": error, "updated_at": now,
+                      "next_attempt_at": now + datetime.timedelta(seconds=delay)}
+        mongo_outbox.update_one(query={"_id": doc["_id"]}, update={"$set": update}, deadline=deadline)
+
+
+def main():
+    from app import app, outbox
+    config = app.config
+    outbox.ensure_indexes()
+    outbox.backfill_done_at()
+    while True:
+        sent = outbox.replay(batch_size=config['OUTBOX_BATCH_SIZE'])
+        if sent:
+            log("outbox: replayed %d messages" % sent)
+        # keep draining while there is a backlog, otherwise poll
+        if sent < config['OUTBOX_BATCH_SIZE']:
+            time.sleep(config['OUTBOX_POLL_SECONDS'])
+
+if __name__ == "__main__":
+    main()
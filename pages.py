@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+pages.py
+
+Multi-page mode: one deployment serving several Facebook pages. With PAGES_FILE
+set, pages are loaded once from that JSON file (see pages.example.json):
+
+    {
+      "databases": {"SHOP2": {"uri_env": "SHOP2_MONGO_URI", "dbname": "contact_bot_shop2"}},
+      "pages": {
+        "1234567890": {"name": "shop-hcm", "access_token_env": "PAGE_ACCESS_TOKEN_SHOP_HCM"},
+        "2345678901": {"name": "shop-hn", "access_token_env": "PAGE_ACCESS_TOKEN_SHOP_HN",
+                       "tasks": "available_tasks.json", "mongodb": "SHOP2"}
+      }
+    }
+
+Each page gets its own access token (read once), pooled MessageSender and
+MessageDispatcher built from its "tasks" file (available_tasks.json by
+default), whose handlers store their data through the page's Mongo prefix
+("mongodb", MONGO by default). Extra databases become extra MGDB_PREFIX
+entries, with the pool options of the MONGO prefix.
+
+Without PAGES_FILE there is a single default page using PAGE_ACCESS_TOKEN,
+available_tasks.json and the MONGO prefix, serving every page id.
+"""
+
+import os
+import json
+from common.log_util import log
+
+DEFAULT_TASKS = u"available_tasks.json"
+
+
+def load_pages_file(config):
+    """ Read PAGES_FILE and add its databases to the Flask config as MGDB_PREFIX entries.
+        Must run before the Mongo clients are created.
+        rtype: dict of page id -> page config, empty without PAGES_FILE
+    """
+    path = config.get('PAGES_FILE')
+    if not path:
+        return {}
+    with open(path) as pages_file:
+        pages_config = json.load(pages_file)
+    base = config['MGDB_PREFIX']
+    prefixes = [base] if isinstance(base, str) else list(base)
+    for name, database in sorted(pages_config.get("databases", {}).items()):
+        if name in prefixes:
+            continue
+        # pool, timeout and read preference options follow the first prefix
+        for key, value in list(config.items()):
+            if key.startswith(prefixes[0] + "_") and key not in (prefixes[0] + "_URI", prefixes[0] + "_DBNAME"):
+                config.setdefault(name + key[len(prefixes[0]):], value)
+        config[name + "_URI"] = os.environ[database["uri_env"]] if "uri_env" in database else database["uri"]
+        config[name + "_DBNAME"] = database.get("dbname")
+        prefixes.append(name)
+    if len(prefixes) > 1:
+        config['MGDB_PREFIX'] = prefixes
+    return pages_config.get("pages", {})
+
+
+class Page:
+    __slots__ = ("page_id", "name", "mongodb", "sender", "dispatcher")
+
+    def __init__(self, page_id, name, mongodb, sender, dispatcher):
+        self.page_id = page_id
+        self.name = name
+        # lowercased prefix, as db.mongo names it ("mongo", "shop2")
+        self.mongodb = mongodb
+        self.sender = sender
+        self.dispatcher = dispatcher
+
+    def __repr__(self):
+        return "Page(%r, %r, %r)" % (self.page_id, self.name, self.mongodb)
+
+
+class PageRegistry:
+
+    def __init__(self, pages_config, make_sender, make_dispatcher):
+        """ make_sender(page_id, access_token) -> MessageSender
+            make_dispatcher(tasks_config_file, mongodb) -> MessageDispatcher
+        """
+        self.pages = {}
+        self.default = None
+        dispatchers = {}
+        for page_id, page_config in sorted(pages_config.items()):
+            if "access_token_env" in page_config:
+                access_token = os.environ[page_config["access_token_env"]]
+            else:
+                access_token = page_config["access_token"]
+            mongodb = page_config.get("mongodb", "MONGO").lower()
+            tasks = page_config.get("tasks", DEFAULT_TASKS)
+            # pages with the same tasks and database share handler instances
+            if (tasks, mongodb) not in dispatchers:
+                dispatchers[(tasks, mongodb)] = make_dispatcher(tasks, mongodb)
+            self.pages[page_id] = Page(page_id, page_config.get("name", page_id), mongodb,
+                                       make_sender(page_id, access_token), dispatchers[(tasks, mongodb)])
+        if not self.pages:
+            # single page mode
+            self.default = Page(None, "default", "mongo", make_sender(None, os.environ.get("PAGE_ACCESS_TOKEN")),
+                                make_dispatcher(DEFAULT_TASKS, "mongo"))
+        log("serving %s" % (", ".join("%s (%s)" % (page.name, page_id) for page_id, page in sorted(self.pages.items()))
+                            or "a single page"))
+
+    def get(self, page_id):
+        """ rtype: the Page of a page id, None for a page this deployment doesn't serve
+        """
+        return self.pages.get(page_id, self.default)
+
+    def all(self):
+        return list(self.pages.values()) if self.pages else [self.default]
+
+    def dispatchers(self):
+        return list(dict((id(page.dispatcher), page.dispatcher) for page in self.all()).values())
+
+    def databases(self):
+        return sorted(set(page.mongodb for page in self.all()))
+
+    def senders(self):
+        """ rtype: dict of page id -> MessageSender
+        """
+        return dict((page.page_id, page.sender) for page in self.all())
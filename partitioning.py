@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+partitioning.py
+
+Sender-affine work distribution (PROCESSING_MODE = "partitioned").
+
+The webhook only enqueues events. Each event goes to one of PARTITION_COUNT
+partitions, picked by hashing sender_id, and gets the next sequence number of
+its partition. Partitions are spread over the live workers with rendezvous
+(highest random weight) hashing, and a worker must hold a partition's lease
+before consuming it. So one partition has exactly one consumer and every
+message of a sender is handled in order, never concurrently.
+
+When a worker joins or leaves, only the partitions whose winner changed move:
+the old owner releases them on its next tick (or its lease expires when it
+died) and the new owner claims them. The lease is renewed before each event,
+and an event gets half the lease to be handled, so a slow event can't let a
+second worker take the partition over while it is still being handled.
+
+A sequence number still missing after gap_wait_seconds is skipped; its event,
+if it is only late, is handled when it arrives, after the events around it.
+
+    python partitioning.py
+"""
+
+import sys
+import time
+import uuid
+import signal
+import socket
+import hashlib
+import datetime
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from common.log_util import log
+from common.deadline import Deadline
+from db.mongo import mongo_events, mongo_partitions, mongo_workers
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+
+def stable_hash(key):
+    """ Same value in every process, unlike hash() with PYTHONHASHSEED randomisation
+    """
+    return int(hashlib.md5(key.encode("utf-8")).hexdigest()[:16], 16)
+
+
+def partition_for(sender_id, partition_count):
+    return stable_hash(str(sender_id)) % partition_count
+
+
+def assign_partitions(worker_ids, partition_count):
+    """ Rendezvous hashing: each partition goes to the worker with the highest score
+        rtype: dict of worker_id -> set of partitions
+    """
+    assignment = dict((worker_id, set()) for worker_id in worker_ids)
+    if not worker_ids:
+        return assignment
+    for partition in range(partition_count):
+        owner = max(worker_ids, key=lambda worker_id: stable_hash("%s:%d" % (worker_id, partition)))
+        assignment[owner].add(partition)
+    return assignment
+
+
+class EventQueue:
+
+    def __init__(self, partition_count=64):
+        self.partition_count = partition_count
+
+    def ensure_indexes(self):
+        mongo_events.create_index([("partition", 1), ("seq", 1)], name="partition_seq", unique=True)
+        # late events: still pending behind the partition's done_seq
+        mongo_events.create_index([("partition", 1), ("status", 1), ("seq", 1)], name="partition_status_seq")
+        # processed events are kept for a day for debugging
+        mongo_events.create_index([("done_at", 1)], name="done_at_ttl", expireAfterSeconds=86400)
+
+    def next_seq(self, partition, deadline=None):
+        """ Take the partition's next sequence number. The partition document is created by
+            its first event, whenever that comes (before warm-up, after PARTITION_COUNT grew)
+        """
+        update = {"$inc": {"next_seq": 1},
+                  "$setOnInsert": {"owner": None, "lease_until": datetime.datetime.utcfromtimestamp(0),
+                                   "done_seq": 0}}
+        try:
+            counter = mongo_partitions.find_one_and_update(query={"_id": partition}, update=update,
+                                                           return_document=ReturnDocument.AFTER,
+                                                           upsert=True, deadline=deadline)
+        except DuplicateKeyError:
+            # two first events racing to insert it: it exists now
+            counter = mongo_partitions.find_one_and_update(query={"_id": partition}, update=update,
+                                                           return_document=ReturnDocument.AFTER,
+                                                           upsert=True, deadline=deadline)
+        return counter["next_seq"]
+
+    def enqueue(self, sender_id, message, deadline=None):
+        partition = partition_for(sender_id, self.partition_count)
+        seq = self.next_seq(partition, deadline=deadline)
+        mongo_events.insert_one(query={
+            "partition": partition,
+            "seq": seq,
+            "sender_id": sender_id,
+            "message": message,
+            "status": PENDING,
+            "created_at": datetime.datetime.utcnow()
+        }, deadline=deadline)
+        return partition, seq
+
+
+class PartitionConsumer:
+
+    def __init__(self, handle_event, worker_id=None, partition_count=64, lease_seconds=30,
+                 batch_size=20, gap_wait_seconds=5):
+        """
+            :param handle_event: function(sender_id, message, deadline) run for each event, in order;
+                deadline (common.deadline.Deadline) is half the lease
+            :param gap_wait_seconds: how long to wait for a missing sequence number (an enqueue
+                that took a number but has not inserted its event yet) before skipping it
+        """
+        self.handle_event = handle_event
+        self.worker_id = worker_id or "%s-%s" % (socket.gethostname(), uuid.uuid4().hex[:8])
+        self.partition_count = partition_count
+        self.lease_seconds = lease_seconds
+        self.batch_size = batch_size
+        self.gap_wait_seconds = gap_wait_seconds
+        self.owned = set()
+        self.gap_since = {}
+
+    def heartbeat(self):
+        mongo_workers.update_one(query={"_id": self.worker_id},
+                                 update={"$set": {"heartbeat_at": datetime.datetime.utcnow()}},
+                                 upsert=True)
+
+    def live_workers(self):
+        since = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.lease_seconds)
+        cursor = mongo_workers.find(query={"heartbeat_at": {"$gte": since}}, limit=0, primary=True)
+        return sorted(doc["_id"] for doc in cursor)
+
+    def rebalance(self):
+        """ Release partitions now assigned elsewhere, claim (or renew) our own
+        """
+        workers = self.live_workers()
+        if self.worker_id not in workers:
+            workers.append(self.worker_id)
+        wanted = assign_partitions(workers, self.partition_count)[self.worker_id]
+        for partition in self.owned - wanted:
+            mongo_partitions.update_one(query={"_id": partition, "owner": self.worker_id},
+                                        update={"$set": {"owner": None}})
+            self.owned.discard(partition)
+        now = datetime.datetime.utcnow()
+        for partition in wanted:
+            claimed = mongo_partitions.find_one_and_update(
+                query={"_id": partition,
+                       "$or": [{"owner": self.worker_id},
+                               {"owner": None},
+                               {"lease_until": {"$lt": now}}]},
+                update={"$set": {"owner": self.worker_id,
+                                 "lease_until": now + datetime.timedelta(seconds=self.lease_seconds)}})
+            if claimed is not None:
+                self.owned.add(partition)
+            else:
+                # still held by its previous owner until it releases it or its lease runs out
+                self.owned.discard(partition)
+
+    def renew_lease(self, partition):
+        """ Extend our lease on a partition, if we still hold it
+            rtype: False when the lease ran out or the partition was taken over
+        """
+        now = datetime.datetime.utcnow()
+        renewed = mongo_partitions.find_one_and_update(
+            query={"_id": partition, "owner": self.worker_id, "lease_until": {"$gte": now}},
+            update={"$set": {"lease_until": now + datetime.timedelta(seconds=self.lease_seconds)}})
+        if renewed is None:
+            self.owned.discard(partition)
+            return False
+        return True
+
+    def consume(self, partition):
+        """ Handle the late events of a partition, then its next pending events in sequence order
+            rtype: number of events handled
+        """
+        state = mongo_partitions.find_one(query={"_id": partition}, primary=True)
+        if state is None or state["owner"] != self.worker_id:
+            self.owned.discard(partition)
+            return 0
+        done_seq = state["done_seq"]
+        handled = 0
+        late = list(mongo_events.find(query={"partition": partition, "status": PENDING,
+                                             "seq": {"$lte": done_seq}},
+                                      limit=self.batch_size, sort_field="seq", sort_order=1, primary=True))
+        for event in late:
+            if not self.handle(partition, event):
+                return handled
+            handled += 1
+        events = mongo_events.find(query={"partition": partition, "seq": {"$gt": done_seq}},
+                                   limit=self.batch_size, sort_field="seq", sort_order=1,
+                                   primary=True)
+        for event in events:
+            if event["seq"] != done_seq + 1 and not self.gap_expired(partition):
+                break
+            self.gap_since.pop(partition, None)
+            if not self.handle(partition, event):
+                break
+            result = mongo_partitions.update_one(query={"_id": partition, "owner": self.worker_id},
+                                                 update={"$set": {"done_seq": event["seq"]}})
+            done_seq = event["seq"]
+            handled += 1
+            if result.modified_count == 0:
+                # lost the lease while handling, the new owner takes over from here
+                self.owned.discard(partition)
+                break
+        return handled
+
+    def handle(self, partition, event):
+        """ Renew the lease, then handle one event within half of it
+            rtype: False when the lease was lost and the event left to the new owner
+        """
+        if not self.renew_lease(partition):
+            return False
+        status = DONE
+        try:
+            self.handle_event(event["sender_id"], event["message"], Deadline(self.lease_seconds / 2.0))
+        except Exception as e:
+            # don't block the sender's later messages behind one that can't be handled
+            log("partition %d: event %d failed: %r" % (partition, event["seq"], e))
+            status = FAILED
+        now = datetime.datetime.utcnow()
+        mongo_events.update_one(query={"_id": event["_id"]},
+                                update={"$set": {"status": status, "done_at": now}})
+        return True
+
+    def gap_expired(self, partition):
+        since = self.gap_since.setdefault(partition, time.time())
+        return time.time() - since > self.gap_wait_seconds
+
+    def run_once(self):
+        self.heartbeat()
+        self.rebalance()
+        return sum(self.consume(partition) for partition in sorted(self.owned))
+
+    def run(self, poll_seconds=0.5, should_stop=None):
+        log("partition worker %s started" % self.worker_id)
+        try:
+            while should_stop is None or not should_stop():
+                if self.run_once() == 0:
+                    time.sleep(poll_seconds)
+        finally:
+            self.stop()
+
+    def stop(self):
+        """ Leave the group: release our partitions so they move without waiting for the lease
+        """
+        mongo_partitions.update_many(query={"owner": self.worker_id}, update={"$set": {"owner": None}})
+        mongo_workers.delete_one(query={"_id": self.worker_id})
+        self.owned = set()
+
+
+def main():
+    from app import app, pages, send_message
+    from messages import message_from_document
+
+    def handle_event(sender_id, document, deadline):
+        message = message_from_document(document)
+        dispatcher = pages.get(message.page_id).dispatcher
+        if document.get("attachment_text"):
+            # text read from a photo / voice note (app.on_attachment_text)
+            reply = dispatcher.process(message, deadline=deadline)
+        else:
+            reply = dispatcher.dispatch_and_process(message, deadline=deadline)
+        if reply is not None:
+            send_message(sender_id, reply, page_id=message.page_id, deadline=deadline)
+
+    # heroku stops dynos with SIGTERM: exit through stop() so partitions are released right away
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    consumer = PartitionConsumer(handle_event,
+                                 partition_count=app.config['PARTITION_COUNT'],
+                                 lease_seconds=app.config['PARTITION_LEASE_SECONDS'])
+    consumer.run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+phone.py
+
+Data-driven phone number recogniser. Country rules come from phone_rules.json:
+
+    "VN": {"country_code": "84", "trunk_prefix": "0", "national_prefixes": ["9", "16", ...],
+           "lengths": [9, 10], "separators": " -."}
+
+lengths are national number lengths, without trunk prefix or country code.
+trunk_prefix is a string or a list of them: US numbers are written with or
+without the leading 1 ("trunk_prefix": ["", "1"]). After a country code, a
+trunk prefix in parentheses is ignored: "+84 (0) 988 123 456".
+
+The rules are compiled into one prefix trie over digits, keyed both by
+trunk prefix + national prefix (0988 123 456) and by country code + national
+prefix (+84 988 123 456). A message is scanned once for digit runs, and each
+run is matched by walking the trie digit by digit, so the cost depends on the
+message length, not on the number of countries (tools/bench_phone.py).
+"""
+
+import os
+import re
+import json
+
+DEFAULT_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "phone_rules.json")
+
+# trie node keys: digits, plus TERMINALS -> list of (country, country_code, digits before the
+# national number, accepted total lengths)
+TERMINALS = "$"
+
+
+def trunk_prefixes_of(rule):
+    """ rtype: list of the trunk prefixes of a country rule
+    """
+    trunk_prefix = rule["trunk_prefix"]
+    return trunk_prefix if isinstance(trunk_prefix, list) else [trunk_prefix]
+
+
+class PhoneMatch(object):
+    __slots__ = ("raw", "e164", "country")
+
+    def __init__(self, raw, e164, country):
+        self.raw = raw
+        self.e164 = e164
+        self.country = country
+
+    def __repr__(self):
+        return "PhoneMatch(%r, %r, %r)" % (self.raw, self.e164, self.country)
+
+
+class PhoneRecognizer:
+
+    def __init__(self, rules):
+        """ rules: dict of country -> rule, see phone_rules.json
+        """
+        self.national = {}
+        self.international = {}
+        separators = set()
+        written_trunks = set()
+        for country, rule in sorted(rules.items()):
+            separators.update(rule.get("separators", " -."))
+            trunk_prefixes = trunk_prefixes_of(rule)
+            written_trunks.update(trunk_prefix for trunk_prefix in trunk_prefixes if trunk_prefix)
+            for national_prefix in rule["national_prefixes"]:
+                for trunk_prefix in trunk_prefixes:
+                    # 0988123456 / 15555555555: trunk prefix, then the national number
+                    self.add(self.national, trunk_prefix + national_prefix,
+                             (country, rule["country_code"], len(trunk_prefix),
+                              set(len(trunk_prefix) + length for length in rule["lengths"])))
+                # +84988123456 / 0084988123456: country code, then the national number
+                self.add(self.international, rule["country_code"] + national_prefix,
+                         (country, rule["country_code"], len(rule["country_code"]),
+                          set(len(rule["country_code"]) + length for length in rule["lengths"])))
+        separator_class = "".join(re.escape(c) for c in sorted(separators - set("()")))
+        # a run of digits joined by at most two separators ("(555) 555-5555"), not glued to a word
+        self.run_pattern = re.compile(r"(?<![\w+])(\+|00)?\(?\d(?:[%s()]{0,2}\d)*" % separator_class)
+        # "+84 (0) 988 123 456": the trunk prefix written in parentheses after the country code
+        self.written_trunk_pattern = re.compile(r"\((?:%s)\)" % "|".join(
+            re.escape(trunk_prefix) for trunk_prefix in sorted(written_trunks))) if written_trunks else None
+
+    @staticmethod
+    def add(trie, key, terminal):
+        node = trie
+        for digit in key:
+            node = node.setdefault(digit, {})
+        node.setdefault(TERMINALS, []).append(terminal)
+
+    @classmethod
+    def from_file(cls, path=DEFAULT_RULES_FILE):
+        with open(path) as rules_file:
+            return cls(json.load(rules_file))
+
+    def match_run(self, run):
+        """ Match one digit run, or its longest prefix ending at a separator
+            rtype: PhoneMatch or None
+        """
+        international = run.startswith("+") or run.startswith("00")
+        start = 2 if run.startswith("00") else 0
+        ignored = set()
+        if international and self.written_trunk_pattern is not None:
+            for written_trunk in self.written_trunk_pattern.finditer(run):
+                ignored.update(range(written_trunk.start(), written_trunk.end()))
+        digits = []
+        ends = []  # ends[i]: index in run just after the i-th digit
+        boundaries = set()
+        for index in range(start, len(run)):
+            char = run[index]
+            if "0" <= char <= "9" and index not in ignored:
+                digits.append(char)
+                ends.append(index + 1)
+            elif digits:
+                boundaries.add(len(digits))
+        digits = "".join(digits)
+        node = self.international if international else self.national
+        best = None
+        for digit in digits:
+            node = node.get(digit)
+            if node is None:
+                break
+            for country, country_code, skip, lengths in node.get(TERMINALS, ()):
+                for length in lengths:
+                    if length == len(digits) or (length < len(digits) and length in boundaries):
+                        if best is None or length > best[0]:
+                            best = (length, country, "+" + country_code + digits[skip:length])
+        if best is None:
+            return None
+        length, country, e164 = best
+        return PhoneMatch(run[:ends[length - 1]], e164, country)
+
+    def find_all(self, text):
+        matches = []
+        for run in self.run_pattern.finditer(text):
+            match = self.match_run(run.group(0))
+            if match is not None:
+                matches.append(match)
+        return matches
+
+    def find(self, text):
+        """ rtype: first PhoneMatch in text, or None
+        """
+        for run in self.run_pattern.finditer(text):
+            match = self.match_run(run.group(0))
+            if match is not None:
+                return match
+        return None
+
+
+_default = None
+
+
+def default_recognizer():
+    """ Recogniser for PHONE_RULES_FILE (phone_rules.json by default), loaded once
+    """
+    global _default
+    if _default is None:
+        _default = PhoneRecognizer.from_file(os.environ.get("PHONE_RULES_FILE", DEFAULT_RULES_FILE))
+    return _default
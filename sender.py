@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+sender.py
+
+Pooled client for the Messenger Send API.
+"""
+
+import os
+import json
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from common.log_util import log
+from common.circuit_breaker import CircuitBreaker
+from common.deadline import DeadlineExceeded
+
+
+class MessageSender:
+
+    def __init__(self, url="https://graph.facebook.com/v2.6/me/messages", pool_size=10, timeout=10,
+                 breaker=None, access_token=None):
+        """
+            :param timeout: seconds per Send API call, or less when the request's deadline is closer
+            :param breaker: common.circuit_breaker.CircuitBreaker, a "graph_api" one by default
+            :param access_token: the page's token, PAGE_ACCESS_TOKEN by default
+        """
+        self.url = url
+        self.access_token = access_token if access_token is not None else os.environ.get("PAGE_ACCESS_TOKEN")
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.breaker = breaker if breaker is not None else CircuitBreaker("graph_api")
+        self.reset()
+
+    def reset(self):
+        """ New connection pool, e.g. in a worker after fork: sockets inherited from the
+            parent must not be shared between processes
+        """
+        # keep-alive connections are reused across replies instead of a new TLS handshake per call.
+        # One pool per process, shared by the per-thread sessions (urllib3 pools are thread-safe)
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.local = threading.local()
+
+    @property
+    def session(self):
+        """ requests.Session of the calling thread, mounted on the shared pool
+        """
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("https://", self.adapter)
+            session.mount("http://", self.adapter)
+            session.headers.update({"Content-Type": "application/json"})
+            self.local.session = session
+        return session
+
+    def warm_up(self):
+        """ Open a pooled connection (DNS + TLS handshake) to the Graph API host
+        """
+        self.session.head(self.url, timeout=5)
+
+    def send(self, recipient_id, message_text, timeout=None, deadline=None):
+        """
+        :param deadline: common.deadline.Deadline, the call gets at most what is left of it
+        rtype: (sent, error) - error is None when the Send API accepted the message
+        """
+        timeout = timeout if timeout is not None else self.timeout
+        try:
+            if deadline is not None:
+                timeout = deadline.timeout(cap=timeout, operation="graph_api")
+        except DeadlineExceeded as e:
+            return False, str(e)
+        if not self.breaker.allow():
+            # fail fast, the outbox keeps the reply for the replay worker
+            return False, "graph_api circuit open"
+        params = {"access_token": self.access_token}
+        data = json.dumps(
+            {"recipient": {"id": recipient_id},
+             "message": {"text": message_text}}
+        )
+        try:
+            r = self.session.post(self.url, params=params, data=data, timeout=timeout)
+        except requests.RequestException as e:
+            log(e)
+            self.breaker.record_failure()
+            return False, str(e)
+        if r.status_code != 200:
+            log(r.status_code)
+            log(r.text)
+            # 5xx / throttling: the API is in trouble; other 4xx are about this message
+            if r.status_code >= 500 or r.status_code == 429:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            return False, "%s %s" % (r.status_code, r.text)
+        self.breaker.record_success()
+        return True, None
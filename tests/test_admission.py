@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+    Webhook admission control (admission.py)
+"""
+import unittest
+from admission import AdmissionController, REPLY, SPILL, RETRY
+
+
+class AdmissionTest(unittest.TestCase):
+
+    def test_enter_leave_accounting(self):
+        admission = AdmissionController(max_in_flight=2, max_latency_ms=1000)
+        self.assertTrue(admission.enter())
+        self.assertTrue(admission.enter())
+        self.assertFalse(admission.enter())
+        admission.leave(0.1)
+        self.assertTrue(admission.enter())
+        admission.leave(0.1)
+        admission.leave(0.1)
+        stats = admission.stats()
+        self.assertEqual(stats["in_flight"], 0)
+        self.assertEqual(stats["admitted"], 3)
+        self.assertEqual(stats["shed"], {RETRY: 1})
+
+    def test_disabled_admits_everything(self):
+        admission = AdmissionController(max_in_flight=0)
+        for _ in range(100):
+            self.assertTrue(admission.enter())
+        admission.leave(10)
+        self.assertIsNone(admission.stats()["limit"])
+
+    def test_limit_follows_latency_ewma(self):
+        admission = AdmissionController(max_in_flight=16, max_latency_ms=1000, alpha=0.5)
+        self.assertEqual(admission.stats()["limit"], 16)
+        for _ in range(20):
+            admission.enter()
+            admission.leave(4)
+        # EWMA close to 4000 ms: a quarter of the limit
+        self.assertEqual(admission.stats()["limit"], 4)
+        for _ in range(20):
+            admission.enter()
+            admission.leave(0.1)
+        self.assertEqual(admission.stats()["limit"], 16)
+
+    def test_limit_never_below_one(self):
+        admission = AdmissionController(max_in_flight=4, max_latency_ms=10, alpha=1)
+        admission.enter()
+        admission.leave(60)
+        self.assertEqual(admission.stats()["limit"], 1)
+        self.assertTrue(admission.enter())
+        self.assertFalse(admission.enter())
+
+    def test_mode_checks(self):
+        self.assertRaises(ValueError, AdmissionController, mode="drop")
+        self.assertRaises(ValueError, AdmissionController, mode=SPILL)
+        AdmissionController(mode=SPILL, spill_to=lambda items, deadline: True)
+
+    def test_shed_requests_counted_per_mode(self):
+        admission = AdmissionController(max_in_flight=1, mode=REPLY)
+        admission.enter()
+        admission.enter()
+        self.assertEqual(admission.stats()["shed"], {REPLY: 1})
+
+    def test_spill_counts(self):
+        stored = []
+        admission = AdmissionController(mode=SPILL, spill_to=lambda items, deadline: stored.extend(items) or True)
+        self.assertTrue(admission.spill(["a", "b"]))
+        admission.spill_to = lambda items, deadline: False
+        self.assertFalse(admission.spill(["c"]))
+        stats = admission.stats()
+        self.assertEqual(stored, ["a", "b"])
+        self.assertEqual((stats["spilled"], stats["spill_failed"]), (2, 1))
+
+    def test_shedding_bounded(self):
+        admission = AdmissionController(mode=REPLY, max_shedding=1)
+        self.assertTrue(admission.begin_shed())
+        self.assertFalse(admission.begin_shed())
+        admission.end_shed()
+        self.assertTrue(admission.begin_shed())
+        admission.end_shed()
+        self.assertEqual(admission.stats()["shed_overflow"], 1)
+        self.assertRaises(ValueError, admission.end_shed)
+
+
+if __name__ == "__main__":
+    unittest.main()
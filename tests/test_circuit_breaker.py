@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+    Circuit breaker (common/circuit_breaker.py) and request deadline (common/deadline.py)
+"""
+import unittest
+from unittest import mock
+from common.circuit_breaker import CircuitBreaker, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+from common.deadline import Deadline, DeadlineExceeded
+
+
+class Clock:
+    """ Stands in for time.monotonic
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch("common.circuit_breaker.time.monotonic", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker("test", failure_threshold=3, reset_seconds=30)
+
+    def fail(self, times):
+        for _ in range(times):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record_failure()
+
+    def test_opens_after_threshold_consecutive_failures(self):
+        self.fail(2)
+        self.breaker.record_success()
+        self.fail(2)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.fail(1)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertRaises(CircuitOpenError, self.breaker.check)
+        self.assertEqual(self.breaker.stats()["trips"], 1)
+        self.assertEqual(self.breaker.stats()["rejected"], 1)
+
+    def test_half_open_lets_one_trial_through(self):
+        self.fail(3)
+        self.clock.now += 29
+        self.assertFalse(self.breaker.allow())
+        self.clock.now += 1
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        # one trial at a time
+        self.assertFalse(self.breaker.allow())
+
+    def test_trial_success_closes(self):
+        self.fail(3)
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_trial_failure_reopens(self):
+        self.fail(3)
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertTrue(self.breaker.is_open())
+        self.assertEqual(self.breaker.stats()["trips"], 2)
+
+    def test_release_frees_the_trial_without_deciding(self):
+        self.fail(3)
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.release()
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertTrue(self.breaker.allow())
+
+    def test_check_open_leaves_the_trial(self):
+        self.fail(3)
+        self.assertRaises(CircuitOpenError, self.breaker.check_open)
+        self.clock.now += 30
+        # due for a trial: lazy operations go ahead, and the trial is still free
+        self.breaker.check_open()
+        self.assertTrue(self.breaker.allow())
+
+
+class DeadlineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch("common.deadline.time.monotonic", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_remaining_counts_down_to_zero(self):
+        deadline = Deadline(2)
+        self.assertEqual(deadline.remaining(), 2)
+        self.clock.now += 1.5
+        self.assertEqual(deadline.remaining(), 0.5)
+        self.assertEqual(deadline.remaining_ms(), 500)
+        self.assertFalse(deadline.expired())
+        self.clock.now += 1
+        self.assertEqual(deadline.remaining(), 0)
+        self.assertTrue(deadline.expired())
+
+    def test_timeout_capped_then_refused(self):
+        deadline = Deadline(5)
+        self.assertEqual(deadline.timeout(cap=2), 2)
+        self.clock.now += 4
+        self.assertEqual(deadline.timeout(cap=2), 1)
+        self.clock.now += 1
+        self.assertRaises(DeadlineExceeded, deadline.timeout, 2, "graph_api")
+        self.assertRaises(DeadlineExceeded, deadline.check)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+    Contact snapshot (contact_snapshot.py): build, lookups and change stream apply,
+    against an in-memory stand-in for the contacts collection
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from bson import ObjectId
+import contact_snapshot
+from contact_snapshot import ContactSnapshot, SnapshotStale, build, apply_changes
+
+
+class FakeChangeStream:
+
+    def __init__(self, changes):
+        self.changes = list(changes)
+        self.resume_token = {"_data": "0"}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def try_next(self):
+        if not self.changes:
+            return None
+        self.resume_token = {"_data": str(int(self.resume_token["_data"]) + 1)}
+        return self.changes.pop(0)
+
+
+class FakeContacts:
+    collection = "contacts"
+
+    def __init__(self, contacts):
+        self.contacts = contacts
+        self.changes = []
+
+    def find(self, query=None, limit=20, primary=False):
+        return iter([contact for contact in self.contacts if "merged_into" not in contact])
+
+    def watch(self, resume_after=None, full_document=None, max_await_time_ms=None):
+        changes, self.changes = self.changes, []
+        return FakeChangeStream(changes)
+
+
+def contact(email, phone_e164, facebook_id, **fields):
+    fields.update({"_id": ObjectId(), "email_norm": email, "phone_e164": phone_e164, "facebook_id": facebook_id})
+    return fields
+
+
+class ContactSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "contacts.snapshot")
+        self.contacts = [contact("user%d@example.com" % i, "+1555555%04d" % i, str(1000 + i)) for i in range(500)]
+        self.vn = contact("vn@example.com", "+84988123456", "42")
+        self.contacts.append(self.vn)
+        self.collection = FakeContacts(self.contacts)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_build_and_lookup(self):
+        # several sorted runs merged
+        self.assertEqual(build(self.collection, self.path, run_records=200), 3 * len(self.contacts))
+        snapshot = ContactSnapshot(self.path)
+        self.assertEqual(snapshot.find_by_email(" User7@Example.com"), [self.contacts[7]["_id"]])
+        self.assertEqual(snapshot.find_by_phone("555-555-0007"), [self.contacts[7]["_id"]])
+        self.assertEqual(snapshot.find_by_phone("1-555-555-0007"), [self.contacts[7]["_id"]])
+        self.assertEqual(snapshot.find_by_phone("0988 123 456"), [self.vn["_id"]])
+        self.assertEqual(snapshot.find_by_facebook_id("1499"), [self.contacts[499]["_id"]])
+        self.assertEqual(snapshot.find_by_email("nobody@example.com"), [])
+        self.assertTrue(snapshot.is_known(phone="+1 555 555 0001"))
+        self.assertFalse(snapshot.is_known(email="nobody@example.com", facebook_id="1"))
+
+    def test_shared_keys_and_merged_duplicates(self):
+        duplicate = contact("user1@example.com", None, "2001")
+        merged = contact("user2@example.com", None, "2002", merged_into=self.contacts[2]["_id"])
+        self.contacts.extend([duplicate, merged])
+        build(self.collection, self.path)
+        snapshot = ContactSnapshot(self.path)
+        self.assertEqual(sorted(snapshot.find_by_email("user1@example.com")),
+                         sorted([self.contacts[1]["_id"], duplicate["_id"]]))
+        self.assertEqual(snapshot.find_by_email("user2@example.com"), [self.contacts[2]["_id"]])
+
+    def test_apply_changes(self):
+        build(self.collection, self.path)
+        snapshot = ContactSnapshot(self.path, check_seconds=0)
+        new = contact("new@example.com", "+15555551234", "3001")
+        updated = dict(self.contacts[3], email_norm="renamed@example.com")
+        self.collection.changes = [
+            {"operationType": "insert", "documentKey": {"_id": new["_id"]}, "fullDocument": new},
+            {"operationType": "update", "documentKey": {"_id": updated["_id"]}, "fullDocument": updated},
+            {"operationType": "delete", "documentKey": {"_id": self.vn["_id"]}},
+        ]
+        self.assertEqual(apply_changes(self.collection, self.path), 3)
+        self.assertEqual(snapshot.find_by_phone("1 (555) 555-1234"), [new["_id"]])
+        self.assertEqual(snapshot.find_by_email("renamed@example.com"), [updated["_id"]])
+        self.assertEqual(snapshot.find_by_email("user3@example.com"), [])
+        self.assertEqual(snapshot.find_by_phone("0988 123 456"), [])
+        self.assertEqual(snapshot.stats()["changes_applied"], 3)
+        # nothing new: the file is left as is
+        self.assertEqual(apply_changes(self.collection, self.path), 0)
+
+    def test_collection_dropped(self):
+        build(self.collection, self.path)
+        self.collection.changes = [{"operationType": "drop", "documentKey": {}}]
+        self.assertRaises(SnapshotStale, apply_changes, self.collection, self.path)
+
+    def test_not_a_snapshot(self):
+        with open(self.path, "wb") as target:
+            target.write(b"\0" * contact_snapshot.HEADER.size)
+        self.assertRaises(ValueError, ContactSnapshot, self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
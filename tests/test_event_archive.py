@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+    Event archive (event_archive.py): concurrent appends read back whole, and retention
+"""
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from event_archive import ArchiveWriter, ArchiveReader
+
+
+class EventArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_concurrent_appends(self):
+        writer = ArchiveWriter(self.directory, block_bytes=2048, segment_bytes=16 * 1024, flush_seconds=60)
+
+        def append(thread):
+            for i in range(200):
+                writer.append(("%d:%d " % (thread, i)).encode("utf-8") * 10, ["sender-%d" % thread], ts_ms=i)
+
+        threads = [threading.Thread(target=append, args=(thread,)) for thread in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.close()
+        bodies = [body for ts_ms, senders, body in ArchiveReader(self.directory).read()]
+        self.assertEqual(len(bodies), 800)
+        self.assertEqual(len(list(ArchiveReader(self.directory).read(sender_id="sender-2"))), 200)
+
+    def test_prune_oldest_segments(self):
+        writer = ArchiveWriter(self.directory, max_segments=2, flush_seconds=60)
+        old = time.time() - 3600
+        for ts_ms in (1, 2, 3, 4):
+            base = os.path.join(self.directory, "events-%013d-1" % ts_ms)
+            for extension in (".seg", ".idx"):
+                with open(base + extension, "wb") as segment:
+                    segment.write(b"x" * 10)
+                os.utime(base + extension, (old, old))
+        writer.prune(os.path.join(self.directory, "events-%013d-1.seg" % 4))
+        self.assertEqual(sorted(os.listdir(self.directory)), [
+            "events-0000000000003-1.idx", "events-0000000000003-1.seg",
+            "events-0000000000004-1.idx", "events-0000000000004-1.seg"])
+
+    def test_prune_keeps_segments_being_written(self):
+        writer = ArchiveWriter(self.directory, max_bytes=1, flush_seconds=60)
+        for ts_ms in (1, 2):
+            with open(os.path.join(self.directory, "events-%013d-%d.seg" % (ts_ms, ts_ms)), "wb") as segment:
+                segment.write(b"x" * 10)
+        writer.prune(os.path.join(self.directory, "events-%013d-2.seg" % 2))
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
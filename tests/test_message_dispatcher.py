@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+    Dry-run dispatch (tools/replay_archive.py --mode dispatch): handlers reply without
+    storing or counting anything
+"""
+import os
+import unittest
+# configuration.py requires it; nothing connects in a dry run
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/contact_bot_test")
+from messages import TextMessage, LocationMessage
+from message_dispatcher import MessageDispatcher
+from db.contact_stats import contact_stats
+
+
+class Untouchable:
+    """ Stands in for the handlers' collections / writers: any use fails the test
+    """
+
+    def __getattr__(self, name):
+        raise AssertionError("dry run used %s" % name)
+
+
+class DryRunDispatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dispatcher = MessageDispatcher(dry_run=True)
+        for handler in self.dispatcher.handlers.values():
+            self.assertTrue(handler.dry_run)
+        self.dispatcher.handlers["contact_registration"].contacts = Untouchable()
+        self.dispatcher.handlers["location_tracking"].location_writer = Untouchable()
+        self.pending = dict(contact_stats.pending)
+
+    def test_contact_reply_without_store(self):
+        reply = self.dispatcher.dispatch_and_process(TextMessage("1", "email@example.com 0988 123 456"))
+        self.assertEqual(reply, "Got it. Your email is email@example.com and phone is 0988 123 456. Thanks.")
+        self.assertEqual(dict(contact_stats.pending), self.pending)
+
+    def test_no_contact(self):
+        reply = self.dispatcher.dispatch_and_process(TextMessage("1", "hello"))
+        self.assertEqual(reply, "Hi, can I have your email & phone number please?")
+        self.assertEqual(dict(contact_stats.pending), self.pending)
+
+    def test_location_not_recorded(self):
+        reply = self.dispatcher.dispatch_and_process(LocationMessage("1", 10.7769, 106.7009))
+        self.assertEqual(reply, "Thanks, I've noted your location.")
+
+
+if __name__ == "__main__":
+    unittest.main()
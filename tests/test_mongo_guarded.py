@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+    db.mongo guarded() / GuardedCursor: what counts against the Mongo breaker
+"""
+import os
+import time
+import collections
+import unittest
+from unittest import mock
+# configuration.py requires it; nothing connects here
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/contact_bot_test")
+from pymongo.errors import AutoReconnect, DuplicateKeyError
+from common.circuit_breaker import CircuitOpenError
+from common.deadline import Deadline
+from db import mongo
+
+
+class BatchCursor:
+    """ pymongo-like cursor: documents of the current batch in _data, a fetch when it is empty
+    """
+
+    def __init__(self, batches):
+        self.batches = collections.deque(batches)
+        self._data = collections.deque()
+        self.fetches = 0
+
+    def __next__(self):
+        if not self._data:
+            self.fetches += 1
+            if not self.batches:
+                raise StopIteration
+            self._data.extend(self.batches.popleft())
+        return self._data.popleft()
+
+
+class GuardedTest(unittest.TestCase):
+
+    def setUp(self):
+        # a prefix of its own: a fresh breaker per test
+        self.prefix = "test_%s" % self.id().rsplit(".", 1)[-1]
+        self.breaker = mongo.get_breaker(self.prefix)
+
+    def run_guarded(self, error, deadline=None, spend=0):
+        try:
+            with mongo.guarded(self.prefix, deadline):
+                time.sleep(spend)
+                raise error
+        except type(error):
+            pass
+
+    def test_unavailable_counts_as_failure(self):
+        self.run_guarded(AutoReconnect("down"))
+        self.assertEqual(self.breaker.failures, 1)
+
+    def test_server_error_counts_as_success(self):
+        self.breaker.record_failure()
+        self.run_guarded(DuplicateKeyError("dup"))
+        self.assertEqual(self.breaker.failures, 0)
+
+    def test_timeout_on_own_deadline_not_counted(self):
+        self.run_guarded(AutoReconnect("timed out"), deadline=Deadline(0.01), spend=0.02)
+        self.assertEqual(self.breaker.failures, 0)
+
+    def test_open_breaker_fails_fast(self):
+        for _ in range(self.breaker.failure_threshold):
+            self.breaker.record_failure()
+        self.assertRaises(CircuitOpenError, mongo.GuardedCursor(BatchCursor([[1]]), mongodb=self.prefix).__next__)
+
+    def test_cursor_guards_fetches_only(self):
+        cursor = BatchCursor([[1, 2, 3], [4, 5]])
+        with mock.patch.object(mongo, "guarded", wraps=mongo.guarded) as guarded:
+            documents = list(mongo.GuardedCursor(cursor, mongodb=self.prefix))
+        self.assertEqual(documents, [1, 2, 3, 4, 5])
+        # two batches, then the fetch finding the cursor exhausted
+        self.assertEqual(guarded.call_count, cursor.fetches)
+        self.assertEqual(cursor.fetches, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+    Partition assignment (partitioning.py)
+"""
+import os
+import unittest
+# configuration.py requires it; nothing connects here
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/contact_bot_test")
+from partitioning import assign_partitions, partition_for, stable_hash
+
+WORKERS = ["web.1:a1", "web.2:b2", "worker.1:c3", "worker.2:d4"]
+
+
+class AssignPartitionsTest(unittest.TestCase):
+
+    def owners(self, assignment):
+        return dict((partition, worker_id)
+                    for worker_id, partitions in assignment.items() for partition in partitions)
+
+    def test_every_partition_owned_once(self):
+        assignment = assign_partitions(WORKERS, 64)
+        self.assertEqual(sum(len(partitions) for partitions in assignment.values()), 64)
+        self.assertEqual(set(self.owners(assignment)), set(range(64)))
+        # every worker gets a share
+        self.assertTrue(all(assignment[worker_id] for worker_id in WORKERS))
+
+    def test_independent_of_worker_order(self):
+        self.assertEqual(assign_partitions(WORKERS, 64), assign_partitions(list(reversed(WORKERS)), 64))
+
+    def test_only_departed_worker_partitions_move(self):
+        before = self.owners(assign_partitions(WORKERS, 64))
+        after = self.owners(assign_partitions([w for w in WORKERS if w != "web.2:b2"], 64))
+        for partition, worker_id in before.items():
+            if worker_id != "web.2:b2":
+                self.assertEqual(after[partition], worker_id)
+        self.assertNotIn("web.2:b2", after.values())
+
+    def test_joining_worker_only_takes_partitions(self):
+        before = self.owners(assign_partitions(WORKERS, 64))
+        after = self.owners(assign_partitions(WORKERS + ["worker.3:e5"], 64))
+        moved = [partition for partition in before if after[partition] != before[partition]]
+        self.assertTrue(moved)
+        self.assertTrue(all(after[partition] == "worker.3:e5" for partition in moved))
+
+    def test_no_workers(self):
+        self.assertEqual(assign_partitions([], 64), {})
+
+
+class PartitionForTest(unittest.TestCase):
+
+    def test_stable_and_in_range(self):
+        # md5-based: the same in every process, whatever PYTHONHASHSEED
+        self.assertEqual(stable_hash("1234"), int("81dc9bdb52d04dc2", 16))
+        for sender_id in ("1234", 1234, "987654321012345"):
+            partition = partition_for(sender_id, 64)
+            self.assertEqual(partition, partition_for(sender_id, 64))
+            self.assertTrue(0 <= partition < 64)
+        self.assertEqual(partition_for(1234, 64), partition_for("1234", 64))
+
+
+if __name__ == "__main__":
+    unittest.main()
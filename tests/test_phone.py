@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+    Phone recognition (phone.py) and the canonical contact keys (extractor.py)
+
+        python -m pytest tests
+"""
+import unittest
+from phone import PhoneRecognizer
+from extractor import Extractor, normalize_email, normalize_phone
+
+
+class NormalizePhoneTest(unittest.TestCase):
+
+    def test_us_numbers(self):
+        for phone in ("555-555-5555", "(555) 555-5555", "555.555.5555", "+1 555 555 5555"):
+            self.assertEqual(normalize_phone(phone), "+15555555555", phone)
+
+    def test_us_numbers_with_leading_1(self):
+        for phone in ("15555555555", "1-555-555-5555", "1 (555) 555-5555", "1.555.555.5555"):
+            self.assertEqual(normalize_phone(phone), "+15555555555", phone)
+
+    def test_vn_numbers(self):
+        self.assertEqual(normalize_phone("0988 123 456"), "+84988123456")
+        self.assertEqual(normalize_phone("0988-123-456"), "+84988123456")
+        self.assertEqual(normalize_phone("+84988123456"), "+84988123456")
+        self.assertEqual(normalize_phone("0084 988 123 456"), "+84988123456")
+        self.assertEqual(normalize_phone("0165 123 4567"), "+841651234567")
+
+    def test_trunk_prefix_in_parentheses(self):
+        self.assertEqual(normalize_phone("+84 (0) 988 123 456"), "+84988123456")
+        # country without a rule: kept as written, without the "(0)"
+        self.assertEqual(normalize_phone("+44 (0) 20 7946 0958"), "+442079460958")
+
+    def test_not_a_phone(self):
+        for phone in (None, "", "12345", "hello"):
+            self.assertIsNone(normalize_phone(phone), phone)
+
+
+class PhoneRecognizerTest(unittest.TestCase):
+
+    def test_trunk_prefix_list(self):
+        recognizer = PhoneRecognizer({"US": {"country_code": "1", "trunk_prefix": ["", "1"],
+                                             "national_prefixes": ["5"], "lengths": [10]}})
+        self.assertEqual(recognizer.find("call 1-555-555-5555 now").e164, "+15555555555")
+        self.assertEqual(recognizer.find("call 1-555-555-5555 now").raw, "1-555-555-5555")
+        self.assertEqual(recognizer.find("call 555-555-5555").e164, "+15555555555")
+
+    def test_trunk_prefix_string(self):
+        recognizer = PhoneRecognizer({"VN": {"country_code": "84", "trunk_prefix": "0",
+                                             "national_prefixes": ["9"], "lengths": [9]}})
+        self.assertEqual(recognizer.find("0988 123 456").e164, "+84988123456")
+        self.assertIsNone(recognizer.find("1988 123 456"))
+
+
+class ExtractContactTest(unittest.TestCase):
+
+    def test_us_number_with_leading_1(self):
+        contact = Extractor().extract_contact("a@b.com 1-555-555-5555")
+        self.assertEqual(contact["phone"], "1-555-555-5555")
+        self.assertEqual(contact["phone_e164"], "+15555555555")
+        self.assertEqual(contact["phone_country"], "US")
+
+    def test_readme_formats(self):
+        for text, e164 in (("My email address is email@example.com and my phone is 555-555-5555.", "+15555555555"),
+                           ("email@example.com,  0983.123.456", "+84983123456"),
+                           ("email@example.com 0165-123-4567", "+841651234567")):
+            contact = Extractor().extract_contact(text)
+            self.assertEqual(contact["email_norm"], "email@example.com", text)
+            self.assertEqual(contact["phone_e164"], e164, text)
+
+    def test_missing_phone(self):
+        self.assertIsNone(Extractor().extract_contact("a@b.com, call me"))
+
+    def test_normalize_email(self):
+        self.assertEqual(normalize_email("  Email@Example.COM "), "email@example.com")
+
+
+if __name__ == "__main__":
+    unittest.main()
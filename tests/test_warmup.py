@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+    Worker warm-up (warmup.py): failed required steps are retried until the worker is ready
+"""
+import unittest
+from warmup import WarmUp
+
+
+class FlakyStep:
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise IOError("mongo down")
+
+
+class WarmUpTest(unittest.TestCase):
+
+    def test_required_step_retried_until_ready(self):
+        warm_up = WarmUp(retry_base_seconds=0, retry_max_seconds=0)
+        mongo, graph_api = FlakyStep(2), FlakyStep(1)
+        warm_up.run([("mongo", mongo, True), ("graph_api", graph_api, False)])
+        report = warm_up.report()
+        self.assertTrue(report["ready"])
+        self.assertEqual(mongo.calls, 3)
+        steps = dict((step["step"], step) for step in report["steps"])
+        self.assertEqual((steps["mongo"]["ok"], steps["mongo"]["attempts"]), (True, 3))
+        # optional steps are only reported
+        self.assertEqual(graph_api.calls, 1)
+        self.assertFalse(steps["graph_api"]["ok"])
+
+    def test_not_ready_while_retrying(self):
+        warm_up = WarmUp(retry_base_seconds=0, retry_max_seconds=0)
+        reports = []
+        warm_up.run([("mongo", FlakyStep(1), True), ("indexes", lambda: reports.append(warm_up.report()), True)])
+        self.assertFalse(reports[0]["ready"])
+        self.assertTrue(warm_up.report()["ready"])
+
+
+if __name__ == "__main__":
+    unittest.main()
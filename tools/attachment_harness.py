@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+attachment_harness.py
+
+Runs the attachment pipeline (attachments.py) against a local stub file server,
+without Mongo or the Graph API:
+
+  - several attachments in one message are all processed
+  - downloads over the size cap are aborted (by Content-Length or while streaming)
+  - more attachments than max_queued are dropped instead of piling up
+  - processing runs in the process pool and results come back to on_result
+  - URLs off the allowed hosts are refused, redirects to them too
+  - a timed-out attachment keeps its file and its slot until its processing is over
+
+    python -m tools.attachment_harness
+"""
+
+import sys
+import time
+import hashlib
+import threading
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+from attachments import AttachmentPipeline
+from messages import Attachment, AttachmentMessage
+
+SMALL = b"business card " * 1000
+BIG = b"x" * (2 * 1024 * 1024)
+
+
+def slow_digest(path):
+    """ Processor outliving the pipeline's timeout, still reading its file at the end
+    """
+    time.sleep(2)
+    return digest(path)
+
+
+def digest(path):
+    """ Stand-in CPU-bound processor: hash the file a few times
+    """
+    with open(path, "rb") as source:
+        data = source.read()
+    for _ in range(200):
+        data = hashlib.sha256(data).digest() + data[:1024]
+    return "%d bytes" % len(data)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.startswith("/redirect"):
+            # off the allowed hosts
+            self.send_response(302)
+            self.send_header("Location", "http://localhost:%d/card" % self.server.server_address[1])
+            self.end_headers()
+            return
+        body = BIG if "big" in self.path else SMALL
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        if not self.path.startswith("/chunked"):
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        # /chunked: no Content-Length, the cap has to be enforced while streaming
+        for start in range(0, len(body), 64 * 1024):
+            self.wfile.write(body[start:start + 64 * 1024])
+            time.sleep(0.01)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def run_case(name, base_url, paths, max_queued, expected_results, processor=digest, timeout_seconds=30):
+    results = []
+    done = threading.Event()
+
+    def on_result(message, attachment, text):
+        results.append((attachment.url, text))
+        if len(results) >= expected_results:
+            done.set()
+
+    # the stub server stands in for Facebook's CDN
+    pipeline = AttachmentPipeline(on_result, processors={"image": processor}, max_workers=2,
+                                  max_queued=max_queued, max_bytes=1024 * 1024, timeout_seconds=timeout_seconds,
+                                  allowed_hosts=("127.0.0.1",), schemes=("http",))
+    started = time.time()
+    message = AttachmentMessage("sender-1", tuple(Attachment("image", path if "://" in path else base_url + path)
+                                                   for path in paths))
+    accepted = pipeline.submit(message)
+    done.wait(timeout=30)
+    pipeline.shutdown()
+    ok = len(results) == expected_results
+    print("%-28s accepted=%d results=%d expected=%d %.2fs %s" % (
+        name, accepted, len(results), expected_results, time.time() - started, "ok" if ok else "FAIL"))
+    return ok
+
+
+def timeout_case(base_url):
+    """ The processor outlives the timeout: no result, but the file is only removed and the
+        slot only freed once processing is over
+    """
+    results = []
+    pipeline = AttachmentPipeline(lambda message, attachment, text: results.append(text),
+                                  processors={"image": slow_digest}, max_workers=1, max_queued=1,
+                                  max_bytes=1024 * 1024, timeout_seconds=0.5,
+                                  allowed_hosts=("127.0.0.1",), schemes=("http",))
+    started = time.time()
+    first = pipeline.submit(AttachmentMessage("sender-1", (Attachment("image", base_url + "/card"),)))
+    time.sleep(1.5)
+    # timed out, still processing: its slot is taken
+    during = pipeline.submit(AttachmentMessage("sender-1", (Attachment("image", base_url + "/card"),)))
+    time.sleep(2)
+    after = pipeline.submit(AttachmentMessage("sender-1", (Attachment("image", base_url + "/card"),)))
+    pipeline.shutdown()
+    ok = (first, during, after) == (1, 0, 1) and not results
+    print("%-28s accepted=%d,%d,%d results=%d %.2fs %s" % (
+        "timeout", first, during, after, len(results), time.time() - started, "ok" if ok else "FAIL"))
+    return ok
+
+
+def main():
+    server = StubServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = "http://127.0.0.1:%d" % server.server_address[1]
+
+    ok = run_case("several attachments", base_url, ["/card-%d" % i for i in range(6)], 32, 6)
+    ok = run_case("over cap (Content-Length)", base_url, ["/big", "/card"], 32, 1) and ok
+    ok = run_case("over cap (streamed)", base_url, ["/chunked-big", "/card"], 32, 1) and ok
+    ok = run_case("bounded queue", base_url, ["/card-%d" % i for i in range(10)], 4, 4) and ok
+    ok = run_case("refused hosts", base_url, ["/redirect", "/card", "http://localhost:%d/card" % server.server_address[1]],
+                  32, 1) and ok
+    ok = timeout_case(base_url) and ok
+    server.shutdown()
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+backfill_contact_keys.py
+
+Fill email_norm / phone_e164 on contacts stored before they existed. Walks the
+collection in _id order, batch by batch, and writes each batch with one bulk
+write. Safe to stop and re-run: documents that already have the keys are skipped.
+--recompute-null also redoes contacts whose keys are null although the raw value is
+set, e.g. phones not recognised before a fix to phone_rules.json.
+
+    python -m tools.backfill_contact_keys --batch-size 1000
+    python -m tools.backfill_contact_keys --recompute-null
+"""
+
+import sys
+import time
+import argparse
+from pymongo import UpdateOne
+
+
+def backfill(collection, batch_size, recompute_null=False):
+    from extractor import normalize_email, normalize_phone
+
+    started = time.time()
+    last_id, updated = None, 0
+    while True:
+        if recompute_null:
+            # null matches a missing key too
+            query = {"$or": [{"phone_e164": None, "phone": {"$nin": [None, ""]}},
+                             {"email_norm": None, "email": {"$nin": [None, ""]}}]}
+        else:
+            query = {"phone_e164": {"$exists": False}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = list(collection.find(query=query, limit=batch_size, sort_field="_id", sort_order=1))
+        if not batch:
+            break
+        collection.bulk_write(requests=[
+            UpdateOne({"_id": doc["_id"]},
+                      {"$set": {"email_norm": normalize_email(doc.get("email")),
+                                "phone_e164": normalize_phone(doc.get("phone"))}})
+            for doc in batch], ordered=False)
+        last_id = batch[-1]["_id"]
+        updated += len(batch)
+        sys.stderr.write("backfilled %d contacts (%.0f/s)\n" % (updated, updated / (time.time() - started)))
+    sys.stderr.write("done: %d contacts in %.1fs\n" % (updated, time.time() - started))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--recompute-null", action="store_true",
+                        help="also redo contacts whose email_norm / phone_e164 is null")
+    args = parser.parse_args()
+
+    from db.contacts import mongo_contacts
+    mongo_contacts.ensure_indexes()
+    backfill(mongo_contacts, args.batch_size, recompute_null=args.recompute_null)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+bench_message_model.py
+
+CPU time and memory per event: messages.from_messaging_event against the dicts
+the webhook used to build (messaging_data, then the {"sender_id", "message"}
+wrapper the handler expected).
+
+    python -m tools.bench_message_model --events 100000
+"""
+
+import gc
+import timeit
+import argparse
+import tracemalloc
+from messages import from_messaging_event
+
+TEXT_EVENT = {
+    "sender": {"id": "1254459154682919"}, "recipient": {"id": "682498171943165"},
+    "timestamp": 1502905976963,
+    "message": {"mid": "mid.$cAAJsujCd2ORkHh27-Fd8qCNpm8Rl", "seq": 1045,
+                "text": "my email is someone@example.com and my phone is 0988 123 456"},
+}
+LOCATION_EVENT = {
+    "sender": {"id": "1254459154682919"}, "recipient": {"id": "682498171943165"},
+    "timestamp": 1502905976963,
+    "message": {"mid": "mid.$cAAJsujCd2ORkHh27-Fd8qCNpm8Rm", "seq": 1046,
+                "attachments": [{"type": "location", "payload": {"coordinates": {"lat": 10.77, "long": 106.69}}}]},
+}
+IMAGE_EVENT = {
+    "sender": {"id": "1254459154682919"}, "recipient": {"id": "682498171943165"},
+    "timestamp": 1502905976963,
+    "message": {"mid": "mid.$cAAJsujCd2ORkHh27-Fd8qCNpm8Rn", "seq": 1047,
+                "attachments": [{"type": "image", "payload": {"url": "https://scontent.xx.fbcdn.net/card.jpg"}},
+                                {"type": "image", "payload": {"url": "https://scontent.xx.fbcdn.net/back.jpg"}}]},
+}
+
+
+def dict_message(event):
+    """ The previous path: messaging_data() then the wrapper dict the handler read from
+    """
+    message_data = event["message"]
+    if "text" in message_data and "quick_reply" not in message_data:
+        data = {"type": "text", "data": message_data["text"], "messaging_id": message_data["mid"]}
+    elif message_data["attachments"][0]["type"] == "location":
+        coordinates = message_data["attachments"][0]["payload"]["coordinates"]
+        data = {"type": "location", "data": [coordinates["lat"], coordinates["long"]],
+                "message_id": message_data["mid"]}
+    else:
+        data = {"type": "attachments",
+                "data": [{"type": a["type"], "data": a["payload"]["url"]} for a in message_data["attachments"]],
+                "message_id": message_data["mid"]}
+    return {"sender_id": event["sender"]["id"], "message": data}
+
+
+def typed_message(event):
+    return from_messaging_event(event, page_id="682498171943165")
+
+
+def bytes_per_event(build, event, count):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = [build(event) for _ in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    # don't count the list holding them
+    size -= kept.__sizeof__()
+    return size / float(count)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=100000)
+    args = parser.parse_args()
+
+    print("%-10s %-6s %12s %14s" % ("event", "model", "ns/event", "bytes/event"))
+    for name, event in (("text", TEXT_EVENT), ("location", LOCATION_EVENT), ("images", IMAGE_EVENT)):
+        for model, build in (("dict", dict_message), ("typed", typed_message)):
+            seconds = min(timeit.repeat(lambda: build(event), number=args.events, repeat=3))
+            print("%-10s %-6s %12.0f %14.1f" % (
+                name, model, seconds / args.events * 1e9, bytes_per_event(build, event, args.events // 10)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+bench_phone.py
+
+Phone extraction cost as countries are added: the prefix-trie recogniser
+(phone.py) against one alternation regex per country, the way the old
+extractor pattern would have grown. Country rules beyond US/VN are synthetic.
+
+    python -m tools.bench_phone --messages 2000
+"""
+
+import re
+import json
+import random
+import timeit
+import argparse
+from phone import PhoneRecognizer, DEFAULT_RULES_FILE, trunk_prefixes_of
+
+WORDS = "hi my name is please call me on or send mail to thanks the office number".split()
+
+
+def synthetic_rules(count, rng):
+    with open(DEFAULT_RULES_FILE) as rules_file:
+        rules = json.load(rules_file)
+    codes = set(rule["country_code"] for rule in rules.values())
+    while len(rules) < count:
+        code = str(rng.randint(200, 999))
+        if code in codes:
+            continue
+        codes.add(code)
+        rules["X%d" % len(rules)] = {
+            "country_code": code,
+            "trunk_prefix": "0",
+            "national_prefixes": sorted(set(str(rng.randint(2, 99)) for _ in range(4))),
+            "lengths": [rng.choice([8, 9]), 10],
+            "separators": " -.",
+        }
+    return rules
+
+
+def sample_number(rule, rng):
+    prefix = rng.choice(rule["national_prefixes"])
+    national = prefix + "".join(str(rng.randint(0, 9)) for _ in range(rng.choice(rule["lengths"]) - len(prefix)))
+    if rng.random() < 0.3:
+        return "+%s %s" % (rule["country_code"], national)
+    number = rng.choice(trunk_prefixes_of(rule)) + national
+    return " ".join(number[i:i + 3] for i in range(0, len(number), 3))
+
+
+def messages(rules, count, rng):
+    rule_list = list(rules.values())
+    result = []
+    for _ in range(count):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(5, 20))]
+        words.insert(rng.randint(0, len(words)), sample_number(rng.choice(rule_list), rng))
+        result.append(" ".join(words))
+    return result
+
+
+def alternation_regex(rules):
+    """ One alternative per country and national prefix, as a single regex """
+    alternatives = []
+    for rule in rules.values():
+        for prefix in rule["national_prefixes"]:
+            for length in rule["lengths"]:
+                rest = length - len(prefix)
+                alternatives.append(r"(?:\+%s[-. ]?|%s)%s(?:[-. ]?\d){%d}\b" % (
+                    rule["country_code"], "|".join(re.escape(trunk_prefix) for trunk_prefix in trunk_prefixes_of(rule)),
+                    prefix, rest))
+    return re.compile("|".join(alternatives))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--countries", default="2,5,10,25,50")
+    args = parser.parse_args()
+
+    print("%-10s %14s %14s %10s" % ("countries", "trie us/msg", "regex us/msg", "trie hits"))
+    for count in [int(c) for c in args.countries.split(",")]:
+        rng = random.Random(count)
+        rules = synthetic_rules(count, rng)
+        corpus = messages(rules, args.messages, rng)
+        recognizer = PhoneRecognizer(rules)
+        regex = alternation_regex(rules)
+        hits = sum(1 for message in corpus if recognizer.find(message) is not None)
+        trie = min(timeit.repeat(lambda: [recognizer.find(m) for m in corpus], number=1, repeat=5))
+        alternation = min(timeit.repeat(lambda: [regex.search(m) for m in corpus], number=1, repeat=5))
+        print("%-10d %14.2f %14.2f %9.1f%%" % (
+            count, trie / len(corpus) * 1e6, alternation / len(corpus) * 1e6, 100.0 * hits / len(corpus)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+build_contact_snapshot.py
+
+Build the read-only contact snapshot (contact_snapshot.py) from the contacts
+collection, or bring it up to date from the contacts change stream:
+
+    python -m tools.build_contact_snapshot contacts.snapshot
+    python -m tools.build_contact_snapshot contacts.snapshot --apply
+    python -m tools.build_contact_snapshot contacts.snapshot --apply --every 60
+
+--apply rebuilds the snapshot when the change stream can't resume from its
+token (no snapshot yet, changes gone from the oplog, standalone server).
+--lookup checks keys against the snapshot, without touching the DB:
+
+    python -m tools.build_contact_snapshot contacts.snapshot --lookup email@example.com "0988 123 456"
+"""
+
+import os
+import sys
+import time
+import argparse
+
+
+def rebuild(collection, args):
+    from contact_snapshot import build
+
+    started = time.time()
+    count = build(collection, args.path, run_records=args.run_records, tmp_dir=args.tmp_dir)
+    sys.stderr.write("built %s: %d records in %.1fs\n" % (args.path, count, time.time() - started))
+
+
+def apply(collection, args):
+    from contact_snapshot import apply_changes, SnapshotStale
+
+    if not os.path.exists(args.path):
+        return rebuild(collection, args)
+    started = time.time()
+    try:
+        changed = apply_changes(collection, args.path, max_changes=args.max_changes)
+    except SnapshotStale as e:
+        sys.stderr.write("%s, rebuilding\n" % e)
+        return rebuild(collection, args)
+    sys.stderr.write("applied %d changed contacts to %s in %.1fs\n" % (changed, args.path, time.time() - started))
+
+
+def lookup(args):
+    from contact_snapshot import ContactSnapshot
+
+    snapshot = ContactSnapshot(args.path, check_seconds=None)
+    print(snapshot.stats())
+    for key in args.lookup:
+        kind = "email" if "@" in key else "phone"
+        contact_ids = snapshot.find_by_email(key) if kind == "email" else snapshot.find_by_phone(key)
+        if not contact_ids:
+            # not an email nor a phone we can normalize: try it as a facebook id
+            kind, contact_ids = "facebook_id", snapshot.find_by_facebook_id(key)
+        print("%-30s %-12s %s" % (key, kind, ", ".join(str(contact_id) for contact_id in contact_ids) or "-"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="snapshot file")
+    parser.add_argument("--apply", action="store_true", help="apply the changes since the last build / apply")
+    parser.add_argument("--every", type=float, default=0, help="with --apply, keep applying every EVERY seconds")
+    parser.add_argument("--max-changes", type=int, default=100000, help="changed contacts per apply")
+    parser.add_argument("--run-records", type=int, default=500000,
+                        help="records sorted in memory per run of the full build")
+    parser.add_argument("--tmp-dir", default=None, help="directory of the sorted runs (default: system temp)")
+    parser.add_argument("--mongodb", default="mongo", help="Mongo prefix of the contacts collection")
+    parser.add_argument("--lookup", nargs="+", metavar="KEY", help="emails / phones / facebook ids to look up")
+    args = parser.parse_args()
+
+    if args.lookup:
+        return lookup(args)
+
+    from db.contacts import ContactsCollection
+    collection = ContactsCollection(mongodb=args.mongodb, collection="contacts")
+    if not args.apply:
+        return rebuild(collection, args)
+    while True:
+        apply(collection, args)
+        if not args.every:
+            break
+        time.sleep(args.every)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+contacts_near.py
+
+Contacts last seen near a point, closest first, from the senders' shared
+locations (db/locations.py):
+
+    python -m tools.contacts_near 10.7769 106.7009 --km 2 --limit 50
+"""
+
+import math
+import argparse
+import datetime
+
+
+def distance_m(longitude1, latitude1, longitude2, latitude2):
+    """ Great-circle distance (haversine)
+    """
+    from db.mongo import EARTH_RADIUS_M
+    phi1, phi2 = math.radians(latitude1), math.radians(latitude2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + \
+        math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(longitude2 - longitude1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("latitude", type=float)
+    parser.add_argument("longitude", type=float)
+    parser.add_argument("--km", type=float, default=5)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    from db.locations import mongo_locations
+    for contact, location in mongo_locations.contacts_near(args.longitude, args.latitude,
+                                                           max_distance_m=args.km * 1000, limit=args.limit):
+        longitude, latitude = location["location"]["coordinates"]
+        seen = datetime.datetime.utcfromtimestamp(location["timestamp"] / 1000.0).strftime("%Y-%m-%d %H:%M")
+        print("%7.2f km  %-30s %-16s seen %s UTC" % (
+            distance_m(args.longitude, args.latitude, longitude, latitude) / 1000.0,
+            contact.get("email"), contact.get("phone_e164") or contact.get("phone"), seen))
+
+if __name__ == "__main__":
+    main()
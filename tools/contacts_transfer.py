@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+contacts_transfer.py
+
+Export / import the contacts collection. The format comes from the file name:
+.jsonl or .csv, plus .gz for gzip compression. Both directions stream, so memory
+stays flat whatever the collection size.
+
+    python -m tools.contacts_transfer export contacts.jsonl.gz
+    python -m tools.contacts_transfer export contacts.csv.gz --fields facebook_id,email,phone
+    python -m tools.contacts_transfer import contacts.jsonl.gz
+
+Import upserts on facebook_id with unordered bulk writes, so it can be re-run.
+Contacts new to the target keep their source _id, so the merged_into links of
+merged duplicates (tools/dedupe_contacts.py) still point at their survivor.
+Rows without the canonical keys (email_norm, phone_e164), e.g. from a csv export,
+get them computed like stored contacts.
+"""
+
+import sys
+import csv
+import gzip
+import time
+import argparse
+from bson import ObjectId, json_util
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+DEFAULT_FIELDS = "facebook_id,email,phone"
+
+
+class Progress:
+
+    def __init__(self, action, every_seconds=2.0):
+        self.action = action
+        self.every_seconds = every_seconds
+        self.rows = 0
+        self.started = self.reported = time.time()
+
+    def add(self, rows):
+        self.rows += rows
+        now = time.time()
+        if now - self.reported >= self.every_seconds:
+            self.reported = now
+            sys.stderr.write("%s %d rows (%.0f rows/s)\n" % (self.action, self.rows, self.rate()))
+
+    def rate(self):
+        elapsed = time.time() - self.started
+        return self.rows / elapsed if elapsed else 0.0
+
+    def summary(self, extra=""):
+        sys.stderr.write("%s %d rows in %.1fs, %.0f rows/s%s\n" % (
+            self.action, self.rows, time.time() - self.started, self.rate(), extra))
+
+
+def file_format(path):
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith(".jsonl"):
+        return "jsonl"
+    if name.endswith(".csv"):
+        return "csv"
+    raise SystemExit("unknown format for %s, use .jsonl or .csv (optionally .gz)" % path)
+
+
+def open_text(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def export_contacts(collection, path, fields, batch_size):
+    fmt = file_format(path)
+    progress = Progress("exported")
+    # limit=0: the whole collection, fetched batch_size documents per round trip
+    cursor = collection.find(query={}, limit=0).batch_size(batch_size)
+    with open_text(path, "w") as out:
+        if fmt == "jsonl":
+            for doc in cursor:
+                out.write(json_util.dumps(doc))
+                out.write("\n")
+                progress.add(1)
+        else:
+            writer = csv.DictWriter(out, fieldnames=fields, extrasaction="ignore")
+            writer.writeheader()
+            for doc in cursor:
+                writer.writerow(doc)
+                progress.add(1)
+    progress.summary()
+
+
+def read_rows(path):
+    fmt = file_format(path)
+    with open_text(path, "r") as source:
+        if fmt == "jsonl":
+            for line in source:
+                if line.strip():
+                    yield json_util.loads(line)
+        else:
+            for row in csv.DictReader(source):
+                yield dict((key, value) for key, value in row.items() if value != "")
+
+
+def import_contacts(collection, path, chunk_size):
+    from extractor import normalize_email, normalize_phone
+
+    # upserts look documents up by facebook_id; same indexes as the bot's contacts
+    collection.ensure_indexes()
+    progress = Progress("imported")
+    skipped = errors = 0
+    chunk = []
+    for row in read_rows(path):
+        source_id = row.pop("_id", None)
+        if ObjectId.is_valid(source_id):
+            # csv cells are strings
+            source_id = ObjectId(source_id)
+        if ObjectId.is_valid(row.get("merged_into")):
+            row["merged_into"] = ObjectId(row["merged_into"])
+        if not row.get("facebook_id"):
+            skipped += 1
+            continue
+        if "email_norm" not in row:
+            row["email_norm"] = normalize_email(row.get("email"))
+        if "phone_e164" not in row:
+            row["phone_e164"] = normalize_phone(row.get("phone"))
+        update = {"$set": row}
+        if source_id:
+            update["$setOnInsert"] = {"_id": source_id}
+        chunk.append(UpdateOne({"facebook_id": row["facebook_id"]}, update, upsert=True))
+        if len(chunk) >= chunk_size:
+            errors += write_chunk(collection, chunk)
+            progress.add(len(chunk))
+            chunk = []
+    if chunk:
+        errors += write_chunk(collection, chunk)
+        progress.add(len(chunk))
+    progress.summary(", %d skipped (no facebook_id), %d failed" % (skipped, errors))
+
+
+def write_chunk(collection, chunk):
+    """ rtype: number of failed writes
+    """
+    try:
+        collection.bulk_write(requests=chunk, ordered=False)
+    except BulkWriteError as e:
+        # unordered: the rest of the chunk was still applied
+        return len(e.details.get("writeErrors", []))
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command")
+    export_parser = subparsers.add_parser("export", help="collection -> file")
+    export_parser.add_argument("path", help="output file")
+    export_parser.add_argument("--fields", default=DEFAULT_FIELDS, help="csv columns")
+    export_parser.add_argument("--batch-size", type=int, default=5000)
+    import_parser = subparsers.add_parser("import", help="file -> collection")
+    import_parser.add_argument("path", help="input file")
+    import_parser.add_argument("--chunk-size", type=int, default=1000)
+    for sub in (export_parser, import_parser):
+        sub.add_argument("--mongodb", default="mongo", help="db prefix (lowercase) holding the collection")
+        sub.add_argument("--collection", default="contacts")
+    args = parser.parse_args()
+
+    from db.contacts import ContactsCollection
+    collection = ContactsCollection(mongodb=args.mongodb, collection=args.collection)
+    if args.command == "export":
+        export_contacts(collection, args.path, args.fields.split(","), args.batch_size)
+    elif args.command == "import":
+        import_contacts(collection, args.path, args.chunk_size)
+    else:
+        parser.print_help()
+
+if __name__ == "__main__":
+    main()
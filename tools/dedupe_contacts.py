@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+dedupe_contacts.py
+
+Merge contacts that share an email or a phone (people re-registering from another
+Facebook account). Grouping runs inside Mongo: one aggregation per key
+(email_norm, then phone_e164) over the key's index, with disk-backed $group/$sort.
+Each group with more than one contact becomes a merge plan: the oldest contact
+survives, collects every facebook_id in facebook_ids, and the others get
+merged_into = survivor. Duplicates are kept, so a merge can be undone.
+
+Plans are applied with one bulk write per batch, and a checkpoint (last key done)
+is saved in the 'jobs' collection after each batch, so a stopped run resumes
+where it left off:
+
+    python -m tools.dedupe_contacts --dry-run
+    heroku run:detached python -m tools.dedupe_contacts
+
+--facebook-id folds contacts sharing a facebook_id (inserted twice by racing
+upserts before facebook_id was unique) into the oldest one, with the newest
+values, deletes the others and replaces the non-unique facebook_id index of
+older versions by the unique one:
+
+    python -m tools.dedupe_contacts --facebook-id --dry-run
+    python -m tools.dedupe_contacts --facebook-id
+"""
+
+import sys
+import time
+import datetime
+import argparse
+from pymongo import DeleteMany, UpdateMany, UpdateOne
+from common.log_util import log
+
+JOB_ID = "dedupe_contacts"
+KEYS = ["email_norm", "phone_e164"]
+
+
+def group_duplicates(contacts, key, after=None, batch_size=1000):
+    """ Groups of contacts sharing a key value, in key order. Already merged contacts
+        count as their survivor, so groups chain across keys (same email -> same phone).
+    """
+    match = {key: {"$gt": after if after is not None else ""}}
+    pipeline = [
+        {"$match": match},
+        {"$sort": {key: 1}},
+        {"$group": {"_id": "$" + key,
+                    "roots": {"$addToSet": {"$ifNull": ["$merged_into", "$_id"]}}}},
+        {"$match": {"roots.1": {"$exists": True}}},
+        {"$sort": {"_id": 1}},
+    ]
+    return contacts.aggregate(pipeline=pipeline, allow_disk_use=True, batch_size=batch_size, primary=True)
+
+
+def plan_merges(contacts, groups):
+    """ Turn a batch of groups into merge plans: (survivor_id, [duplicate_ids], facebook_ids).
+        Roots are re-read first since earlier batches may have merged them, and groups
+        sharing a contact are joined into one plan.
+    """
+    ids = set()
+    for group in groups:
+        ids.update(group["roots"])
+    docs = dict((doc["_id"], doc) for doc in contacts.find_by_id(id_array=list(ids), primary=True))
+    parent = {}
+
+    def root(contact_id):
+        # union-find over the current roots
+        contact_id = docs.get(contact_id, {}).get("merged_into", contact_id)
+        while parent.get(contact_id, contact_id) != contact_id:
+            contact_id = parent[contact_id]
+        return contact_id
+
+    for group in groups:
+        roots = sorted(set(root(contact_id) for contact_id in group["roots"]))
+        for other in roots[1:]:
+            parent[other] = roots[0]
+
+    components = {}
+    for contact_id in ids:
+        components.setdefault(root(contact_id), set()).add(docs.get(contact_id, {}).get("merged_into", contact_id))
+    plans = []
+    for survivor, members in sorted(components.items()):
+        duplicates = sorted(members - set([survivor]))
+        if not duplicates:
+            continue
+        facebook_ids = set()
+        for contact_id in [survivor] + duplicates:
+            doc = docs.get(contact_id) or contacts.find_one(query={"_id": contact_id}, primary=True) or {}
+            if doc.get("facebook_id"):
+                facebook_ids.add(doc["facebook_id"])
+            facebook_ids.update(doc.get("facebook_ids", []))
+        plans.append((survivor, duplicates, sorted(facebook_ids)))
+    return plans
+
+
+def apply_merges(contacts, plans):
+    now = datetime.datetime.utcnow()
+    requests = []
+    for survivor, duplicates, facebook_ids in plans:
+        requests.append(UpdateMany({"_id": {"$in": duplicates}},
+                                   {"$set": {"merged_into": survivor, "merged_at": now}}))
+        # contacts merged earlier into a duplicate move to the new survivor
+        requests.append(UpdateMany({"merged_into": {"$in": duplicates}},
+                                   {"$set": {"merged_into": survivor}}))
+        requests.append(UpdateOne({"_id": survivor},
+                                  {"$addToSet": {"facebook_ids": {"$each": facebook_ids}}}))
+    # ordered: a plan's updates depend on the ones before it
+    contacts.bulk_write(requests=requests, ordered=True)
+
+
+def fold_same_facebook_id(contacts, dry_run, batch_size=500):
+    """ Fold the contacts sharing a facebook_id into the oldest of them, which takes the
+        newest values (the last upsert's), then make the facebook_id index unique
+        rtype: number of contacts deleted
+    """
+    pipeline = [
+        {"$match": {"facebook_id": {"$exists": True}}},
+        {"$group": {"_id": "$facebook_id", "ids": {"$addToSet": "$_id"}}},
+        {"$match": {"ids.1": {"$exists": True}}},
+    ]
+    folded = 0
+    requests = []
+    for group in contacts.aggregate(pipeline=pipeline, allow_disk_use=True, batch_size=batch_size, primary=True):
+        docs = sorted(contacts.find_by_id(id_array=group["ids"], primary=True), key=lambda doc: doc["_id"])
+        if len(docs) < 2:
+            continue
+        survivor, duplicate_ids = docs[0]["_id"], [doc["_id"] for doc in docs[1:]]
+        folded += len(duplicate_ids)
+        if dry_run:
+            log("facebook_id %s: keep %s, delete %s" % (
+                group["_id"], survivor, ", ".join(str(i) for i in duplicate_ids)))
+            continue
+        newest = dict((field, value) for field, value in docs[-1].items()
+                      if field not in ("_id", "merged_into", "merged_at", "facebook_ids"))
+        facebook_ids = sorted(set(facebook_id for doc in docs for facebook_id in doc.get("facebook_ids", [])))
+        update = {"$set": newest}
+        if facebook_ids:
+            update["$addToSet"] = {"facebook_ids": {"$each": facebook_ids}}
+        requests.append(UpdateOne({"_id": survivor}, update))
+        # contacts merged into a deleted one move to the survivor
+        requests.append(UpdateMany({"merged_into": {"$in": duplicate_ids}}, {"$set": {"merged_into": survivor}}))
+        requests.append(DeleteMany({"_id": {"$in": duplicate_ids}}))
+        if len(requests) >= batch_size * 3:
+            contacts.bulk_write(requests=requests, ordered=True)
+            requests = []
+    if requests:
+        contacts.bulk_write(requests=requests, ordered=True)
+    sys.stderr.write("%s %d contacts sharing a facebook_id\n" % ("would delete" if dry_run else "deleted", folded))
+    if not dry_run:
+        contacts.make_facebook_id_unique()
+        sys.stderr.write("facebook_id index is unique\n")
+    return folded
+
+
+def run(contacts, jobs, batch_size, dry_run, pause_seconds):
+    checkpoint = jobs.find_one(query={"_id": JOB_ID}, primary=True) or {}
+    started = time.time()
+    merged = checkpoint.get("merged", 0)
+    start_index = KEYS.index(checkpoint["key"]) if checkpoint.get("key") in KEYS else 0
+    for key in KEYS[start_index:]:
+        after = checkpoint.get("last_value") if checkpoint.get("key") == key else None
+        batch = []
+        for group in group_duplicates(contacts, key, after=after, batch_size=batch_size):
+            batch.append(group)
+            if len(batch) >= batch_size:
+                merged += process_batch(contacts, jobs, key, batch, dry_run, merged)
+                batch = []
+                time.sleep(pause_seconds)
+        if batch:
+            merged += process_batch(contacts, jobs, key, batch, dry_run, merged)
+        checkpoint = {}
+    if not dry_run:
+        # finished: the next run starts a full pass
+        jobs.delete_one(query={"_id": JOB_ID})
+    sys.stderr.write("%s %d duplicates in %.1fs\n" % (
+        "would merge" if dry_run else "merged", merged, time.time() - started))
+
+
+def process_batch(contacts, jobs, key, batch, dry_run, merged_so_far):
+    plans = plan_merges(contacts, batch)
+    duplicates = sum(len(plan[1]) for plan in plans)
+    if dry_run:
+        for survivor, duplicate_ids, facebook_ids in plans:
+            log("%s: keep %s, merge %s (facebook_ids %s)" % (
+                key, survivor, ", ".join(str(i) for i in duplicate_ids), ", ".join(facebook_ids)))
+        return duplicates
+    if plans:
+        apply_merges(contacts, plans)
+    jobs.update_one(query={"_id": JOB_ID},
+                    update={"$set": {"key": key, "last_value": batch[-1]["_id"],
+                                     "merged": merged_so_far + duplicates,
+                                     "updated_at": datetime.datetime.utcnow()}},
+                    upsert=True)
+    sys.stderr.write("%s up to %r: %d duplicates merged\n" % (key, batch[-1]["_id"], merged_so_far + duplicates))
+    return duplicates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="log the merge plans, write nothing")
+    parser.add_argument("--batch-size", type=int, default=500, help="groups per bulk write")
+    parser.add_argument("--pause-ms", type=int, default=0, help="sleep between batches to limit load")
+    parser.add_argument("--restart", action="store_true", help="ignore the saved checkpoint")
+    parser.add_argument("--facebook-id", action="store_true",
+                        help="fold contacts sharing a facebook_id and make the facebook_id index unique")
+    args = parser.parse_args()
+
+    from db.mongo import mongo_jobs
+    from db.contacts import mongo_contacts
+    mongo_contacts.ensure_indexes()
+    if args.facebook_id:
+        return fold_same_facebook_id(mongo_contacts, args.dry_run, args.batch_size)
+    if args.restart and not args.dry_run:
+        mongo_jobs.delete_one(query={"_id": JOB_ID})
+    run(mongo_contacts, mongo_jobs, args.batch_size, args.dry_run, args.pause_ms / 1000.0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+load_harness.py
+
+Webhook throughput of one gunicorn worker per worker mode (gunicorn.conf.py).
+Runs gunicorn with each mode against a local stub of the Send API, which adds
+--api-ms of latency per reply like the real Graph API round trip, posts text
+messages from --clients concurrent clients and reports requests/s per worker.
+With the Send API call dominating a request, a sync worker serves one request
+per round trip and gthread / gevent workers overlap them.
+
+Needs a local scratch MongoDB (contacts and outbox documents are written):
+
+    MONGO_URI=mongodb://localhost:27017/contact_bot_harness python -m tools.load_harness \
+        --modes sync:1,gthread:8,gthread:32,gevent:64
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import subprocess
+import requests
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StubSendApi(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    delay = 0.05
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.delay)
+        self.reply(b'{"recipient_id": "1", "message_id": "m"}')
+
+    def do_HEAD(self):
+        self.reply(b"")
+
+    def reply(self, body):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def free_port():
+    probe = socket.socket()
+    probe.bind(("127.0.0.1", 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+
+def webhook_body(sender_id, n):
+    return json.dumps({"object": "page", "entry": [{"id": "harness-page", "messaging": [{
+        "sender": {"id": sender_id}, "recipient": {"id": "harness-page"}, "timestamp": int(time.time() * 1000),
+        "message": {"mid": "mid.%s.%d" % (sender_id, n),
+                    "text": "I'm %s@example.com, call 0988 %03d %03d" % (sender_id, n % 1000, n // 1000 % 1000)}}]}]})
+
+
+def client(base_url, index, stop, results):
+    session = requests.Session()
+    sender_id = "harness-%d" % index
+    n = 0
+    while not stop.is_set():
+        n += 1
+        started = time.time()
+        try:
+            ok = session.post(base_url, data=webhook_body(sender_id, n),
+                              headers={"Content-Type": "application/json"}, timeout=30).status_code == 200
+        except requests.RequestException:
+            ok = False
+        results.append((ok, time.time() - started))
+
+
+def wait_ready(base_url, process, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline and process.poll() is None:
+        try:
+            if requests.get(base_url + "ready", timeout=1).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def run(worker_class, concurrency, api_url, args):
+    port = free_port()
+    base_url = "http://127.0.0.1:%d/" % port
+    env = dict(os.environ, WEB_WORKER_CLASS=worker_class, WEB_CONCURRENCY=str(args.workers),
+               WEB_THREADS=str(concurrency), WEB_WORKER_CONNECTIONS=str(concurrency),
+               GRAPH_API_URL=api_url, GRAPH_API_POOL_SIZE=str(concurrency),
+               PAGE_ACCESS_TOKEN="harness", PROCESSING_MODE="inline", ARCHIVE_DIR="")
+    process = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+                                "-b", "127.0.0.1:%d" % port, "app:app"], cwd=ROOT, env=env)
+    try:
+        if not wait_ready(base_url, process, args.ready_timeout):
+            print("%-8s %5d  worker not ready" % (worker_class, concurrency))
+            return False
+        results, stop = [], threading.Event()
+        clients = [threading.Thread(target=client, args=(base_url, i, stop, results))
+                   for i in range(args.clients)]
+        for thread in clients:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in clients:
+            thread.join()
+    finally:
+        process.terminate()
+        process.wait()
+
+    latencies = sorted(elapsed for ok, elapsed in results if ok)
+    errors = len(results) - len(latencies)
+    if not latencies:
+        print("%-8s %5d  no successful requests, %d errors" % (worker_class, concurrency, errors))
+        return False
+    print("%-8s %5d %10.1f %10.1f %8.0f %8.0f %7d" % (
+        worker_class, concurrency, len(latencies) / args.seconds, len(latencies) / args.seconds / args.workers,
+        latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000, errors))
+    return errors == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="sync:1,gthread:8,gthread:32,gevent:64",
+                        help="comma separated worker_class:threads (or gevent connections)")
+    parser.add_argument("--workers", type=int, default=1, help="gunicorn worker processes")
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--api-ms", type=float, default=50, help="simulated Send API latency")
+    parser.add_argument("--ready-timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    uri = os.environ.get("MONGO_URI", "")
+    if "localhost" not in uri and "127.0.0.1" not in uri:
+        sys.exit("refusing to run: MONGO_URI must point to a local scratch database")
+
+    StubSendApi.delay = args.api_ms / 1000.0
+    server = StubServer(("127.0.0.1", 0), StubSendApi)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = "http://127.0.0.1:%d/v2.6/me/messages" % server.server_address[1]
+
+    print("%-8s %5s %10s %10s %8s %8s %7s" % ("class", "conc", "req/s", "per worker", "p50 ms", "p99 ms", "errors"))
+    ok = True
+    for mode in args.modes.split(","):
+        worker_class, concurrency = mode.split(":")
+        if worker_class == "gevent":
+            try:
+                import gevent  # noqa: F401
+            except ImportError:
+                print("%-8s %5s  skipped, gevent is not installed" % (worker_class, concurrency))
+                continue
+        ok = run(worker_class, int(concurrency), api_url, args) and ok
+    server.shutdown()
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+partition_harness.py
+
+Local harness for partitioned processing (partitioning.py). Enqueues events for
+a set of senders, runs 1, 2, 4... partition workers in separate processes and
+reports throughput, then checks that every sender's events were handled in
+order and never concurrently. With --churn a worker is killed half way and a
+new one joins, so the rebalance path is exercised too.
+
+Needs a local scratch MongoDB, the harness wipes the events/partitions/workers
+collections:
+
+    MONGO_URI=mongodb://localhost:27017/contact_bot_harness python -m tools.partition_harness
+"""
+
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+
+def worker_main(worker_id, partition_count, lease_seconds, work_ms, results, stop):
+    from partitioning import PartitionConsumer
+
+    def handle_event(sender_id, message, deadline):
+        started = time.time()
+        time.sleep(work_ms / 1000.0)
+        results.put((sender_id, message["n"], worker_id, started, time.time()))
+
+    consumer = PartitionConsumer(handle_event, worker_id=worker_id,
+                                 partition_count=partition_count, lease_seconds=lease_seconds)
+    consumer.run(poll_seconds=0.05, should_stop=stop.is_set)
+
+
+def check_ordering(records):
+    """ rtype: (out_of_order, overlapping, duplicates) counts over all senders
+    """
+    by_sender = {}
+    for record in records:
+        by_sender.setdefault(record[0], []).append(record)
+    out_of_order = overlapping = duplicates = 0
+    for sender_records in by_sender.values():
+        sender_records.sort(key=lambda record: record[3])
+        seen = set()
+        last_n, last_end = 0, 0.0
+        for sender_id, n, worker_id, started, ended in sender_records:
+            if n in seen:
+                # redelivered after a crash between handling and committing: at-least-once
+                duplicates += 1
+            elif n != last_n + 1:
+                out_of_order += 1
+            if started < last_end:
+                overlapping += 1
+            seen.add(n)
+            last_n, last_end = max(last_n, n), ended
+    return out_of_order, overlapping, duplicates
+
+
+def run(worker_count, args):
+    from db.mongo import mongo_events, mongo_partitions, mongo_workers
+    from partitioning import EventQueue
+
+    for collection in (mongo_events, mongo_partitions, mongo_workers):
+        collection.delete_many(query={})
+    queue = EventQueue(partition_count=args.partitions)
+    queue.ensure_indexes()
+    counters = {}
+    for i in range(args.events):
+        sender_id = "sender-%d" % (i % args.senders)
+        counters[sender_id] = counters.get(sender_id, 0) + 1
+        queue.enqueue(sender_id, {"n": counters[sender_id]})
+
+    context = multiprocessing.get_context("spawn")
+    results, stop = context.Queue(), context.Event()
+
+    def start_worker(worker_id):
+        process = context.Process(target=worker_main,
+                                  args=(worker_id, args.partitions, args.lease_seconds,
+                                        args.work_ms, results, stop))
+        process.start()
+        return process
+
+    processes = [start_worker("worker-%d" % i) for i in range(worker_count)]
+    records, started, churned = [], None, False
+    deadline = time.time() + args.timeout
+    while len(records) < args.events and time.time() < deadline:
+        try:
+            record = results.get(timeout=1)
+        except Empty:
+            continue
+        started = started or record[3]
+        records.append(record)
+        if args.churn and not churned and len(records) >= args.events // 2:
+            churned = True
+            processes[0].terminate()
+            processes.append(start_worker("worker-joined"))
+    elapsed = (records[-1][4] - started) if records else 0.0
+    stop.set()
+    for process in processes:
+        process.join(timeout=args.lease_seconds + 5)
+
+    out_of_order, overlapping, duplicates = check_ordering(records)
+    print("workers=%d handled=%d/%d elapsed=%.2fs throughput=%.1f events/s "
+          "out_of_order=%d overlapping=%d duplicates=%d" % (
+              worker_count, len(records), args.events, elapsed,
+              len(records) / elapsed if elapsed else 0.0, out_of_order, overlapping, duplicates))
+    return out_of_order == 0 and overlapping == 0 and len(records) >= args.events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--senders", type=int, default=100)
+    parser.add_argument("--partitions", type=int, default=16)
+    parser.add_argument("--workers", default="1,2,4", help="comma separated worker counts to run")
+    parser.add_argument("--work-ms", type=float, default=5.0, help="simulated handling time per event")
+    parser.add_argument("--lease-seconds", type=int, default=5)
+    parser.add_argument("--timeout", type=int, default=300)
+    parser.add_argument("--churn", action="store_true", help="kill a worker half way and add a new one")
+    args = parser.parse_args()
+
+    uri = os.environ.get("MONGO_URI", "")
+    if "localhost" not in uri and "127.0.0.1" not in uri:
+        sys.exit("refusing to run: MONGO_URI must point to a local scratch database")
+
+    ok = True
+    for worker_count in [int(count) for count in args.workers.split(",")]:
+        ok = run(worker_count, args) and ok
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+replay_archive.py
+
+Replay webhook bodies from the event archive (event_archive.py).
+
+    # decode + build messages only, as fast as possible: measures the read path
+    python -m tools.replay_archive /tmp/event-archive --mode bench
+
+    # run a time range / one sender through the pages' handlers; replies are printed,
+    # never sent
+    python -m tools.replay_archive /tmp/event-archive --mode dispatch \
+        --from 2026-10-19T08:00 --to 2026-10-19T09:00 --sender 1254459154682919 --rate 50
+
+Dispatch mode builds its own dry-run dispatchers (MessageDispatcher with
+dry_run=True) rather than app.py's: handlers store nothing, nothing is counted in
+contact_stats and attachments are answered like unknown messages instead of being
+downloaded. Mongo isn't used.
+"""
+
+import sys
+import json
+import time
+import calendar
+import datetime
+import argparse
+from event_archive import ArchiveReader
+from messages import from_messaging_event
+
+
+def parse_time(value):
+    """ Epoch milliseconds, or an ISO date/time in UTC
+    """
+    if value is None:
+        return None
+    if value.isdigit():
+        return int(value)
+    for fmt in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d"):
+        try:
+            parsed = datetime.datetime.strptime(value, fmt)
+            return calendar.timegm(parsed.timetuple()) * 1000
+        except ValueError:
+            pass
+    raise SystemExit("can't parse time %r" % value)
+
+
+def messages_of(body):
+    data = json.loads(body.decode("utf-8"))
+    if data.get("object") != "page":
+        return
+    for entry in data.get("entry", []):
+        for messaging_event in entry.get("messaging", []):
+            message = from_messaging_event(messaging_event, page_id=entry.get("id"))
+            if message is not None:
+                yield message
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory")
+    parser.add_argument("--mode", choices=["bench", "dispatch"], default="bench")
+    parser.add_argument("--from", dest="start", help="epoch ms or UTC ISO time")
+    parser.add_argument("--to", dest="end", help="epoch ms or UTC ISO time")
+    parser.add_argument("--sender", help="only events from this sender id")
+    parser.add_argument("--rate", type=float, default=0, help="max bodies per second, 0 = unlimited")
+    args = parser.parse_args()
+
+    handle = None
+    if args.mode == "dispatch":
+        from application import pages_config
+        from pages import PageRegistry
+        from message_dispatcher import MessageDispatcher
+        # no senders, no stats, no attachment pipeline
+        pages = PageRegistry(pages_config, lambda page_id, access_token: None,
+                             lambda tasks_config_file, mongodb: MessageDispatcher(tasks_config_file, mongodb=mongodb,
+                                                                                  dry_run=True))
+
+        def handle(message):
+            page = pages.get(message.page_id)
+            if page is not None:
+                print("%s -> %r" % (message.sender_id, page.dispatcher.dispatch_and_process(message)))
+
+    reader = ArchiveReader(args.directory)
+    start_ms = parse_time(args.start) or 0
+    end_ms = parse_time(args.end) or 2 ** 62
+    started = time.time()
+    bodies = events = raw_bytes = 0
+    for ts_ms, senders, body in reader.read(start_ms, end_ms, args.sender):
+        bodies += 1
+        raw_bytes += len(body)
+        for message in messages_of(body):
+            if args.sender is not None and message.sender_id != args.sender:
+                continue
+            events += 1
+            if handle is not None:
+                handle(message)
+        if args.rate:
+            # pace against the wall clock rather than sleeping a fixed time per body
+            delay = started + bodies / args.rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+    elapsed = time.time() - started
+    sys.stderr.write("%d bodies, %d events, %.1f MB in %.2fs: %.0f bodies/s, %.0f events/s\n" % (
+        bodies, events, raw_bytes / 1e6, elapsed, bodies / elapsed if elapsed else 0,
+        events / elapsed if elapsed else 0))
+
+if __name__ == "__main__":
+    main()
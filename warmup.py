@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+warmup.py
+
+Warm-up run once per worker before it reports ready on GET /ready: opens the
+Mongo pools, exercises the handlers and extractor, and opens the Graph API
+connection pool, so the first users don't pay for it.
+
+Required steps that fail (Mongo not reachable yet...) are retried with
+exponential backoff until they succeed, so a worker started during an outage
+becomes ready once it is over instead of answering 503 for good.
+"""
+
+import time
+import threading
+from common.log_util import log
+
+
+class WarmUp:
+
+    def __init__(self, retry_base_seconds=1, retry_max_seconds=30):
+        self.lock = threading.Lock()
+        self.steps = []
+        self.ready = False
+        self.started_at = None
+        self.finished_at = None
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+
+    def record(self, name, seconds, ok=True, error=None, required=True):
+        """ Report a step, replacing the report of its previous attempt
+        """
+        with self.lock:
+            previous = [step for step in self.steps if step["step"] == name]
+            step = {"step": name, "ms": round(seconds * 1000, 1), "ok": ok, "required": required, "error": error,
+                    "attempts": previous[0]["attempts"] + 1 if previous else 1}
+            if previous:
+                self.steps[self.steps.index(previous[0])] = step
+            else:
+                self.steps.append(step)
+
+    def run_step(self, name, function, required):
+        """ rtype: True if the step succeeded
+        """
+        started = time.time()
+        try:
+            function()
+            self.record(name, time.time() - started, required=required)
+            return True
+        except Exception as e:
+            log("warm-up step %s failed: %r" % (name, e))
+            self.record(name, time.time() - started, ok=False, error=repr(e), required=required)
+            return False
+
+    def run(self, steps):
+        """ steps: list of (name, function, required). The worker is ready once every
+            required step succeeded, optional ones are only reported. Failed required
+            steps are retried, in order, until they all succeed.
+        """
+        self.started_at = time.time()
+        failed = [(name, function) for name, function, required in steps
+                  if not self.run_step(name, function, required) and required]
+        delay = self.retry_base_seconds
+        while failed:
+            log("warm-up: retrying %s in %.0fs" % (", ".join(name for name, function in failed), delay))
+            time.sleep(delay)
+            delay = min(delay * 2, self.retry_max_seconds)
+            failed = [(name, function) for name, function in failed if not self.run_step(name, function, True)]
+        self.finished_at = time.time()
+        self.ready = True
+        log("warm-up done in %.0fms, ready=True" % ((self.finished_at - self.started_at) * 1000))
+
+    def start(self, steps):
+        thread = threading.Thread(target=self.run, args=(steps,), name="warm-up")
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def report(self):
+        with self.lock:
+            return {
+                "ready": self.ready,
+                "running": self.started_at is not None and self.finished_at is None,
+                "total_ms": round((self.finished_at - self.started_at) * 1000, 1) if self.finished_at else None,
+                "steps": list(self.steps),
+            }